@@ -0,0 +1,177 @@
+"""
+A stand-in for a psycopg2 connection which answers from rows held in memory.
+
+It understands just enough of the SQL Models sends to return plausible rows,
+so a benchmark run against it measures the ORM's own overhead (building SQL,
+instrumentation, the pool, turning rows into instances) with no network or
+server time in the way.
+"""
+import re
+
+from collections import namedtuple
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+Column = namedtuple("Column", ["name", "type_code"])
+
+UPDATE_COLUMN = re.compile(r"(\w+) = %s")
+
+
+class FakeDatabase:
+    """
+    One table of rows keyed by its first column, shared by every connection.
+
+    columns => list of (name, type_code) pairs, type codes as in
+    cursor.description (e.g. 23 for int4, 25 for text).
+    """
+
+    def __init__(self, columns, rows=None):
+        self.description = [Column(name, type_code) for name, type_code in columns]
+        self.names = [name for name, _ in columns]
+        self.rows = {}
+        self._by_value = {}
+        for row in rows or []:
+            self.rows[row[0]] = tuple(row)
+
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+    def _index(self, position):
+        """Rows grouped by the value of one column, built on first use."""
+        index = self._by_value.get(position)
+        if index is None:
+            index = {}
+            for row in self.rows.values():
+                index.setdefault(row[position], []).append(row)
+            self._by_value[position] = index
+        return index
+
+
+    def _write(self, row):
+        self.rows[row[0]] = row
+        self._by_value = {}
+
+
+    def respond(self, SQL, params, mogrified):
+        """The rows a real server would return for this statement."""
+        statement = " ".join(SQL.split())
+
+        if statement.startswith("INSERT"):
+            written = mogrified if mogrified else [params]
+            for row in written: self._write(tuple(row))
+            return [tuple(row) for row in written]
+
+        if statement.startswith("UPDATE"):
+            key = params[-1]
+            row = self.rows.get(key)
+            if row is None: return []
+
+            changes = dict(zip(UPDATE_COLUMN.findall(statement.split(" WHERE ")[0]), params))
+            row = tuple(changes.get(name, value) for name, value in zip(self.names, row))
+            self._write(row)
+            return [row]
+
+        if statement.startswith("DELETE"):
+            self.rows.pop(params[0], None)
+            self._by_value = {}
+            return []
+
+        if "LIMIT 0" in statement: return []
+        if statement.startswith("SELECT EXISTS"): return [(True, )]
+        if statement.startswith("SELECT COUNT"): return [(len(self.rows), )]
+
+        if re.search(r"WHERE \w+ IN \(", statement):
+            return [self.rows[key] for key in params if key in self.rows]
+
+        match = re.search(r"WHERE (\w+)\s+(?:I?LIKE|=) %s", statement)
+        if match is None: return list(self.rows.values())
+
+        position = self.names.index(match.group(1))
+        if position == 0:
+            row = self.rows.get(params[0])
+            return [] if row is None else [row]
+
+        if "LIKE" in statement:
+            needle = params[0].strip("%").lower()
+            return [row for row in self.rows.values() if needle in str(row[position]).lower()]
+
+        return list(self._index(position).get(params[0], []))
+
+
+class FakeCursor:
+
+    def __init__(self, conn, name=None):
+        self.connection = conn
+        self.name = name
+        self.itersize = 2000
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+        self._position = 0
+        self._mogrified = []
+
+
+    def __enter__(self): return self
+    def __exit__(self, *args): self.close()
+    def close(self): self._rows = []
+
+
+    def mogrify(self, template, args):
+        # execute_values joins these into one statement, the fake keeps the rows
+        self._mogrified.append(args)
+        return b"(?)"
+
+
+    def execute(self, SQL, params=None):
+        if isinstance(SQL, bytes): SQL = SQL.decode()
+
+        self._rows = self.connection.database.respond(SQL, params, self._mogrified)
+        self._mogrified = []
+        self._position = 0
+        self.description = self.connection.database.description
+        self.rowcount = len(self._rows)
+
+
+    def fetchone(self):
+        if self._position >= len(self._rows): return None
+        self._position += 1
+        return self._rows[self._position - 1]
+
+
+    def fetchmany(self, size=None):
+        if size is None: size = self.itersize
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+
+    def __iter__(self):
+        while self._position < len(self._rows):
+            yield self.fetchone()
+
+
+class FakeConnection:
+
+    encoding = "UTF8"
+
+    def __init__(self, database):
+        self.database = database
+        self.closed = 0
+
+
+    def cursor(self, name=None):
+        return FakeCursor(self, name=name)
+
+
+    def get_transaction_status(self): return TRANSACTION_STATUS_IDLE
+    def commit(self): pass
+    def rollback(self): pass
+    def close(self): self.closed = 1
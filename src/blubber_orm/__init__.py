@@ -1,5 +1,4 @@
-import os
-from .models import Models
+from .models import Models, AsyncModels, ModelCache, QueryRecorder
 
 #WARNING: these functions will edit whichever DB is linked in the environment...
 
@@ -7,8 +6,9 @@ def get_blubber():
     """
     Get an instance of the database connection for custom uses.
 
-    This is an object which contains the database connection, `.connection`.
-    For the driver cursor, use connection.conn.cursor() which returns a `Cursor` instance.
+    This is an object which contains the database connection pool, `.pool`.
+    Borrow a connection with `with blubber.connection() as conn:`, and for the
+    driver cursor use conn.cursor() which returns a `Cursor` instance.
     """
     from .models._conn import Blubber
     return Blubber.get_instance()
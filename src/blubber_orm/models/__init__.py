@@ -1,2 +1,6 @@
 from ._base import Models
+from ._async import AsyncModels
+from ._cache import ModelCache
+from ._query import Query
+from ._advisor import QueryRecorder
 from ._base import logger
@@ -0,0 +1,294 @@
+import re
+import json
+import logging
+import threading
+
+logger = logging.getLogger('blubber-orm')
+
+# "column <op>" or "(column, ...) <op>" in a WHERE clause as Models and Query
+# generate it, with the "NOT (" of a negated condition if there is one
+CONDITION = re.compile(
+    r"(\bNOT\s*\(\s*)?(\([A-Za-z_][A-Za-z0-9_\s,]*\)|\b[A-Za-z_][A-Za-z0-9_]*)\s*"
+    r"(<=|>=|<>|=|<|>|NOT\s+I?LIKE\b|I?LIKE\b|IS\s+NOT\b|IS\b|NOT\s+IN\b|IN\b)",
+    re.IGNORECASE
+)
+
+EQUALITY = "eq"
+RANGE = "range"
+PATTERN = "like"
+
+
+def normalize(sql):
+    """One line of SQL, so the same statement always gives the same shape."""
+    return " ".join(sql.split())
+
+
+def is_select(sql):
+    return sql.lstrip().upper().startswith("SELECT")
+
+
+def filter_columns(sql, table_columns):
+    """
+    The (column, kind) pairs the statement filters on, in order, where kind is
+    "eq", "range" or "like". Conditions no index can serve (<>, NOT LIKE, IS NOT,
+    NOT (...)) are left out, and so is anything which isn't a column of the
+    table. With `table_columns` None, every name is taken for a column.
+    """
+    parts = re.split(r"\bWHERE\b", sql, maxsplit=1, flags=re.IGNORECASE)
+    if len(parts) == 1: return []
+    conds = parts[1]
+
+    columns = {}
+    for negated, names, operator in CONDITION.findall(conds):
+        if negated: continue
+
+        operator = " ".join(operator.upper().split())
+        if operator in ["=", "IS", "IN"]: kind = EQUALITY
+        elif operator in ["<", ">", "<=", ">="]: kind = RANGE
+        elif operator in ["LIKE", "ILIKE"]: kind = PATTERN
+        else: continue
+
+        for column in names.strip("()").split(","):
+            column = column.strip()
+            if table_columns is not None and column not in table_columns: continue
+            if column not in columns: columns[column] = kind
+    return list(columns.items())
+
+
+class QueryRecorder:
+    """
+    Aggregates the distinct query shapes run through Models: table, operation
+    and the columns filtered on, with the parameters left out. `filter({"a": 1})`
+    and `filter({"a": 2})` are one shape, and `filter({"a": 1, "b": 2})`
+    another. So are `get_batch` calls of any number of keys, whose IN lists
+    differ in length.
+
+        recorder = QueryRecorder()
+        recorder.start()
+        ...
+        recorder.save("shapes.json")
+
+    Each shape keeps its count, total and max time, and the statement of its
+    slowest run with, for SELECTs, its parameters, which `advise` replays under
+    EXPLAIN. The
+    parameters of writes (e.g. password hashes) are never kept. Then run:
+
+        python -m blubber_orm.versions.blubber_cli --func advise --shapes shapes.json
+    """
+
+    def __init__(self):
+        self._shapes = {}
+        self._lock = threading.Lock()
+        self._instrumentation = None
+
+
+    def start(self, instrumentation=None):
+        """Record every query timed by `instrumentation` (default Models')."""
+        if self._instrumentation is not None: return
+        if instrumentation is None:
+            from ._instrument import Instrumentation
+            instrumentation = Instrumentation.get_instance()
+
+        instrumentation.add_hook(after=self.record)
+        self._instrumentation = instrumentation
+
+
+    def stop(self):
+        if self._instrumentation is None: return
+        self._instrumentation.remove_hook(after=self.record)
+        self._instrumentation = None
+
+
+    def record(self, event):
+        if event.error is not None: return
+
+        table_name = getattr(event.model, "table_name", None)
+        sql = normalize(event.sql)
+        elapsed_ms = event.elapsed * 1000
+
+        # the model's columns if already loaded, never queried from a hook
+        columns = tuple(filter_columns(sql, getattr(event.model, "table_attributes", None)))
+        key = (table_name, event.operation, columns)
+
+        with self._lock:
+            shape = self._shapes.get(key)
+            if shape is None:
+                shape = self._shapes[key] = {
+                    "table": table_name,
+                    "operation": event.operation,
+                    "sql": sql,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "params": None
+                }
+
+            shape["count"] += 1
+            shape["total_ms"] += elapsed_ms
+            if elapsed_ms >= shape["max_ms"]:
+                shape["max_ms"] = elapsed_ms
+                shape["sql"] = sql
+                if is_select(sql): shape["params"] = event.params
+
+
+    def shapes(self):
+        """Every shape recorded, the most total time first."""
+        with self._lock:
+            shapes = [dict(shape) for shape in self._shapes.values()]
+        return sorted(shapes, key=lambda shape: shape["total_ms"], reverse=True)
+
+
+    def reset(self):
+        with self._lock:
+            self._shapes = {}
+
+
+    def save(self, path):
+        # parameters are only replayed by EXPLAIN: dates and such go as text,
+        # which Postgres casts back to the column type.
+        with open(path, "w") as shapes_file:
+            json.dump(self.shapes(), shapes_file, default=str, indent=2)
+
+
+    @classmethod
+    def load(cls, path):
+        recorder = cls()
+        with open(path, "r") as shapes_file:
+            for shape in json.load(shapes_file):
+                columns = tuple(filter_columns(shape["sql"], None))
+                recorder._shapes[(shape["table"], shape["operation"], columns)] = shape
+        return recorder
+
+
+def explain(sql, params, connection, analyze=True):
+    """
+    The JSON plan of a statement. With `analyze`, SELECTs are run to get actual
+    rows and buffers; nothing is committed either way.
+    """
+    analyze = analyze and is_select(sql)
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+
+    with connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"EXPLAIN ({options}) {sql}", params)
+                (plan, ), = cursor.fetchall()
+        finally:
+            conn.rollback()
+
+    if isinstance(plan, str): plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def sequential_scans(plan):
+    """The Seq Scan nodes of a plan, with their rows and buffers."""
+    scans = []
+    if plan.get("Node Type") == "Seq Scan":
+        scans.append({
+            "table": plan.get("Relation Name"),
+            "filter": plan.get("Filter"),
+            "rows": plan.get("Actual Rows", plan.get("Plan Rows")),
+            "rows_removed": plan.get("Rows Removed by Filter"),
+            "buffers": plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0) if "Shared Hit Blocks" in plan else None,
+        })
+
+    for child in plan.get("Plans", []):
+        scans.extend(sequential_scans(child))
+    return scans
+
+
+def suggest_index(table, columns, indexes):
+    """
+    (CREATE INDEX statement, None) for the filter columns of a shape, or
+    (None, name) if an index of the same type on the same leading columns
+    already exists.
+
+    B-tree on the equality columns then the first range column; a pattern
+    match (LIKE '%term%') alone gets a trigram GIN index instead, which only a
+    GIN or GiST index with a trigram operator class can serve.
+    """
+    equality = [column for column, kind in columns if kind == EQUALITY]
+    ranges = [column for column, kind in columns if kind == RANGE]
+    patterns = [column for column, kind in columns if kind == PATTERN]
+
+    if equality or ranges:
+        key = equality + ranges[:1]
+        SQL = f"CREATE INDEX ON {table} ({', '.join(key)});"
+        serves = lambda method, opclasses: method == "btree"
+    elif patterns:
+        key = patterns[:1]
+        SQL = f"CREATE INDEX ON {table} USING GIN ({key[0]} gin_trgm_ops);"
+        serves = lambda method, opclasses: method in ["gin", "gist"] and opclasses[:1] in [("gin_trgm_ops", ), ("gist_trgm_ops", )]
+    else:
+        return None, None
+
+    for name, index_columns, _, method, opclasses in indexes:
+        if not serves(method, opclasses): continue
+        if set(index_columns[:len(key)]) == set(key): return None, name
+    return SQL, None
+
+
+def advise(shapes, connection, catalog, top=10, analyze=True):
+    """
+    EXPLAIN the `top` SELECT shapes by total time and report the ones which scan a
+    table sequentially, with an index suggestion checked against the table's
+    existing indexes.
+
+    connection => a callable returning a context manager which yields a
+    psycopg2 connection, e.g. Blubber.connection.
+
+    catalog => the SchemaCatalog, for the tables' columns and indexes.
+    """
+    # only SELECTs keep their parameters; Models writes filter on primary keys
+    shapes = [shape for shape in shapes if is_select(shape["sql"])]
+
+    report = []
+    for shape in shapes[:top]:
+        table = catalog.get(shape["table"], connection) if shape["table"] else None
+        if table is None: continue
+
+        try:
+            plan = explain(shape["sql"], shape["params"], connection, analyze=analyze)
+        except Exception as e:
+            logger.warning("Could not explain %s.%s: %s", shape["table"], shape["operation"], e)
+            continue
+
+        scans = [scan for scan in sequential_scans(plan) if scan["table"] == table.name]
+        if len(scans) == 0: continue
+
+        columns = filter_columns(shape["sql"], table.column_set)
+        suggestion, existing_index = suggest_index(table.name, columns, table.indexes)
+
+        report.append({
+            "table": shape["table"],
+            "operation": shape["operation"],
+            "sql": shape["sql"],
+            "count": shape["count"],
+            "total_ms": shape["total_ms"],
+            "mean_ms": shape["total_ms"] / shape["count"] if shape["count"] else None,
+            "columns": columns,
+            "seq_scans": scans,
+            "suggestion": suggestion,
+            "existing_index": existing_index
+        })
+    return report
+
+
+def format_report(report):
+    if len(report) == 0: return "No sequential scans found in the recorded query shapes."
+
+    lines = []
+    for entry in report:
+        lines.append(f"{entry['table']}.{entry['operation']}: {entry['count']} calls, {entry['total_ms']:.1f} ms total, {entry['mean_ms']:.2f} ms mean")
+        lines.append(f"    {entry['sql']}")
+        for scan in entry["seq_scans"]:
+            lines.append(f"    Seq Scan on {scan['table']}: {scan['rows']} rows, {scan['rows_removed']} removed by filter, {scan['buffers']} buffers")
+
+        if entry["suggestion"]:
+            lines.append(f"    suggest: {entry['suggestion']}")
+        elif entry["existing_index"]:
+            lines.append(f"    index {entry['existing_index']} exists but was not used (small table or low selectivity?)")
+        else:
+            lines.append("    no indexable filter columns")
+        lines.append("")
+    return "\n".join(lines)
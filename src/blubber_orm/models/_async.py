@@ -0,0 +1,491 @@
+import logging
+
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from ._base import Models, forget_schema
+from ._catalog import SchemaCatalog
+from ._conn import Blubber, AsyncBlubber
+from ._instrument import Instrumentation
+from ._loader import AsyncModelLoader
+from ._utils import format_query_statement, format_query_data, format_batch_query, match_batch_keys
+
+logger = logging.getLogger('blubber-orm')
+
+# model class -> AsyncModelLoader, set while inside AsyncModels.batching()
+_batch_loaders = ContextVar("blubber_batch_loaders", default=None)
+
+
+class AsyncModels:
+    """
+    The asyncio counterpart of Models. Child classes are declared exactly like
+    Models, with `table_name`, `table_primaries` and `sensitive_attributes`, but
+    every query is a coroutine which runs on the AsyncBlubber connection pool:
+
+        class User(AsyncModels):
+            table_name = "users"
+            table_primaries = ["id"]
+
+        user = await User.get({"id": 1})
+        async for user in User.iter_filter({"is_blocked": False}):
+            ...
+
+    NOTE: like Models, this class must be inherited, not used directly.
+    """
+
+    __slots__ = ("_blubber_row", "_blubber_names")
+
+    table_name = None
+    table_primaries = None
+    table_attributes = None
+    sensitive_attributes = None
+
+    db = AsyncBlubber.get_instance()
+    instrumentation = Instrumentation.get_instance()
+    catalog = SchemaCatalog.get_instance()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.__dict__.get("table_name") is not None:
+            AsyncModels.catalog.register(cls.table_name)
+
+    @classmethod
+    async def insert(cls, attributes):
+        from psycopg.errors import UniqueViolation
+
+        cols = ", ".join(attributes.keys())
+        values = ", ".join(["%s"] * len(attributes))
+
+        SQL = f"""
+            INSERT
+            INTO {cls.table_name} ({cols})
+            VALUES ({values})
+            RETURNING *;
+            """
+
+        data = tuple(attributes.values())
+
+        async with AsyncModels.db.connection() as conn:
+            async with conn.cursor() as cursor:
+
+                try:
+                    await cls._execute(cursor, "insert", SQL, data)
+
+                except UniqueViolation as e:
+                    logger.error(e, exc_info=True)
+                    await conn.rollback()
+                    return None
+
+                result = await cursor.fetchone()
+                await conn.commit()
+
+                _instance_dict = Blubber.format_to_dict(cursor, result)
+
+        _instance = cls._new(_instance_dict)
+        loader = cls._batch_loader()
+        if loader is not None: loader.prime(_instance_dict, _instance)
+
+        return _instance
+
+
+    @classmethod
+    async def upsert(cls, attributes):
+        for pkey in cls.table_primaries:
+            assert attributes.get(pkey) is not None, "Upsert needs every primary key."
+
+        cols = ", ".join(attributes.keys())
+        values = ", ".join(["%s"] * len(attributes))
+        pkey = ", ".join(cls.table_primaries)
+
+        updates = [f"{col} = EXCLUDED.{col}" for col in attributes.keys() if col not in cls.table_primaries]
+        if len(updates) == 0: updates = [f"{cls.table_primaries[0]} = EXCLUDED.{cls.table_primaries[0]}"]
+        updates = ", ".join(updates)
+
+        SQL = f"""
+            INSERT
+            INTO {cls.table_name} ({cols})
+            VALUES ({values})
+            ON CONFLICT ({pkey}) DO UPDATE
+            SET {updates}
+            RETURNING *;
+            """
+
+        async with AsyncModels.db.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cls._execute(cursor, "upsert", SQL, tuple(attributes.values()))
+                result = await cursor.fetchone()
+                await conn.commit()
+
+                _instance_dict = Blubber.format_to_dict(cursor, result)
+
+        _instance = cls._new(_instance_dict)
+        loader = cls._batch_loader()
+        if loader is not None: loader.prime(_instance_dict, _instance)
+
+        return _instance
+
+
+    @classmethod
+    async def get(cls, pkeys):
+        assert isinstance(pkeys, dict)
+
+        loader = cls._batch_loader()
+        if loader is not None: return await loader.load(pkeys)
+
+        data = format_query_data(cls.table_primaries, pkeys)
+        conds = format_query_statement(cls.table_primaries, pkeys)
+
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name}
+            WHERE {conds};
+            """
+
+        async with AsyncModels.db.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cls._execute(cursor, "get", SQL, data)
+                result = await cursor.fetchone()
+
+                if result is None: return None
+
+                _instance_dict = Blubber.format_to_dict(cursor, result)
+
+        _instance = cls._new(_instance_dict)
+        return _instance
+
+
+    @classmethod
+    async def get_batch(cls, pkeys_list):
+        """
+        Get many rows by primary key(s) in one query. Returns a list in the same
+        order as `pkeys_list`, with None where no row matched.
+        """
+        assert isinstance(pkeys_list, list)
+        if len(pkeys_list) == 0: return []
+
+        conds, data, keys = format_batch_query(cls.table_primaries, pkeys_list)
+
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name}
+            WHERE {conds};
+            """
+
+        async with AsyncModels.db.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cls._execute(cursor, "get_batch", SQL, data)
+                results = await cursor.fetchall()
+
+                _instances = {}
+                for result in results:
+                    _instance_dict = Blubber.format_to_dict(cursor, result)
+                    _instance = cls._new(_instance_dict)
+                    _instances[format_query_data(cls.table_primaries, _instance_dict)] = _instance
+        return match_batch_keys(keys, _instances)
+
+
+    @staticmethod
+    @asynccontextmanager
+    async def batching():
+        """
+        Within this block, AsyncModels.get calls awaited in the same tick of the
+        event loop are coalesced into one get_batch query per model, e.g.
+
+            async with AsyncModels.batching():
+                users = await asyncio.gather(*[User.get({"id": i}) for i in ids])
+        """
+        token = _batch_loaders.set({})
+        try:
+            yield
+        finally:
+            _batch_loaders.reset(token)
+
+
+    @classmethod
+    def _batch_loader(cls):
+        loaders = _batch_loaders.get()
+        if loaders is None: return None
+        if cls not in loaders:
+            loaders[cls] = AsyncModelLoader(cls)
+        return loaders[cls]
+
+
+    @classmethod
+    async def set(cls, pkeys, changes):
+        assert isinstance(pkeys, dict)
+
+        set_data = tuple(changes.values())
+        set_conds = ", ".join([f"{col} = %s" for col in changes.keys()])
+
+        where_data = format_query_data(cls.table_primaries, pkeys)
+        where_conds = format_query_statement(cls.table_primaries, pkeys)
+
+        SQL = f"""
+            UPDATE {cls.table_name}
+            SET {set_conds}
+            WHERE {where_conds}
+            RETURNING *;
+            """
+
+        data = set_data + where_data
+
+        async with AsyncModels.db.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cls._execute(cursor, "set", SQL, data)
+                result = await cursor.fetchone()
+                await conn.commit()
+
+                if result is None: return None
+
+                _instance_dict = Blubber.format_to_dict(cursor, result)
+
+        _instance = cls._new(_instance_dict)
+        loader = cls._batch_loader()
+        if loader is not None: loader.prime(_instance_dict, _instance)
+
+        return _instance
+
+
+    @classmethod
+    async def delete(cls, pkeys):
+
+        data = format_query_data(cls.table_primaries, pkeys)
+        conds = format_query_statement(cls.table_primaries, pkeys)
+
+        SQL = f"""
+            DELETE
+            FROM {cls.table_name}
+            WHERE {conds};
+            """
+
+        async with AsyncModels.db.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cls._execute(cursor, "delete", SQL, data)
+
+            await conn.commit()
+
+        loader = cls._batch_loader()
+        if loader is not None: loader.clear(pkeys)
+
+
+    @classmethod
+    async def get_all(cls):
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name};
+            """
+
+        return await cls._fetch_all("get_all", SQL)
+
+
+    @classmethod
+    async def filter(cls, filters):
+        assert isinstance(filters, dict)
+        assert await cls.verify_attributes(list(filters.keys()))
+
+        data = tuple(filters.values())
+        conds = " AND ".join([f"{key} = %s" for key in filters.keys()])
+
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name}
+            WHERE {conds};
+            """
+
+        return await cls._fetch_all("filter", SQL, data)
+
+
+    # @notice: operates like AsyncModels.filter() but promises to only return 1 result
+    @classmethod
+    async def unique(cls, filters):
+        _instances = await cls.filter(filters)
+
+        if len(_instances) == 0: return None
+
+        assert len(_instances) == 1, "The set of filters applied are not unique to one row."
+
+        _instance, = _instances
+        return _instance
+
+
+    @classmethod
+    async def like(cls, column, search, where="any", case_sensitive=False):
+        assert await cls.verify_attributes([column]), "Error: invalid column name."
+        assert where in ["start", "any", "end"], "Error: invalid search location."
+
+        if where == "start": search = f"{search}%"
+        elif where == "any": search = f"%{search}%"
+        elif where == "end": search = f"%{search}"
+
+        if case_sensitive: like_command = 'LIKE'
+        else: like_command = 'ILIKE'
+
+        # FLAG: 'column' is directly formatted into the str... *ONLY* because of this check^
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name}
+            WHERE {column}
+            {like_command} %s
+            ESCAPE '';
+            """
+
+        return await cls._fetch_all("like", SQL, (search, ))
+
+
+    @classmethod
+    async def iter_all(cls, itersize=2000):
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name};
+            """
+
+        async for _instance in cls._iter("iter_all", SQL, None, itersize):
+            yield _instance
+
+
+    @classmethod
+    async def iter_filter(cls, filters, itersize=2000):
+        """
+        Like filter, but yields instances as they arrive from a server-side
+        cursor instead of building the whole list. Use with `async for`.
+        """
+        assert isinstance(filters, dict)
+        assert await cls.verify_attributes(list(filters.keys()))
+
+        data = tuple(filters.values())
+        conds = " AND ".join([f"{key} = %s" for key in filters.keys()])
+
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name}
+            WHERE {conds};
+            """
+
+        async for _instance in cls._iter("iter_filter", SQL, data, itersize):
+            yield _instance
+
+
+    @classmethod
+    async def does_row_exist(cls, attributes):
+        assert isinstance(attributes, dict)
+        assert await cls.verify_attributes(list(attributes.keys()))
+
+        data = tuple(attributes.values())
+        conds = format_query_statement(attributes.keys(), attributes)
+
+        SQL = f"""
+            SELECT EXISTS (
+                SELECT 1
+                FROM {cls.table_name}
+                WHERE {conds}
+            );
+            """
+
+        async with AsyncModels.db.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cls._execute(cursor, "does_row_exist", SQL, data)
+                result, = await cursor.fetchone()
+
+        return result
+
+
+    @classmethod
+    async def verify_attributes(cls, query_attributes: list) -> bool:
+        """
+        A controlled check to see if the list of query_attributes (input), is
+        actually a subset of the columns defined in the table.
+        """
+        columns = cls.__dict__.get("_column_set")
+        if columns is None:
+            columns = frozenset(await cls._get_attributes())
+            setattr(cls, "_column_set", columns)
+
+        for _attribute in query_attributes:
+            if _attribute not in columns:
+                logger.error(f"NotTableAttributeError, {_attribute} is not an attribute of {cls.table_name}.")
+                return False
+        return True
+
+
+    @classmethod
+    def reset_schema(cls):
+        """Forget the schema of every table, see Models.reset_schema."""
+        AsyncModels.catalog.clear()
+        forget_schema(AsyncModels)
+
+
+    @classmethod
+    async def _get_attributes(cls):
+        if cls.table_attributes is None:
+            table = await AsyncModels.catalog.get_async(cls.table_name, AsyncModels.db.connection)
+            if table is None:
+                raise Exception(f"SchemaError: table {cls.table_name} was not found in the database.")
+
+            cls.table_attributes = list(table.columns)
+            cls._schema_loaded = True
+
+            logger.debug("Table attributes are initialized as: %s", cls.table_attributes)
+        return cls.table_attributes
+
+
+    @classmethod
+    async def _execute(cls, cursor, operation, SQL, data=None):
+        with AsyncModels.instrumentation.track(cls, operation, SQL, data) as event:
+            await cursor.execute(SQL, data)
+            event.rowcount = cursor.rowcount
+
+
+    @classmethod
+    async def _fetch_all(cls, operation, SQL, data=None):
+        async with AsyncModels.db.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cls._execute(cursor, operation, SQL, data)
+                results = await cursor.fetchall()
+
+                _instances = []
+                for result in results:
+                    _instance_dict = Blubber.format_to_dict(cursor, result)
+                    _instance = cls._new(_instance_dict)
+                    _instances.append(_instance)
+        return _instances
+
+
+    @classmethod
+    async def _iter(cls, operation, SQL, data, itersize):
+        # a server-side cursor needs its own transaction, so it does not share
+        # the task's connection with other queries issued while iterating.
+        pool = await AsyncModels.db.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor(name=f"blubber_{cls.table_name}_iter") as cursor:
+                cursor.itersize = itersize
+                await cls._execute(cursor, operation, SQL, data)
+                async for result in cursor:
+                    _instance_dict = Blubber.format_to_dict(cursor, result)
+                    yield cls._new(_instance_dict)
+
+
+    async def save(self):
+        """Write the columns changed since this instance was loaded, see Models.save."""
+        pkeys, changes = self._changes(await self._get_attributes())
+        if len(changes) == 0: return False
+
+        _instance = await type(self).set(pkeys, changes)
+        if _instance is None: return False
+
+        self._refresh(_instance)
+        return True
+
+
+    # same serialisation and change tracking as Models, shared so both stay in sync
+    _new = classmethod(Models._new.__func__)
+    _state = Models._state
+    _refresh = Models._refresh
+    _loaded = Models._loaded
+    _changes = Models._changes
+
+    def to_dict(self, serializable=True):
+        return Models.to_dict(self, serializable)
+
+
+    def __repr__(self): return f"<Blubber Table: {self.table_name}>"
+    def __eq__(self, other): return self._state() == other._state()
@@ -1,16 +1,46 @@
+import copy
 import json
 import logging
 import psycopg2
+import psycopg2.extras
 
-from datetime import datetime, date, time
 from abc import ABC, abstractmethod
 
 from ._conn import Blubber
-from ._utils import format_query_statement, format_query_data
+from ._cache import identity_map, _identity_map
+from ._catalog import SchemaCatalog
+from ._columnar import fetch_columns
+from ._copy import export, load
+from ._instrument import Instrumentation
+from ._loader import ModelLoader
+from ._query import Query
+from ._session import _session
+from ._serialize import serializer_for, remember_types, dump_json_many
+from ._utils import format_query_statement, format_query_data, format_batch_query, match_batch_keys
+from ._utils import encode_page_token, decode_page_token
 
 logger = logging.getLogger('blubber-orm')
 logger.addHandler(logging.NullHandler())
 
+# what models derive from the schema, dropped by reset_schema
+SCHEMA_ATTRIBUTES = ["_column_set", "_column_types", "_serializers", "_row_factories"]
+
+
+def forget_schema(base):
+    """Drop the schema cached on `base` and all of its subclasses."""
+    models = [base]
+    while models:
+        model = models.pop()
+        models.extend(model.__subclasses__())
+
+        for attribute in SCHEMA_ATTRIBUTES:
+            if attribute in model.__dict__: delattr(model, attribute)
+        # columns loaded from the catalog, not declared by the model
+        if model.__dict__.get("_schema_loaded"):
+            model.table_attributes = None
+            del model._schema_loaded
+
+
 class AbstractModels(ABC):
     """
     AbstractModels defines the basic functions that each of the Models should
@@ -31,15 +61,45 @@ class AbstractModels(ABC):
     table_primaries => defines the primary key(s) of the modeled table. Class-level
     attribute.
 
-    db => Blubber instance which stores database connection and cursor for SQL scripts.
+    cache => an optional ModelCache of instances keyed by primary key(s), which
+    Models.get reads through. Class-level attribute, None disables caching.
+
+    db => Blubber instance which stores the database connection pool. Borrow a
+    connection with `db.connection()` for SQL scripts.
+
+    instrumentation => Instrumentation instance which times every query and
+    runs the registered query hooks.
+
+    catalog => SchemaCatalog instance which loads the columns of every model's
+    table at once, and optionally caches them on disk.
+
+    search_columns => columns Models.search is meant for, mapped to the search
+    modes ("fts", "trigram") to build GIN indexes for, e.g. {"name": ["fts"]}.
+    See `create_search_indexes`. Class-level attribute.
+
+    search_config => Postgres text search configuration used by "fts" searches
+    and their indexes. Class-level attribute.
     """
 
+    __slots__ = ()
+
     table_name = None
     table_primaries = None
     table_attributes = None
     sensitive_attributes = None
+    cache = None
+    search_columns = None
+    search_config = "english"
 
     db = Blubber.get_instance()
+    instrumentation = Instrumentation.get_instance()
+    catalog = SchemaCatalog.get_instance()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # known tables are introspected together, see SchemaCatalog
+        if cls.__dict__.get("table_name") is not None:
+            AbstractModels.catalog.register(cls.table_name)
 
     @classmethod
     @abstractmethod
@@ -64,9 +124,10 @@ class AbstractModels(ABC):
 
     @classmethod
     @abstractmethod
-    def get_all(cls) -> list:
+    def get_all(cls, as_=None) -> list:
         """
-        Get all rows from this table.
+        Get all rows from this table. With `as_="columns"` or `as_="numpy"` the
+        rows come back column-oriented instead of as instances.
         """
 
     @classmethod
@@ -74,16 +135,16 @@ class AbstractModels(ABC):
     def set(cls, pkeys: dict, attributes: dict):
         """
         Edit data in a particular row by passing its primary key(s) and the changes
-        in a dictionary.
+        in a dictionary. Returns the updated row, or None if no row matched.
         """
 
     @classmethod
     @abstractmethod
-    def filter(cls, filters: dict) -> list:
+    def filter(cls, filters: dict, as_=None) -> list:
         """
         Pass the filter(s) in a dictionary where the keys are the columns on which
         to filter and the values are the requirements for those columns. Should
-        not be redefined after inheriting Models.
+        not be redefined after inheriting Models. `as_` works as in get_all.
         """
 
     @classmethod
@@ -103,46 +164,165 @@ class Models(AbstractModels):
     the database table.
     """
 
+    # the row an instance was loaded from, for `save`. Kept in slots so they
+    # stay out of the instance __dict__ (to_dict, __eq__).
+    __slots__ = ("_blubber_row", "_blubber_names")
+
     @classmethod
     def insert(cls, attributes):
-        debug_mode = Models.db._debug
-
         cols = ", ".join(attributes.keys())
         values = ", ".join(["%s"] * len(attributes))
-        pkey = ", ".join(cls.table_primaries)
 
         SQL = f"""
             INSERT
             INTO {cls.table_name} ({cols})
             VALUES ({values})
-            RETURNING {pkey};
+            RETURNING *;
             """
 
         data = tuple(attributes.values())
 
-        with Models.db.conn.cursor() as cursor:
+        with Models.db.connection() as conn:
+            with conn.cursor() as cursor:
+
+                try:
+                    cls._execute(cursor, "insert", SQL, data)
+
+                except psycopg2.errors.UniqueViolation as e:
+                    # inside a session the error rolls back the whole unit of work
+                    if Models.db.in_session(): raise
+                    logger.error(e, exc_info=True)
+                    conn.rollback()
+                    return None
+
+                Models.db.commit(conn)
+                result = cursor.fetchone()
+
+                logger.debug("Result:\n\t%s", result)
+
+                _instance_dict = Blubber.format_to_dict(cursor, result)
+                _instance = cls._build(_instance_dict, refresh=True)
+        return _instance
 
-            try:
-                cursor.execute(SQL, data)
 
-            except psycopg2.errors.UniqueViolation as e:
-                logger.error(e, exc_info=True)
-                Models.db.conn.rollback()
-                return None
+    @classmethod
+    def upsert(cls, attributes):
+        """
+        Insert a row, or overwrite the row with the same primary key(s) if one
+        already exists. Returns the row as it is stored after the write.
+        """
+        for pkey in cls.table_primaries:
+            assert attributes.get(pkey) is not None, "Upsert needs every primary key."
+
+        cols = ", ".join(attributes.keys())
+        values = ", ".join(["%s"] * len(attributes))
+        conflict = cls._conflict_clause(attributes.keys(), "upsert")
 
-            logger.debug(f"Query:\n\t{SQL}")
+        SQL = f"""
+            INSERT
+            INTO {cls.table_name} ({cols})
+            VALUES ({values})
+            {conflict}
+            RETURNING *;
+            """
 
-            Models.db.conn.commit()
-            result = cursor.fetchone()
+        data = tuple(attributes.values())
 
-            logger.debug(f"Result:\n\t{result}")
+        with Models.db.connection() as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "upsert", SQL, data)
 
-            pkey = Blubber.format_to_dict(cursor, result)
+                Models.db.commit(conn)
+                result = cursor.fetchone()
 
-        _instance = cls.get(pkey)
+                _instance_dict = Blubber.format_to_dict(cursor, result)
+                _instance = cls._build(_instance_dict, refresh=True)
         return _instance
 
 
+    @classmethod
+    def insert_many(cls, rows, batch_size=1000, on_conflict="fail"):
+        """
+        Insert many rows in one transaction, sending `batch_size` rows per
+        multi-row INSERT. Every row must have the same columns. Returns the
+        inserted rows as instances, built from `RETURNING *`.
+
+        on_conflict => what to do with rows which violate a unique constraint:
+        "fail" rolls back the whole insert and returns None, "skip" leaves the
+        existing rows untouched (and they are not returned), "upsert" overwrites
+        the existing rows with the same primary key with the new values; when
+        `rows` repeat a primary key, the last of them wins.
+        """
+        assert on_conflict in ["fail", "skip", "upsert"], "Error: invalid conflict policy."
+
+        rows = list(rows)
+        if len(rows) == 0: return []
+
+        cols = list(rows[0].keys())
+        assert cls.verify_attributes(cols)
+
+        for row in rows:
+            assert row.keys() == rows[0].keys(), "All rows must have the same columns."
+
+        # a row may only be updated once per statement: the last row of a
+        # primary key wins, as in `load`
+        if on_conflict == "upsert" and all(pkey in cols for pkey in cls.table_primaries):
+            rows = list({tuple(row[pkey] for pkey in cls.table_primaries): row for row in rows}.values())
+
+        data = [tuple(row[col] for col in cols) for row in rows]
+
+        conflict = cls._conflict_clause(cols, on_conflict)
+
+        SQL = f"""
+            INSERT
+            INTO {cls.table_name} ({", ".join(cols)})
+            VALUES %s
+            {conflict}
+            RETURNING *;
+            """
+
+        with Models.db.connection() as conn:
+            with conn.cursor() as cursor:
+
+                try:
+                    with Models.instrumentation.track(cls, "insert_many", SQL) as event:
+                        results = psycopg2.extras.execute_values(
+                            cursor, SQL, data, page_size=batch_size, fetch=True
+                        )
+                        event.rowcount = len(results)
+
+                except psycopg2.errors.UniqueViolation as e:
+                    # inside a session the error rolls back the whole unit of work
+                    if Models.db.in_session(): raise
+                    logger.error(e, exc_info=True)
+                    conn.rollback()
+                    return None
+
+                Models.db.commit(conn)
+
+                _instances = []
+                for result in results:
+                    _instance_dict = Blubber.format_to_dict(cursor, result)
+                    _instance = cls._build(_instance_dict, refresh=True)
+                    _instances.append(_instance)
+        return _instances
+
+
+    @classmethod
+    def _conflict_clause(cls, cols, on_conflict):
+        """The ON CONFLICT clause of an insert of `cols`, see insert_many."""
+        if on_conflict == "fail": return ""
+        # no conflict target: rows violating any unique constraint are skipped
+        if on_conflict == "skip": return "ON CONFLICT DO NOTHING"
+
+        pkey = ", ".join(cls.table_primaries)
+
+        updates = [f"{col} = EXCLUDED.{col}" for col in cols if col not in cls.table_primaries]
+        # with only primary keys given, a no-op update still returns the row
+        if len(updates) == 0: updates = [f"{cls.table_primaries[0]} = EXCLUDED.{cls.table_primaries[0]}"]
+        return f"ON CONFLICT ({pkey}) DO UPDATE SET {', '.join(updates)}"
+
+
     @classmethod
     def get(cls, pkeys):
         assert isinstance(pkeys, dict)
@@ -150,28 +330,82 @@ class Models(AbstractModels):
         data = format_query_data(cls.table_primaries, pkeys)
         conds = format_query_statement(cls.table_primaries, pkeys)
 
+        _instance = cls._lookup(data)
+        if _instance is not None: return _instance
+
         SQL = f"""
             SELECT *
             FROM {cls.table_name}
             WHERE {conds};
             """
 
-        logger.debug(f"Query:\n\t{SQL}")
-
-        with Models.db.conn.cursor() as cursor:
-            cursor.execute(SQL, data)
-            result = cursor.fetchone()
+        with Models.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "get", SQL, data)
+                result = cursor.fetchone()
 
-            logger.debug(f"Result:\n\t{result}")
+                logger.debug("Result:\n\t%s", result)
 
-            if result is None: return None
+                if result is None: return None
 
-            _instance_dict = Blubber.format_to_dict(cursor, result)
+                _instance_dict = Blubber.format_to_dict(cursor, result)
+                _instance = cls._build(_instance_dict)
 
-        _instance = cls(_instance_dict)
+        # keyed by the row's own key, which writes refresh, not by the caller's
+        # values (e.g. "5" for an integer id)
+        if cls.cache is not None: cls._cache_put(format_query_data(cls.table_primaries, _instance_dict), _instance)
         return _instance
 
 
+    @classmethod
+    def get_batch(cls, pkeys_list):
+        """
+        Get many rows by primary key(s) in one query. Returns a list in the same
+        order as `pkeys_list`, with None where no row matched.
+        """
+        assert isinstance(pkeys_list, list)
+        if len(pkeys_list) == 0: return []
+
+        _, _, keys = format_batch_query(cls.table_primaries, pkeys_list)
+
+        _instances = {key: cls._lookup(key) for key in keys}
+        misses = [pkeys for pkeys, key in zip(pkeys_list, keys) if _instances[key] is None]
+        if len(misses) == 0: return [_instances[key] for key in keys]
+
+        conds, data, _ = format_batch_query(cls.table_primaries, misses)
+
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name}
+            WHERE {conds};
+            """
+
+        with Models.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "get_batch", SQL, data)
+                results = cursor.fetchall()
+
+                logger.debug("Result:\n\t%s", results)
+
+                for result in results:
+                    _instance_dict = Blubber.format_to_dict(cursor, result)
+                    _instance = cls._build(_instance_dict)
+                    key = format_query_data(cls.table_primaries, _instance_dict)
+                    _instances[key] = _instance
+                    if cls.cache is not None: cls._cache_put(key, _instance)
+        return match_batch_keys(keys, _instances)
+
+
+    @classmethod
+    def loader(cls):
+        """
+        A request-scoped ModelLoader, which coalesces many `load` calls into one
+        `get_batch` query and remembers the rows it has already fetched. Only
+        `load` promises are batched: plain `get` calls still run one query each.
+        """
+        return ModelLoader(cls)
+
+
     @classmethod
     def set(cls, pkeys, changes):
         assert isinstance(pkeys, dict)
@@ -185,17 +419,24 @@ class Models(AbstractModels):
         SQL = f"""
             UPDATE {cls.table_name}
             SET {set_conds}
-            WHERE {where_conds};
+            WHERE {where_conds}
+            RETURNING *;
             """
 
         data = set_data + where_data
 
-        logger.debug(f"Query:\n\t{SQL}")
+        with Models.db.connection() as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "set", SQL, data)
 
-        with Models.db.conn.cursor() as cursor:
-            cursor.execute(SQL, data)
+                Models.db.commit(conn)
+                result = cursor.fetchone()
 
-            Models.db.conn.commit()
+                if result is None: return None
+
+                _instance_dict = Blubber.format_to_dict(cursor, result)
+                _instance = cls._build(_instance_dict, refresh=True)
+        return _instance
 
 
     @classmethod
@@ -210,66 +451,296 @@ class Models(AbstractModels):
             WHERE {conds};
             """
 
-        logger.debug(f"Query:\n\t{SQL}")
+        with Models.db.connection() as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "delete", SQL, data)
 
-        with Models.db.conn.cursor() as cursor:
-            cursor.execute(SQL, data)
+            Models.db.commit(conn)
+
+        cls._forget(data)
 
-            Models.db.conn.commit()
+
+    @classmethod
+    def set_many(cls, updates, page_size=100):
+        """
+        Apply many updates in one transaction. `updates` is a list of
+        (pkeys, changes) pairs; the UPDATE statements are sent `page_size` at a
+        time instead of one round trip each.
+        """
+        assert isinstance(updates, list)
+        if len(updates) == 0: return
+
+        groups = {}
+        for pkeys, changes in updates:
+            assert isinstance(pkeys, dict) and isinstance(changes, dict)
+            groups.setdefault(tuple(changes.keys()), []).append((pkeys, changes))
+
+        assert cls.verify_attributes([col for cols in groups.keys() for col in cols])
+
+        where_conds = " AND ".join([f"{pkey} = %s" for pkey in cls.table_primaries])
+
+        with Models.db.connection() as conn:
+            with conn.cursor() as cursor:
+                for cols, _updates in groups.items():
+                    set_conds = ", ".join([f"{col} = %s" for col in cols])
+
+                    SQL = f"""
+                        UPDATE {cls.table_name}
+                        SET {set_conds}
+                        WHERE {where_conds};
+                        """
+
+                    data = [
+                        tuple(changes.values()) + format_query_data(cls.table_primaries, pkeys)
+                        for pkeys, changes in _updates
+                    ]
+
+                    with Models.instrumentation.track(cls, "set_many", SQL) as event:
+                        psycopg2.extras.execute_batch(cursor, SQL, data, page_size=page_size)
+                        event.rowcount = len(data)
+
+            Models.db.commit(conn)
+
+        for pkeys, _ in updates:
+            cls._forget(format_query_data(cls.table_primaries, pkeys))
+
+
+    @classmethod
+    def delete_many(cls, pkeys_list):
+        """Delete many rows by primary key(s) with one DELETE."""
+        assert isinstance(pkeys_list, list)
+        if len(pkeys_list) == 0: return
+
+        conds, data, keys = format_batch_query(cls.table_primaries, pkeys_list)
+
+        SQL = f"""
+            DELETE
+            FROM {cls.table_name}
+            WHERE {conds};
+            """
+
+        with Models.db.connection() as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "delete_many", SQL, data)
+
+            Models.db.commit(conn)
+
+        for key in keys: cls._forget(key)
 
 
     @classmethod
-    def get_all(cls):
+    def get_all(cls, as_=None):
         SQL = f"""
             SELECT *
             FROM {cls.table_name};
             """
 
-        logger.debug(f"Query:\n\t{SQL}")
+        with Models.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "get_all", SQL)
+                if as_ is not None: return fetch_columns(cursor, as_)
 
-        with Models.db.conn.cursor() as cursor:
-            cursor.execute(SQL)
-            results = cursor.fetchall()
+                results = cursor.fetchall()
 
-            logger.debug(f"Result:\n\t{results}")
+                logger.debug("Result:\n\t%s", results)
 
-            _instances = []
-            for result in results:
-                _instance_dict = Blubber.format_to_dict(cursor, result)
-                _instance = cls(_instance_dict)
-                _instances.append(_instance)
+                build = cls._row_factory(cursor)
+                _instances = [build(result) for result in results]
         return _instances
 
 
     @classmethod
-    def get_many(cls, limit):
-        assert isinstance(limit, int), "Limit must be of type integer."
+    def iter_all(cls, itersize=2000):
+        """
+        Like get_all, but yields instances lazily from a server-side cursor,
+        fetching `itersize` rows per round trip. Memory use does not grow with
+        the size of the table, and breaking out of the loop stops the scan.
+
+        The cursor runs on a connection of its own, not the one pinned to this
+        thread or session, so it does not see writes this thread or session has
+        not committed yet.
+        """
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name};
+            """
+
+        yield from cls._iter("iter_all", SQL, None, itersize)
+
+
+    @classmethod
+    def iter_filter(cls, filters, itersize=2000):
+        """
+        Like filter, but yields instances lazily from a server-side cursor, on
+        a connection of its own like iter_all.
+        """
+        filter_keys = [key for key in filters.keys()]
+
+        assert isinstance(filters, dict)
+        assert cls.verify_attributes(filter_keys)
+
+        data = tuple(filters.values())
+        conds = " AND ".join([f"{key} = %s" for key in filters.keys()])
 
         SQL = f"""
             SELECT *
             FROM {cls.table_name}
+            WHERE {conds};
             """
 
-        data = (limit,)
+        yield from cls._iter("iter_filter", SQL, data, itersize)
+
+
+    @classmethod
+    def export(cls, target, format="csv", partitions=1, columns=None, header=True):
+        """
+        Write the whole table to a file path or stream with COPY TO STDOUT,
+        without building a row in Python. Returns the number of rows written.
+
+        format => "csv" (with a header line unless `header=False`) or "binary",
+        Postgres' COPY BINARY format, which `load` and COPY FROM read back.
+
+        partitions => split the table into that many ranges of the first primary
+        key and COPY them in parallel, each on its own connection. All ranges
+        read one consistent snapshot, and are written to `target` in key range
+        order. Meant for tables of millions of rows, where one COPY is bound by
+        one server backend. Only the pool's free connections are used; with
+        none free (e.g. inside a session on a small pool), the table is exported
+        in one piece.
+        """
+        return export(cls, target, format=format, partitions=partitions, columns=columns, header=header)
+
 
-        logger.debug(f"Query:\n\t{SQL}")
+    @classmethod
+    def load(cls, source, columns=None, format="csv", header=True, on_conflict="fail"):
+        """
+        Bulk load rows with COPY FROM STDIN, in one transaction. Returns
+        {"rows", "seconds", "rows_per_s"}, or None if on_conflict="fail" and a
+        row violated the primary key (nothing is loaded then).
 
-        with Models.db.conn.cursor() as cursor:
-            cursor.execute(SQL)
-            results = cursor.fetchmany(limit)
+        source => a file path or an open file, CSV (with a header line naming
+        the columns, unless `header=False`) or COPY binary as written by
+        `export`; or an iterator of dicts or tuples, streamed to COPY as CSV
+        without being held in memory.
 
-            logger.debug(f"Result:\n\t{results}")
+        columns => the columns of the rows, in order. Defaults to the CSV
+        header, the keys of the first dict, or else all the table's columns.
 
-            _instances = []
-            for result in results:
-                _instance_dict = Blubber.format_to_dict(cursor, result)
-                _instance = cls(_instance_dict)
-                _instances.append(_instance)
+        on_conflict => as for insert_many. "skip" and "upsert" COPY into a
+        temporary table first and merge it with INSERT ... ON CONFLICT; with
+        "upsert" the last row of a primary key in the source wins.
+        """
+        return load(cls, source, columns=columns, format=format, header=header, on_conflict=on_conflict)
+
+
+    @classmethod
+    def query(cls):
+        """
+        Start a lazy Query on this model, for filters beyond equality, ordering
+        and limits, e.g. `User.query().where(id__in=ids).order_by("-id").limit(50)`.
+        """
+        return Query(cls)
+
+
+    @classmethod
+    def get_many(cls, limit, offset=0):
+        """
+        Get one page of `limit` rows, ordered by primary key(s). Deep offsets
+        still make Postgres walk the skipped rows, prefer `paginate` for feeds.
+        """
+        assert isinstance(limit, int), "Limit must be of type integer."
+        assert isinstance(offset, int), "Offset must be of type integer."
+
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name}
+            ORDER BY {", ".join(cls.table_primaries)}
+            LIMIT %s
+            OFFSET %s;
+            """
+
+        data = (limit, offset)
+
+        with Models.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "get_many", SQL, data)
+                results = cursor.fetchall()
+
+                logger.debug("Result:\n\t%s", results)
+
+                build = cls._row_factory(cursor)
+                _instances = [build(result) for result in results]
         return _instances
 
 
     @classmethod
-    def filter(cls, filters):
+    def paginate(cls, limit, after=None, order_by=None, filters=None):
+        """
+        Keyset (seek) pagination: returns `(instances, next_token)`, where
+        `next_token` is passed back as `after` to get the following page, and is
+        None on the last page. Every page costs the same, however deep.
+
+        order_by => column to sort on, prefixed with "-" for descending. Defaults
+        to the primary key(s), which also break ties on any other column. The
+        column should be indexed (together with the primary key) to be fast.
+
+        filters => optional equality filters, as in Models.filter.
+        """
+        assert isinstance(limit, int) and limit > 0, "Limit must be a positive integer."
+        if filters is None: filters = {}
+        assert isinstance(filters, dict)
+
+        descending = order_by is not None and order_by.startswith("-")
+        if order_by is not None: order_by = order_by.lstrip("-")
+
+        sort_keys = [] if order_by is None else [order_by]
+        sort_keys += [pkey for pkey in cls.table_primaries if pkey not in sort_keys]
+
+        assert cls.verify_attributes(sort_keys + list(filters.keys()))
+
+        conds = [f"{key} = %s" for key in filters.keys()]
+        data = tuple(filters.values())
+
+        if after is not None:
+            values = decode_page_token(after)
+            assert len(values) == len(sort_keys), "Page token does not match the ordering."
+
+            comparison = "<" if descending else ">"
+            placeholders = ", ".join(["%s"] * len(sort_keys))
+            conds.append(f"({', '.join(sort_keys)}) {comparison} ({placeholders})")
+            data += tuple(values)
+
+        direction = "DESC" if descending else "ASC"
+        where = "" if len(conds) == 0 else "WHERE " + " AND ".join(conds)
+
+        # one extra row tells whether there is a next page
+        SQL = f"""
+            SELECT *
+            FROM {cls.table_name}
+            {where}
+            ORDER BY {", ".join([f"{key} {direction}" for key in sort_keys])}
+            LIMIT %s;
+            """
+
+        data += (limit + 1, )
+
+        with Models.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "paginate", SQL, data)
+                results = cursor.fetchall()
+
+                build = cls._row_factory(cursor)
+                _instances = [build(result) for result in results[:limit]]
+
+                next_token = None
+                if len(results) > limit:
+                    last_dict = Blubber.format_to_dict(cursor, results[limit - 1])
+                    next_token = encode_page_token([last_dict[key] for key in sort_keys])
+        return _instances, next_token
+
+
+    @classmethod
+    def filter(cls, filters, as_=None):
         filter_keys = [key for key in filters.keys()]
 
         assert isinstance(filters, dict)
@@ -284,19 +755,17 @@ class Models(AbstractModels):
             WHERE {conds};
             """
 
-        logger.debug(f"Query:\n\t{SQL}")
+        with Models.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "filter", SQL, data)
+                if as_ is not None: return fetch_columns(cursor, as_)
 
-        with Models.db.conn.cursor() as cursor:
-            cursor.execute(SQL, data)
-            results = cursor.fetchall()
+                results = cursor.fetchall()
 
-            logger.debug(f"Result:\n\t{results}")
+                logger.debug("Result:\n\t%s", results)
 
-            _instances = []
-            for result in results:
-                _instance_dict = Blubber.format_to_dict(cursor, result)
-                _instance = cls(_instance_dict)
-                _instances.append(_instance)
+                build = cls._row_factory(cursor)
+                _instances = [build(result) for result in results]
         return _instances
 
     # @notice: operates like Models.filter() but promises to only return 1 result
@@ -305,6 +774,10 @@ class Models(AbstractModels):
         filter_keys = [key for key in filters.keys()]
 
         assert isinstance(filters, dict)
+
+        # a lookup on exactly the primary key(s) can be answered by the cache
+        if set(filter_keys) == set(cls.table_primaries): return cls.get(filters)
+
         assert cls.verify_attributes(filter_keys)
 
         data = tuple(filters.values())
@@ -316,19 +789,20 @@ class Models(AbstractModels):
             WHERE {conds};
             """
 
-        with Models.db.conn.cursor() as cursor:
-            cursor.execute(SQL, data)
-            result = cursor.fetchall()
+        with Models.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "unique", SQL, data)
+                result = cursor.fetchall()
 
-            logger.debug(f"Result:\n\t{result}")
+                logger.debug("Result:\n\t%s", result)
 
-            if len(result) == 0: return None
+                if len(result) == 0: return None
 
-            assert len(result) == 1, "The set of filters applied are not unique to one row."
+                assert len(result) == 1, "The set of filters applied are not unique to one row."
 
-            result, = result
-            _instance_dict = Blubber.format_to_dict(cursor, result)
-            _instance = cls(_instance_dict)
+                result, = result
+                _instance_dict = Blubber.format_to_dict(cursor, result)
+                _instance = cls._build(_instance_dict)
         return _instance
 
 
@@ -356,22 +830,398 @@ class Models(AbstractModels):
 
         data = (search, )
 
-        logger.debug(f"Query:\n\t{SQL}")
+        with Models.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "like", SQL, data)
+                results = cursor.fetchall()
 
-        with Models.db.conn.cursor() as cursor:
-            cursor.execute(SQL, data)
-            results = cursor.fetchall()
+                logger.debug("Result:\n\t%s", results)
 
-            logger.debug(f"Result:\n\t{results}")
+                build = cls._row_factory(cursor)
+                _instances = [build(result) for result in results]
+        return _instances
 
-            _instances = []
-            for result in results:
-                _instance_dict = Blubber.format_to_dict(cursor, result)
-                _instance = cls(_instance_dict)
-                _instances.append(_instance)
+
+    @classmethod
+    def search(cls, column, term, mode="fts", limit=20):
+        """
+        The rows best matching `term` in `column`, best match first.
+
+        mode => "fts" matches words (stemmed with `search_config`) and ranks by
+        ts_rank; the term takes web search syntax ("quoted phrase", -word, or).
+        "trigram" matches by pg_trgm word similarity, which tolerates typos and
+        partial words.
+
+        Both use the GIN indexes made by `create_search_indexes` instead of
+        scanning the whole table like `like` does.
+        """
+        assert cls.verify_attributes([column]), "Error: invalid column name."
+        assert mode in ["fts", "trigram"], "Error: invalid search mode."
+        assert isinstance(limit, int) and limit > 0, "Error: limit must be a positive integer."
+
+        # 'column' is checked above; the expressions must match the index ones
+        if mode == "fts":
+            document = f"to_tsvector(%s::regconfig, {column})"
+            query = "websearch_to_tsquery(%s::regconfig, %s)"
+            SQL = f"""
+                SELECT *
+                FROM {cls.table_name}
+                WHERE {document} @@ {query}
+                ORDER BY ts_rank({document}, {query}) DESC
+                LIMIT %s;
+                """
+            config = cls.search_config
+            data = (config, config, term, config, config, term, limit)
+        else:
+            SQL = f"""
+                SELECT *
+                FROM {cls.table_name}
+                WHERE %s <%% {column}
+                ORDER BY word_similarity(%s, {column}) DESC
+                LIMIT %s;
+                """
+            data = (term, term, limit)
+
+        with Models.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "search", SQL, data)
+                results = cursor.fetchall()
+
+                build = cls._row_factory(cursor)
+                _instances = [build(result) for result in results]
         return _instances
 
 
+    @classmethod
+    def search_indexes(cls, concurrently=False):
+        """
+        (name, SQL) of the GIN indexes `search` needs for `search_columns`,
+        e.g. to copy into a migration. Trigram indexes also make `like` fast.
+        """
+        assert cls.search_config.replace("_", "").isalnum(), "Error: invalid search config."
+        create = "CREATE INDEX CONCURRENTLY" if concurrently else "CREATE INDEX"
+
+        indexes = []
+        for column, modes in (cls.search_columns or {}).items():
+            assert cls.verify_attributes([column]), f"Error: invalid search column {column}."
+            for mode in modes:
+                assert mode in ["fts", "trigram"], "Error: invalid search mode."
+
+                if mode == "fts":
+                    name = f"{cls.table_name}_{column}_fts_idx"
+                    expression = f"(to_tsvector('{cls.search_config}'::regconfig, {column}))"
+                else:
+                    name = f"{cls.table_name}_{column}_trgm_idx"
+                    expression = f"{column} gin_trgm_ops"
+
+                indexes.append((name, f"{create} IF NOT EXISTS {name} ON {cls.table_name} USING GIN ({expression});"))
+        return indexes
+
+
+    @classmethod
+    def create_search_indexes(cls, concurrently=False):
+        """
+        Create the missing search indexes of this model, and the pg_trgm
+        extension if a trigram index needs it.
+
+        concurrently => build without locking out writes. Slower, and runs
+        outside of a transaction, so not inside a session.
+        """
+        indexes = cls.search_indexes(concurrently=concurrently)
+        if len(indexes) == 0: return []
+
+        statements = []
+        if any(name.endswith("_trgm_idx") for name, _ in indexes):
+            statements.append("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        statements += [SQL for _, SQL in indexes]
+
+        with Models.db.connection() as conn:
+            if concurrently:
+                assert not Models.db.in_session(), "Error: indexes can't be built concurrently inside a session."
+                conn.commit()
+                conn.autocommit = True
+            try:
+                with conn.cursor() as cursor:
+                    for SQL in statements:
+                        cls._execute(cursor, "create_index", SQL)
+            finally:
+                if concurrently: conn.autocommit = False
+            if not concurrently: Models.db.commit(conn)
+
+        return [name for name, _ in indexes]
+
+
+    @classmethod
+    def _iter(cls, operation, SQL, data, itersize):
+        # the cursor gets a connection of its own: a commit by another query in
+        # this thread would otherwise close it halfway through the scan.
+        with Models.db.connection(pinned=False, readonly=True) as conn:
+            with conn.cursor(name=f"blubber_iter_{cls.table_name}") as cursor:
+                cursor.itersize = itersize
+                cls._execute(cursor, operation, SQL, data)
+
+                build = None
+                for result in cursor:
+                    # the description is only known once the first rows arrive
+                    if build is None: build = cls._row_factory(cursor)
+                    yield build(result)
+
+
+    @staticmethod
+    def identity_map():
+        """
+        Within this block each row is represented by exactly one instance, e.g.
+
+            with Models.identity_map():
+                assert User.get({"id": 1}) is User.filter({"id": 1})[0]
+        """
+        return identity_map()
+
+
+    @classmethod
+    def _build(cls, _instance_dict, refresh=False):
+        """
+        Turn a fetched row into an instance. Inside an identity map, the instance
+        already representing the row is returned instead, updated in place when
+        `refresh` is set (i.e. the row was just written).
+        """
+        _instances = _identity_map.get()
+        if _instances is None and not (refresh and cls.cache is not None):
+            return cls._new(_instance_dict)
+
+        key = format_query_data(cls.table_primaries, _instance_dict)
+        _instance = None if _instances is None else _instances.get((cls, key))
+
+        if _instance is None:
+            _instance = cls._new(_instance_dict)
+            if _instances is not None: _instances[(cls, key)] = _instance
+        elif refresh:
+            _instance._refresh(cls._new(_instance_dict))
+
+        if refresh and cls.cache is not None: cls._cache_put(key, _instance)
+        return _instance
+
+
+    @classmethod
+    def _new(cls, _instance_dict):
+        """Build an instance from a row, keeping the row to diff against in `save`."""
+        _instance = cls(_instance_dict)
+        _instance._blubber_row = _instance_dict
+        return _instance
+
+
+    @classmethod
+    def _execute(cls, cursor, operation, SQL, data=None):
+        with Models.instrumentation.track(cls, operation, SQL, data) as event:
+            cursor.execute(SQL, data)
+            event.rowcount = cursor.rowcount
+
+
+    @classmethod
+    def _row_factory(cls, cursor):
+        """
+        A function turning rows of this cursor into instances. The column layout
+        is read once and the function is cached per model and layout, instead of
+        walking cursor.description for every row.
+        """
+        names = tuple(attr.name for attr in cursor.description)
+        if "_column_types" not in cls.__dict__:
+            remember_types(cls, {attr.name: attr.type_code for attr in cursor.description})
+
+        # inside an identity map every row has to be looked up by its key
+        if _identity_map.get() is not None:
+            return lambda result: cls._build(dict(zip(names, result)))
+
+        factories = cls.__dict__.get("_row_factories")
+        if factories is None:
+            factories = {}
+            setattr(cls, "_row_factories", factories)
+
+        build = factories.get(names)
+        if build is None:
+            build = cls._compile_row_factory(names)
+            factories[names] = build
+        return build
+
+
+    @classmethod
+    def _compile_row_factory(cls, names):
+        columns = cls.__dict__.get("table_attributes") or ()
+
+        # hand-written models run their own __init__ on each row
+        if not cls.__dict__.get("_generated") or set(names) != set(columns):
+            def build(result):
+                _instance = cls(dict(zip(names, result)))
+                _instance._blubber_row = result
+                _instance._blubber_names = names
+                return _instance
+            return build
+
+        # generated slot models: assign every slot straight from the row tuple
+        # with the slot descriptors, skipping the dict and __init__ altogether.
+        # The row tuple itself is kept as the loaded state for `save`.
+        namespace = {
+            "_new": object.__new__,
+            "_cls": cls,
+            "_names": names,
+        }
+        lines = ["def build(result):", "    self = _new(_cls)"]
+        for index, name in enumerate(names):
+            namespace[f"_set_{index}"] = cls.__dict__[name].__set__
+            lines.append(f"    _set_{index}(self, result[{index}])")
+        lines.append("    self._blubber_row = result")
+        # rows in the declared column order are read back with table_attributes
+        if names != tuple(columns): lines.append("    self._blubber_names = _names")
+        lines.append("    return self")
+
+        exec("\n".join(lines), namespace)
+        return namespace["build"]
+
+
+    @classmethod
+    def define(cls, table_name, table_primaries, table_attributes=None, sensitive_attributes=None, name=None):
+        """
+        Generate a compact model class for a table, whose instances store one
+        slot per column instead of a __dict__. Rows are loaded into it by a
+        constructor compiled once per column layout. If `table_attributes` is
+        not given, the columns are read from the database.
+
+            Category = Models.define("categories", ["id"])
+        """
+        if table_attributes is None:
+            table = Models.catalog.get(table_name, Models.db.connection)
+            if table is None:
+                raise Exception(f"SchemaError: table {table_name} was not found in the database.")
+            table_attributes = table.columns
+
+        columns = tuple(table_attributes)
+
+        # a slot would hide the Models attribute of the same name
+        reserved = set(dir(cls))
+        for column in columns:
+            if column in reserved:
+                raise Exception(f"SchemaError: column {column} of {table_name} clashes with the Models attribute {column}, declare a Models subclass for this table instead.")
+
+        def __init__(self, attrs):
+            for column in columns:
+                setattr(self, column, attrs.get(column))
+
+        namespace = {
+            "__module__": cls.__module__,
+            "__slots__": columns,
+            "__init__": __init__,
+            "_generated": True,
+            "table_name": table_name,
+            "table_primaries": list(table_primaries),
+            "table_attributes": list(columns),
+            "sensitive_attributes": list(sensitive_attributes or []),
+        }
+
+        if name is None: name = "".join(word.capitalize() for word in table_name.split("_"))
+        return type(name, (cls, ), namespace)
+
+
+    @classmethod
+    def _lookup(cls, key):
+        _instances = _identity_map.get()
+        if _instances is not None and (cls, key) in _instances:
+            return _instances[(cls, key)]
+
+        if cls.cache is None: return None
+
+        # the session's own version of the row is only in the database
+        session = _session.get()
+        if session is not None and session.is_touched(cls, key): return None
+
+        _instance = cls.cache.get(key)
+        if _instance is None: return None
+
+        # the cached instance is shared by every thread: each caller gets its
+        # own copy to change and `save`
+        _instance = copy.deepcopy(_instance)
+        if _instances is not None: _instances[(cls, key)] = _instance
+        return _instance
+
+
+    @classmethod
+    def _forget(cls, key):
+        _instances = _identity_map.get()
+        if _instances is not None: _instances.pop((cls, key), None)
+        if cls.cache is None: return
+
+        cls.cache.invalidate(key)
+        session = _session.get()
+        if session is not None: session.touch(cls, key)
+
+
+    @classmethod
+    def _cache_put(cls, key, _instance):
+        """
+        Cache a row, unless a session is open: the row may be rolled back, and
+        other threads must not see it before the commit. The key is dropped
+        instead, and dropped again when the session ends.
+        """
+        session = _session.get()
+        if session is None:
+            # a copy, so later changes to the caller's instance stay its own
+            cls.cache.put(key, copy.deepcopy(_instance))
+            return
+
+        cls.cache.invalidate(key)
+        session.touch(cls, key)
+
+
+    @classmethod
+    def count(cls, filters=None):
+        """Number of rows matching the equality filters (all rows if None)."""
+        return cls._query_filters(filters).count()
+
+
+    @classmethod
+    def exists(cls, filters):
+        """Whether any row matches the equality filters, without fetching it."""
+        return cls._query_filters(filters).exists()
+
+
+    @classmethod
+    def aggregate(cls, func, column, filters=None, group_by=None):
+        """
+        Run an aggregate (count, sum, min, max or avg) over `column` in Postgres.
+        Returns a scalar, or with `group_by` (a column or list of columns) a dict
+        of group value(s) to aggregate.
+        """
+        return cls._query_filters(filters).aggregate(func, column, group_by=group_by)
+
+
+    @classmethod
+    def sum(cls, column, filters=None, group_by=None):
+        return cls.aggregate("sum", column, filters, group_by)
+
+
+    @classmethod
+    def min(cls, column, filters=None, group_by=None):
+        return cls.aggregate("min", column, filters, group_by)
+
+
+    @classmethod
+    def max(cls, column, filters=None, group_by=None):
+        return cls.aggregate("max", column, filters, group_by)
+
+
+    @classmethod
+    def avg(cls, column, filters=None, group_by=None):
+        return cls.aggregate("avg", column, filters, group_by)
+
+
+    @classmethod
+    def _query_filters(cls, filters):
+        query = cls.query()
+        if filters is None: return query
+
+        assert isinstance(filters, dict)
+        return query.where(**filters)
+
+
     @classmethod
     def verify_attributes(cls, query_attributes: list) -> bool:
         """
@@ -381,35 +1231,54 @@ class Models(AbstractModels):
         If not, then returns False and prints the name of the first entry to fail
         the check.
         """
-        _query_attributes = query_attributes.copy()
-        _attribute = _query_attributes.pop(0)
-
-        attribute = set([_attribute])
-        table_attributes = cls._get_attributes()
-        if attribute.issubset(table_attributes):
-            if len(_query_attributes) == 0: return True
-            else: return cls.verify_attributes(_query_attributes)
+        columns = cls.__dict__.get("_column_set")
+        if columns is None:
+            columns = frozenset(cls._get_attributes())
+            setattr(cls, "_column_set", columns)
 
-        logger.error(f"NotTableAttributeError, {_attribute} is not an attribute of {cls.table_name}.")
+        for _attribute in query_attributes:
+            if _attribute not in columns:
+                logger.error(f"NotTableAttributeError, {_attribute} is not an attribute of {cls.table_name}.")
+                return False
+        return True
 
 
     @classmethod
     def _get_attributes(cls):
         if cls.table_attributes is None:
-            SQL = f"""
-                SELECT *
-                FROM {cls.table_name}
-                LIMIT 0
-                """
+            table = Models.catalog.get(cls.table_name, Models.db.connection)
+            if table is None:
+                raise Exception(f"SchemaError: table {cls.table_name} was not found in the database.")
 
-            with Models.db.conn.cursor() as cursor:
-                cursor.execute(SQL)
-                cls.table_attributes = [attr.name for attr in cursor.description]
+            cls.table_attributes = list(table.columns)
+            cls._schema_loaded = True
+            remember_types(cls, table.types)
 
-            logger.debug(f"Table attributes are initialized as: {cls.table_attributes}")
+            logger.debug("Table attributes are initialized as: %s", cls.table_attributes)
         return cls.table_attributes
 
 
+    @classmethod
+    def load_schema(cls):
+        """
+        Load the columns of every model defined so far, in one query (or from
+        BLUBBER_SCHEMA_CACHE), e.g. when a worker starts.
+        """
+        Models.catalog.load(Models.db.connection)
+
+
+    @classmethod
+    def reset_schema(cls):
+        """
+        Forget the schema of every table, in the catalog and in every model
+        (columns, column types, compiled row factories and serializers), e.g.
+        after a migration applied while the process runs. Columns declared in
+        a model's `table_attributes` are kept.
+        """
+        Models.catalog.clear()
+        forget_schema(Models)
+
+
     @classmethod
     def does_row_exist(cls, attributes):
         attr_keys = [key for key in attributes.keys()]
@@ -421,38 +1290,111 @@ class Models(AbstractModels):
         conds = format_query_statement(attributes.keys(), attributes)
 
         SQL = f"""
-            SELECT *
-            FROM {cls.table_name}
-            WHERE {conds};
+            SELECT EXISTS (
+                SELECT 1
+                FROM {cls.table_name}
+                WHERE {conds}
+            );
             """
 
-        logger.debug(f"Query:\n\t{SQL}")
+        with Models.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                cls._execute(cursor, "does_row_exist", SQL, data)
+                result, = cursor.fetchone()
 
-        with Models.db.conn.cursor() as cursor:
-            cursor.execute(SQL, data)
-            result = cursor.fetchone()
+        return result
+
+
+    def _state(self):
+        """The instance attributes, for both __dict__ and __slots__ models."""
+        try:
+            return self.__dict__
+        except AttributeError:
+            return {name: getattr(self, name) for name in self.__slots__ if hasattr(self, name)}
+
+
+    def _refresh(self, other):
+        for key, value in other._state().items():
+            setattr(self, key, value)
+
+        for key in ["_blubber_row", "_blubber_names"]:
+            if hasattr(other, key): setattr(self, key, getattr(other, key))
+            elif hasattr(self, key): delattr(self, key)
+
+
+    def _loaded(self):
+        """The row this instance was built from, as a dict. None if it wasn't loaded."""
+        row = getattr(self, "_blubber_row", None)
+        if row is None or isinstance(row, dict): return row
+        return dict(zip(getattr(self, "_blubber_names", self.table_attributes), row))
+
+
+    def _changes(self, columns):
+        """
+        The primary key(s) of the loaded row and the columns whose values differ
+        from it. Attributes are matched to columns by name, with or without a
+        leading underscore (as in to_dict).
+        """
+        loaded = self._loaded()
+        _state = self._state()
+
+        values = {}
+        for column in columns:
+            if column in _state: values[column] = _state[column]
+            elif f"_{column}" in _state: values[column] = _state[f"_{column}"]
+
+        if loaded is None:
+            pkeys = {pkey: values.get(pkey) for pkey in self.table_primaries}
+            changes = {column: value for column, value in values.items() if column not in self.table_primaries}
+        else:
+            pkeys = {pkey: loaded.get(pkey) for pkey in self.table_primaries}
+            changes = {
+                column: value for column, value in values.items()
+                if column not in loaded or loaded[column] != value
+            }
+        return pkeys, changes
+
+
+    def save(self):
+        """
+        Write the columns changed since this instance was loaded with one
+        UPDATE, through `set`. Repeated changes to a column are sent once, as
+        their final value. Returns True if the row was updated, False if nothing
+        had changed (no query is made) or the row no longer exists.
+
+        Changes are found by comparing values with the loaded row, so reassign
+        lists and dicts instead of editing them in place.
+        """
+        pkeys, changes = self._changes(self._get_attributes())
+        if len(changes) == 0: return False
+
+        _instance = type(self).set(pkeys, changes)
+        if _instance is None: return False
 
-        return result is not None
+        # picks up values set by the database (triggers, defaults) and the new row
+        if _instance is not self: self._refresh(_instance)
+        return True
 
 
     def to_dict(self, serializable=True):
-        _self_dict = self.__dict__
-        if serializable:
-            _serializable_dict = {}
-            for key, value in _self_dict.items():
-                if key[0] == "_":
-                    key = key[1:]
-                if isinstance(value, datetime):
-                    _serializable_dict[key] = datetime.timestamp(value)
-                elif isinstance(value, date):
-                    _serializable_dict[key] = datetime.timestamp(value)
-                elif isinstance(value, time):
-                    _serializable_dict[key] = value.strftime("%H:%M:%S.%f")
-                elif key not in self.sensitive_attributes:
-                    _serializable_dict[key] = value
-            _self_dict = _serializable_dict
-        return _self_dict
+        _self_dict = self._state()
+        if not serializable: return _self_dict
+
+        serialize = serializer_for(type(self), tuple(_self_dict))
+        return serialize(_self_dict)
+
+
+    @staticmethod
+    def dump_json_many(instances, chunk_size=500):
+        """
+        Stream instances (a list, or an iterator like `iter_all`) as one JSON
+        array of their `to_dict()`, in string chunks, e.g. for a streamed HTTP
+        response:
+
+            return Response(Models.dump_json_many(User.iter_all()), mimetype="application/json")
+        """
+        return dump_json_many(instances, chunk_size)
 
 
     def __repr__(self): return f"<Blubber Table: {self.table_name}>"
-    def __eq__(self, other): return self.__dict__ == other.__dict__
+    def __eq__(self, other): return self._state() == other._state()
@@ -0,0 +1,108 @@
+import threading
+
+from time import monotonic
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class ModelCache:
+    """
+    A bounded LRU cache of model instances keyed by primary key(s), for hot
+    tables which are read far more often than they are written. Opt in per model:
+
+        class Category(Models):
+            table_name = "categories"
+            table_primaries = ["id"]
+            cache = ModelCache(maxsize=512, ttl=300)
+
+    Models.get and Models.unique (on the primary key) read through the cache,
+    and Models.insert/set/upsert/delete keep it up to date. Models keep a copy of
+    each instance and hand out copies of it, so callers (and threads) never
+    share an instance.
+
+    maxsize => number of rows kept before the least recently used is evicted.
+
+    ttl => seconds a row stays fresh. None keeps rows until evicted.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        assert maxsize > 0, "Cache maxsize must be positive."
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key):
+        with self._lock:
+            entry = self._rows.get(key)
+            if entry is not None:
+                instance, expires = entry
+                if expires is None or expires > monotonic():
+                    self._rows.move_to_end(key)
+                    self.hits += 1
+                    return instance
+                del self._rows[key]
+            self.misses += 1
+            return None
+
+
+    def put(self, key, instance):
+        expires = None if self.ttl is None else monotonic() + self.ttl
+        with self._lock:
+            self._rows[key] = (instance, expires)
+            self._rows.move_to_end(key)
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+                self.evictions += 1
+
+
+    def invalidate(self, key):
+        with self._lock:
+            self._rows.pop(key, None)
+
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._rows),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+# (model class, primary key tuple) -> instance, set inside Models.identity_map()
+_identity_map = ContextVar("blubber_identity_map", default=None)
+
+
+@contextmanager
+def identity_map():
+    """
+    A unit of work in which each row is represented by exactly one instance:
+    fetching the same row twice returns the same object, and `Models.get` for a
+    row already seen is answered without a query. Writes refresh the instance
+    in place.
+    """
+    if _identity_map.get() is not None:
+        yield _identity_map.get()
+        return
+
+    token = _identity_map.set({})
+    try:
+        yield _identity_map.get()
+    finally:
+        _identity_map.reset(token)
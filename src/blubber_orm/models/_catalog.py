@@ -0,0 +1,254 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger('blubber-orm')
+
+# columns (name, type OID) in table order and indexes (name, primary, unique,
+# columns, access method, operator classes) for every requested table which
+# exists, in one round trip
+SQL_CATALOG = """
+    SELECT
+        t.name,
+        (
+            SELECT json_agg(json_build_array(a.attname, a.atttypid::int) ORDER BY a.attnum)
+            FROM pg_attribute a
+            WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        ),
+        (
+            SELECT json_agg(json_build_array(
+                i.relname,
+                x.indisprimary,
+                x.indisunique,
+                (
+                    SELECT json_agg(a.attname ORDER BY k.ord)
+                    FROM unnest(x.indkey) WITH ORDINALITY AS k(attnum, ord)
+                    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+                ),
+                am.amname,
+                (
+                    SELECT json_agg(o.opcname ORDER BY k.ord)
+                    FROM unnest(x.indclass::oid[]) WITH ORDINALITY AS k(opclass, ord)
+                    JOIN pg_opclass o ON o.oid = k.opclass
+                )
+            ))
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_am am ON am.oid = i.relam
+            WHERE x.indrelid = c.oid
+        )
+    FROM unnest(%s::text[]) AS t(name)
+    JOIN pg_class c ON c.oid = to_regclass(t.name);
+    """
+
+
+class TableSchema:
+    """
+    What the catalog knows about one table.
+
+    columns => column names in table order, `column_set` the same as a
+    frozenset for membership checks.
+
+    types => column name -> type OID, as in cursor.description.
+
+    primary_keys => column names of the primary key, in index order.
+
+    indexes => list of (name, columns, unique, method, opclasses) for every
+    index on the table, where method is the access method ("btree", "gin", ...)
+    and opclasses the operator class of each key column ("gin_trgm_ops", ...).
+    """
+
+    __slots__ = ("name", "columns", "column_set", "types", "primary_keys", "indexes", "_raw")
+
+    def __init__(self, name, columns, indexes):
+        self.name = name
+        self.columns = tuple(column for column, _ in columns)
+        self.column_set = frozenset(self.columns)
+        self.types = {column: type_code for column, type_code in columns}
+
+        self.primary_keys = ()
+        self.indexes = []
+        for index in indexes:
+            index_name, primary, unique, index_columns = index[:4]
+            # cache files written before access methods were loaded have none
+            method, opclasses = index[4:6] if len(index) >= 6 else (None, None)
+
+            index_columns = tuple(index_columns or ())
+            if primary: self.primary_keys = index_columns
+            self.indexes.append((index_name, index_columns, unique, method, tuple(opclasses or ())))
+
+        self._raw = [name, columns, indexes]
+
+
+class SchemaCatalog:
+    """
+    Columns, types, primary keys and indexes of every registered model's table.
+
+    Models register their table when the class is defined. The first model to
+    need its columns loads every registered table at once, with one query
+    (see `load`), instead of one `SELECT * ... LIMIT 0` per model.
+
+    With BLUBBER_SCHEMA_CACHE set to a file path and BLUBBER_SCHEMA_VERSION set
+    to the version of the schema (e.g. the last migration applied), the catalog
+    is also saved to that file and later processes read it instead of querying.
+    A file written for another schema version is ignored.
+    """
+
+    _instance = None
+
+    def __init__(self):
+        if SchemaCatalog._instance:
+            raise Exception("SchemaCatalog instance should only be created once.")
+        else:
+            self._cache_config = None
+            self._registered = []
+            self._tables = {}
+            self._lock = threading.RLock()
+            self._file_loaded = False
+            SchemaCatalog._instance = self
+
+    @staticmethod
+    def get_instance():
+        if SchemaCatalog._instance is None:
+            SchemaCatalog()
+        return SchemaCatalog._instance
+
+    @staticmethod
+    def get_cache_config():
+        path = os.environ.get("BLUBBER_SCHEMA_CACHE", None)
+        version = os.environ.get("BLUBBER_SCHEMA_VERSION", None)
+        if path is not None and version is None:
+            logger.warning("BLUBBER_SCHEMA_CACHE is set without BLUBBER_SCHEMA_VERSION, the cache is not used.")
+            path = None
+        return path, version
+
+
+    def register(self, table_name):
+        with self._lock:
+            if table_name not in self._registered:
+                self._registered.append(table_name)
+
+
+    def get(self, table_name, connection):
+        """
+        The TableSchema of a table, or None if it doesn't exist. Tables which
+        aren't known yet are loaded with every other registered table.
+
+        connection => a callable returning a context manager which yields a
+        psycopg2 connection, e.g. Blubber.connection.
+        """
+        table = self._tables.get(table_name)
+        if table is not None: return table
+
+        self.register(table_name)
+        self.load(connection)
+        return self._tables.get(table_name)
+
+
+    def load(self, connection):
+        """
+        Load every registered table not loaded yet, from the cache file if it
+        has them or else with one query. Call it at start up to warm a worker.
+        """
+        with self._lock:
+            self._read_file()
+
+            missing = [name for name in self._registered if name not in self._tables]
+            if len(missing) == 0: return
+
+            with connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(SQL_CATALOG, (missing, ))
+                    results = cursor.fetchall()
+
+            self._add(results)
+            self._write_file()
+
+
+    async def get_async(self, table_name, connection):
+        """`get` for psycopg 3 async connections, e.g. AsyncBlubber.connection."""
+        table = self._tables.get(table_name)
+        if table is not None: return table
+
+        self.register(table_name)
+        self._read_file()
+
+        missing = [name for name in self._registered if name not in self._tables]
+        if len(missing) > 0:
+            async with connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(SQL_CATALOG, (missing, ))
+                    results = await cursor.fetchall()
+
+            with self._lock:
+                self._add(results)
+                self._write_file()
+
+        return self._tables.get(table_name)
+
+
+    def _add(self, results):
+        for name, columns, indexes in results:
+            self._tables[name] = TableSchema(name, columns or [], indexes or [])
+        logger.debug("Schema catalog loaded: %s", [name for name, _, _ in results])
+
+
+    # the cache settings are read on first use rather than at import
+    @property
+    def path(self):
+        if self._cache_config is None: self._cache_config = SchemaCatalog.get_cache_config()
+        return self._cache_config[0]
+
+    @property
+    def version(self):
+        if self._cache_config is None: self._cache_config = SchemaCatalog.get_cache_config()
+        return self._cache_config[1]
+
+
+    def _read_file(self):
+        if self.path is None or self._file_loaded: return
+        self._file_loaded = True
+
+        try:
+            with open(self.path, "r") as cache_file:
+                cached = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read the schema cache %s: %s", self.path, e)
+            return
+
+        if cached.get("version") != self.version:
+            logger.info("Schema cache %s is for version %s, not %s.", self.path, cached.get("version"), self.version)
+            return
+
+        self._add(cached.get("tables", []))
+
+
+    def _write_file(self):
+        if self.path is None: return
+
+        cached = {
+            "version": self.version,
+            "tables": [table._raw for table in self._tables.values()]
+        }
+
+        # write then rename, so other processes never read half a file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as cache_file:
+                json.dump(cached, cache_file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Could not write the schema cache %s: %s", self.path, e)
+
+
+    def clear(self):
+        """
+        Forget every loaded table. Models keep the columns and types they
+        already read: after a migration, call Models.reset_schema instead.
+        """
+        with self._lock:
+            self._tables = {}
+            self._file_loaded = True
@@ -0,0 +1,71 @@
+from datetime import timezone
+
+
+# Postgres type OIDs (cursor.description type_code) => NumPy dtype
+INTEGER_TYPES = {20: "int64", 21: "int16", 23: "int32"}
+FLOAT_TYPES = {700: "float32", 701: "float64", 1700: "float64"}
+BOOLEAN_TYPES = {16: "bool"}
+DATETIME_TYPES = {1114: "datetime64[us]", 1184: "datetime64[us]", 1082: "datetime64[D]"}
+TIMEZONE_TYPES = {1184}
+
+RESULT_FORMATS = [None, "columns", "numpy"]
+
+
+def fetch_columns(cursor, as_="columns", batch_size=10000):
+    """
+    Read the rest of an executed cursor column by column, without building a
+    dict or model instance per row.
+
+    as_ => "columns" returns {column: list of values}. "numpy" returns
+    {column: numpy array}, typed for integer, float, boolean, date and timestamp
+    columns (timestamps with time zone are converted to UTC). Integer and boolean
+    columns containing NULLs fall back to float64 (NaN) and object arrays.
+    """
+    assert as_ in RESULT_FORMATS[1:], "Error: invalid result format."
+
+    names = [attr.name for attr in cursor.description]
+    columns = [[] for _ in names]
+
+    while True:
+        results = cursor.fetchmany(batch_size)
+        if len(results) == 0: break
+
+        for column, values in zip(columns, zip(*results)):
+            column.extend(values)
+
+    if as_ == "columns":
+        return dict(zip(names, columns))
+
+    try:
+        import numpy
+    except ImportError:
+        raise Exception("ImportError: as_='numpy' requires numpy, install blubber-orm[numpy].")
+
+    type_codes = [attr.type_code for attr in cursor.description]
+    return {
+        name: _to_array(numpy, type_code, column)
+        for name, type_code, column in zip(names, type_codes, columns)
+    }
+
+
+def _to_array(numpy, type_code, column):
+    has_nulls = None in column
+
+    if type_code in INTEGER_TYPES:
+        if has_nulls: return numpy.array(column, dtype="float64")
+        return numpy.array(column, dtype=INTEGER_TYPES[type_code])
+
+    if type_code in FLOAT_TYPES:
+        return numpy.array(column, dtype=FLOAT_TYPES[type_code])
+
+    if type_code in BOOLEAN_TYPES:
+        if has_nulls: return numpy.fromiter(column, dtype="object", count=len(column))
+        return numpy.array(column, dtype="bool")
+
+    if type_code in DATETIME_TYPES:
+        if type_code in TIMEZONE_TYPES:
+            column = [None if value is None else value.astimezone(timezone.utc).replace(tzinfo=None) for value in column]
+        return numpy.array(column, dtype=DATETIME_TYPES[type_code])
+
+    # fromiter keeps array values (e.g. text[] columns) as single objects
+    return numpy.fromiter(column, dtype="object", count=len(column))
@@ -1,26 +1,36 @@
 import os
 import logging
+import threading
+from time import monotonic
+from functools import partial
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
 from psycopg2 import connect
-from uritools import urisplit
+
+from ._pool import ConnectionPool, ReplicaSet
+from ._session import Session, _session
 
 
 class Blubber:
-    """A class to store a connection to the Postgres database using psycopg2."""
+    """A class to store a pool of connections to the Postgres database using psycopg2."""
 
     _instance = None
     _debug = None
-    conn = None
+    _lock = threading.Lock()
+    pool = None
+    replicas = None
+
+    # when this thread or task last committed, for the read-your-writes window
+    _last_write = ContextVar("blubber_last_write", default=None)
 
+    # nothing is read from the environment and no connection is made until the
+    # first query, so importing blubber_orm stays cheap (see `get_pool`)
     def __init__(self):
         if Blubber._instance:
             #TODO: log that this problem happened
             raise Exception("Database instance should only be created once.")
         else:
-            Blubber._debug = Blubber.get_debug()
-            Blubber.conn = Blubber.open_conn()
             Blubber._instance = self
-            if Blubber._debug:
-                logging.info("Database connection: ", Blubber.conn)
 
     @staticmethod
     def get_instance():
@@ -41,6 +51,37 @@ class Blubber:
         else:
             raise Exception("ExportError: BLUBBER_DEBUG config must be either 0 or 1.")
 
+    @staticmethod
+    def get_pool_size():
+        try:
+            minconn = int(os.environ.get("BLUBBER_POOL_MIN", 1))
+            maxconn = int(os.environ.get("BLUBBER_POOL_MAX", 10))
+        except ValueError:
+            raise Exception("ExportError: BLUBBER_POOL_MIN and BLUBBER_POOL_MAX must be integers.")
+        return minconn, maxconn
+
+    @staticmethod
+    def get_pool_ping():
+        ping = os.environ.get("BLUBBER_POOL_PING", "0")
+        if ping not in ["0", "1"]:
+            raise Exception("ExportError: BLUBBER_POOL_PING config must be either 0 or 1.")
+        return ping == "1"
+
+    @staticmethod
+    def get_replica_config():
+        uris = os.environ.get("DATABASE_REPLICA_URLS", "")
+        uris = [uri.strip() for uri in uris.split(",") if uri.strip()]
+
+        strategy = os.environ.get("BLUBBER_REPLICA_STRATEGY", "round_robin")
+        if strategy not in ReplicaSet.STRATEGIES:
+            raise Exception("ExportError: BLUBBER_REPLICA_STRATEGY must be either round_robin or least_connections.")
+
+        try:
+            read_your_writes = float(os.environ.get("BLUBBER_READ_YOUR_WRITES", 0))
+        except ValueError:
+            raise Exception("ExportError: BLUBBER_READ_YOUR_WRITES must be a number of seconds.")
+        return uris, strategy, read_your_writes
+
 
     @staticmethod
     def format_to_dict(cursor, result):
@@ -51,6 +92,8 @@ class Blubber:
 
     @staticmethod
     def parse_uri(database_uri):
+        from uritools import urisplit
+
         not_postgres_error = "This URI is not for a PostgreSQL database."
         assert("postgres://" in database_uri or "postgresql://" in database_uri), not_postgres_error
         uri_credentials = urisplit(database_uri)
@@ -67,11 +110,12 @@ class Blubber:
 
     #returns a database connection by reading the uri from the environment
     @classmethod
-    def open_conn(cls, debug=None):
+    def open_conn(cls, debug=None, database_uri=None):
         conn = None
         try:
             #build exception for when URI cannot be found in environment
-            database_uri = os.environ.get("DATABASE_URL", "Connection Failed.")
+            if database_uri is None:
+                database_uri = os.environ.get("DATABASE_URL", "Connection Failed.")
             credentials = Blubber.parse_uri(database_uri)
         except AssertionError as not_postgres_error:
             print(not_postgres_error)
@@ -92,9 +136,234 @@ class Blubber:
             return conn
 
 
-    #we need to close the db and the connect established in 'open_conn'
+    #returns a pool which hands out connections made by 'open_conn'
+    @classmethod
+    def open_pool(cls, minconn=None, maxconn=None, **kwargs):
+        default_minconn, default_maxconn = Blubber.get_pool_size()
+        if minconn is None: minconn = default_minconn
+        if maxconn is None: maxconn = default_maxconn
+        kwargs.setdefault("ping", Blubber.get_pool_ping())
+        return ConnectionPool(cls.open_conn, minconn=minconn, maxconn=maxconn, **kwargs)
+
+
+    #returns a pool per replica in DATABASE_REPLICA_URLS, or None without replicas
+    @classmethod
+    def open_replicas(cls, **kwargs):
+        uris, strategy, read_your_writes = Blubber.get_replica_config()
+        if len(uris) == 0: return None
+
+        minconn, maxconn = Blubber.get_pool_size()
+        kwargs.setdefault("ping", Blubber.get_pool_ping())
+        pools = [
+            ConnectionPool(partial(cls.open_conn, database_uri=uri), minconn=minconn, maxconn=maxconn, **kwargs)
+            for uri in uris
+        ]
+        return ReplicaSet(pools, strategy=strategy, read_your_writes=read_your_writes)
+
+
+    #opens the pool on first use, once even if threads race for it
+    @classmethod
+    def get_pool(cls):
+        if cls.pool is None:
+            with cls._lock:
+                if cls.pool is None:
+                    Blubber._debug = Blubber.get_debug()
+                    cls.replicas = cls.open_replicas()
+                    cls.pool = cls.open_pool()
+                    if Blubber._debug:
+                        logging.info(f"Database pool: {cls.pool.stats()}")
+                        if cls.replicas: logging.info(f"Replica pools: {cls.replicas.stats()}")
+        return cls.pool
+
+
+    #borrow a connection from the pool, returned when the block exits
+    @classmethod
+    def connection(cls, pinned=True, readonly=False):
+        pool = cls.get_pool()
+        if readonly and cls.replicas is not None and cls._reads_from_replica(pool):
+            return cls.replicas.connection(pinned=pinned)
+        return pool.connection(pinned=pinned)
+
+
+    #reads stay on the primary inside a transaction, and after a commit while
+    #the read-your-writes window lasts
+    @classmethod
+    def _reads_from_replica(cls, pool):
+        if _session.get() is not None: return False
+        if pool.pinned() is not None: return False
+
+        last_write = cls._last_write.get()
+        if last_write is not None and monotonic() - last_write < cls.replicas.read_your_writes:
+            return False
+        return True
+
+
+    #a unit of work: queued writes flushed and committed once when the block exits
+    @classmethod
+    @contextmanager
+    def session(cls):
+        if _session.get() is not None:
+            yield _session.get()
+            return
+
+        with cls.connection() as conn:
+            session = Session(conn)
+            token = _session.set(session)
+            try:
+                yield session
+                session.flush()
+                conn.commit()
+                session._discard_cached()
+                cls._last_write.set(monotonic())
+            except BaseException:
+                session.rollback()
+                raise
+            finally:
+                _session.reset(token)
+
+
+    #commit the work done on 'conn', unless a session will commit it later
+    @classmethod
+    def commit(cls, conn):
+        if _session.get() is None:
+            conn.commit()
+            cls._last_write.set(monotonic())
+
+
+    @staticmethod
+    def in_session():
+        return _session.get() is not None
+
+
+    #call in a forked child (e.g. gunicorn's post_fork) before any query; also
+    #run automatically on os.fork, and pools check the PID on checkout anyway
+    @classmethod
+    def after_fork(cls):
+        cls._lock = threading.Lock()
+        if cls.pool: cls.pool.after_fork()
+        if cls.replicas: cls.replicas.after_fork()
+
+
+    #we need to close the pool and the connections established in 'open_conn'
     @classmethod
     def close_conn(cls):
-        if cls.conn:
-            cls.conn.close()
-            cls.conn = None
+        if cls.pool:
+            cls.pool.closeall()
+            cls.pool = None
+        if cls.replicas:
+            cls.replicas.closeall()
+            cls.replicas = None
+
+
+class AsyncBlubber:
+    """
+    The asyncio counterpart of Blubber. Stores a psycopg 3 AsyncConnectionPool
+    built from the same DATABASE_URL and pool size settings.
+
+    psycopg 3 is an optional dependency: `pip install blubber-orm[async]`.
+    """
+
+    _instance = None
+    _lock = None
+    pool = None
+
+    # the connection borrowed by the current task, so nested AsyncModels calls
+    # (e.g. insert -> get) run on the same connection.
+    _task_conn = ContextVar("blubber_task_conn", default=None)
+
+    def __init__(self):
+        if AsyncBlubber._instance:
+            raise Exception("Async database instance should only be created once.")
+        else:
+            AsyncBlubber._instance = self
+
+    @staticmethod
+    def get_instance():
+        if AsyncBlubber._instance is None:
+            AsyncBlubber()
+        return AsyncBlubber._instance
+
+
+    @classmethod
+    async def open_pool(cls, minconn=None, maxconn=None, **kwargs):
+        try:
+            from psycopg_pool import AsyncConnectionPool
+        except ImportError:
+            raise Exception("ImportError: AsyncBlubber requires psycopg 3, install blubber-orm[async].")
+
+        database_uri = os.environ.get("DATABASE_URL", "Connection Failed.")
+        credentials = Blubber.parse_uri(database_uri)
+
+        default_minconn, default_maxconn = Blubber.get_pool_size()
+        if minconn is None: minconn = default_minconn
+        if maxconn is None: maxconn = default_maxconn
+
+        pool = AsyncConnectionPool(
+            kwargs=credentials,
+            min_size=minconn,
+            max_size=maxconn,
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+            **kwargs
+        )
+        await pool.open()
+        return pool
+
+
+    #opens the pool on first use, inside the running event loop
+    @classmethod
+    async def get_pool(cls):
+        if cls.pool is None:
+            if cls._lock is None:
+                # imported here: asyncio is slow to import and only needed by async apps
+                import asyncio
+                cls._lock = asyncio.Lock()
+            async with cls._lock:
+                if cls.pool is None:
+                    cls.pool = await cls.open_pool()
+        return cls.pool
+
+
+    #borrow a connection from the pool for the current task
+    @classmethod
+    @asynccontextmanager
+    async def connection(cls):
+        conn = cls._task_conn.get()
+        if conn is not None:
+            yield conn
+            return
+
+        pool = await cls.get_pool()
+        async with pool.connection() as conn:
+            token = cls._task_conn.set(conn)
+            try:
+                yield conn
+            finally:
+                cls._task_conn.reset(token)
+
+
+    #in a forked child: the inherited pool belongs to the parent's event loop
+    #and worker threads, so a new one is opened on first use. The old one is
+    #kept referenced, never closed, so its connections aren't finalized here.
+    @classmethod
+    def after_fork(cls):
+        if cls.pool is not None: _inherited_pools.append(cls.pool)
+        cls.pool = None
+        cls._lock = None
+        cls._task_conn.set(None)
+
+
+    @classmethod
+    async def close_conn(cls):
+        if cls.pool:
+            await cls.pool.close()
+            cls.pool = None
+            cls._lock = None
+
+
+# pools a forked child inherited from its parent, see AsyncBlubber.after_fork
+_inherited_pools = []
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Blubber.after_fork)
+    os.register_at_fork(after_in_child=AsyncBlubber.after_fork)
@@ -0,0 +1,394 @@
+import io
+import os
+import csv
+import json
+import codecs
+import logging
+import psycopg2
+
+from time import perf_counter
+from decimal import Decimal
+from itertools import chain
+from datetime import datetime, date, time
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+
+logger = logging.getLogger('blubber-orm')
+
+COPY_FORMATS = ["csv", "binary"]
+
+# every COPY BINARY stream starts with an 11 byte signature, 4 bytes of flags
+# and the 4 byte length of a header extension, and ends with a -1 field count
+BINARY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+BINARY_TRAILER = b"\xff\xff"
+
+# partitions are spooled in memory up to this size, then on disk
+SPOOL_SIZE = 64 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+def _copy_options(format, header):
+    if format == "binary": return "(FORMAT binary)"
+    return "(FORMAT csv, HEADER true)" if header else "(FORMAT csv)"
+
+
+def _select(model, columns):
+    if columns is None: return "*"
+    assert model.verify_attributes(list(columns)), "Error: invalid column name."
+    return ", ".join(columns)
+
+
+def _open_target(target, format):
+    """(stream, close?) for a path or an already open stream."""
+    if isinstance(target, (str, os.PathLike)):
+        return open(target, "wb"), True
+    if format == "binary":
+        assert not isinstance(target, io.TextIOBase), "Error: binary exports need a binary stream."
+    return target, False
+
+
+def export(model, target, format="csv", partitions=1, columns=None, header=True):
+    """See Models.export."""
+    assert format in COPY_FORMATS, "Error: invalid export format."
+    assert isinstance(partitions, int) and partitions > 0, "Error: partitions must be a positive integer."
+
+    select = _select(model, columns)
+    stream, close = _open_target(target, format)
+    try:
+        # partitions need a connection each besides the coordinator's, a pool
+        # of one could never hand them out
+        if partitions == 1 or model.db.get_pool().maxconn < 2:
+            return _export_one(model, stream, select, format, header)
+        return _export_partitioned(model, stream, select, format, header, partitions)
+    finally:
+        if close: stream.close()
+
+
+def _export_one(model, stream, select, format, header):
+    if select == "*": source = model.table_name
+    else: source = f"(SELECT {select} FROM {model.table_name})"
+    SQL = f"COPY {source} TO STDOUT WITH {_copy_options(format, header)};"
+
+    with model.db.connection(readonly=True) as conn:
+        with conn.cursor() as cursor:
+            with model.instrumentation.track(model, "export", SQL) as event:
+                cursor.copy_expert(SQL, stream, size=CHUNK_SIZE)
+                event.rowcount = cursor.rowcount
+    return event.rowcount
+
+
+def _partition_bounds(cursor, model, partitions):
+    """The lowest first primary key value of each of `partitions` even ranges."""
+    pkey = model.table_primaries[0]
+    SQL = f"""
+        SELECT bound
+        FROM (
+            SELECT min({pkey}) AS bound
+            FROM (
+                SELECT {pkey}, ntile(%s) OVER (ORDER BY {pkey}) AS part
+                FROM {model.table_name}
+            ) AS parts
+            GROUP BY part
+        ) AS bounds
+        ORDER BY bound;
+        """
+    model._execute(cursor, "export_bounds", SQL, (partitions, ))
+    # rows sharing a first key value (composite keys) may straddle two tiles
+    return list(dict.fromkeys(bound for bound, in cursor.fetchall()))
+
+
+def _export_partitioned(model, stream, select, format, header, partitions):
+    # imported here: slow to import, and only partitioned exports need them
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    pkey = model.table_primaries[0]
+
+    # all partitions read the same snapshot, taken by this coordinating
+    # connection and held open until every partition is written
+    with model.db.connection(pinned=False) as conn:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+                cursor.execute("SELECT pg_export_snapshot();")
+                snapshot, = cursor.fetchone()
+
+                # workers only get the connections nobody holds, e.g. not this
+                # thread's session connection, or they would wait for ever
+                pool = model.db.get_pool()
+                workers = pool.maxconn - pool.in_use()
+
+                bounds = [] if workers < 1 else _partition_bounds(cursor, model, partitions)
+                if len(bounds) < 2:
+                    return _export_snapshot(model, cursor, stream, f"SELECT {select} FROM {model.table_name}", format, header)
+
+                statements = []
+                for i, bound in enumerate(bounds):
+                    conds = []
+                    if i > 0: conds.append(cursor.mogrify(f"{pkey} >= %s", (bound, )).decode())
+                    if i < len(bounds) - 1: conds.append(cursor.mogrify(f"{pkey} < %s", (bounds[i + 1], )).decode())
+                    statements.append(f"SELECT {select} FROM {model.table_name} WHERE {' AND '.join(conds)}")
+
+            workers = min(len(statements), workers)
+            spools = [tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) for _ in statements]
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = [
+                        executor.submit(_export_partition, model, snapshot, SQL, spool, format, header and i == 0)
+                        for i, (SQL, spool) in enumerate(zip(statements, spools))
+                    ]
+                    rowcount = sum(future.result() for future in futures)
+
+                for i, spool in enumerate(spools):
+                    _append(stream, spool, format, first=(i == 0), last=(i == len(spools) - 1))
+            finally:
+                for spool in spools: spool.close()
+        finally:
+            conn.rollback()
+
+    return rowcount
+
+
+def _export_partition(model, snapshot, SQL, spool, format, header):
+    with model.db.connection(pinned=False) as conn:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+                cursor.execute("SET TRANSACTION SNAPSHOT %s;", (snapshot, ))
+                return _export_snapshot(model, cursor, spool, SQL, format, header)
+        finally:
+            conn.rollback()
+
+
+def _export_snapshot(model, cursor, stream, select_SQL, format, header):
+    SQL = f"COPY ({select_SQL}) TO STDOUT WITH {_copy_options(format, header)};"
+    with model.instrumentation.track(model, "export", SQL) as event:
+        cursor.copy_expert(SQL, stream, size=CHUNK_SIZE)
+        event.rowcount = cursor.rowcount
+    return event.rowcount
+
+
+def _append(stream, spool, format, first, last):
+    """
+    Copy a partition to the target. Binary partitions are complete COPY files:
+    only the first keeps its header, only the last its trailer.
+    """
+    spool.seek(0, os.SEEK_END)
+    end = spool.tell()
+    spool.seek(0)
+
+    if format == "binary":
+        if not first:
+            head = spool.read(len(BINARY_SIGNATURE) + 8)
+            assert head.startswith(BINARY_SIGNATURE), "Error: invalid COPY BINARY data."
+            spool.seek(int.from_bytes(head[-4:], "big"), os.SEEK_CUR)
+        if not last:
+            end -= len(BINARY_TRAILER)
+
+    # a chunk may end inside a character, the decoder carries it over
+    decode = codecs.getincrementaldecoder("utf-8")().decode if isinstance(stream, io.TextIOBase) else None
+
+    remaining = end - spool.tell()
+    while remaining > 0:
+        chunk = spool.read(min(CHUNK_SIZE, remaining))
+        remaining -= len(chunk)
+        stream.write(decode(chunk, final=(remaining == 0)) if decode else chunk)
+
+
+def _quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _array(values):
+    items = []
+    for value in values:
+        if value is None: items.append("NULL")
+        elif isinstance(value, (list, tuple)): items.append(_array(value))
+        else: items.append('"' + _text(value).replace("\\", "\\\\").replace('"', '\\"') + '"')
+    return "{" + ",".join(items) + "}"
+
+
+def _text(value):
+    """A Python value as Postgres reads it in a COPY text field."""
+    if isinstance(value, str): return value
+    if isinstance(value, (list, tuple)): return _array(value)
+    if isinstance(value, dict): return json.dumps(value)
+    if isinstance(value, (bytes, bytearray, memoryview)): return "\\x" + bytes(value).hex()
+    if isinstance(value, (datetime, date, time)): return value.isoformat()
+    return str(value)
+
+
+# unquoted empty is NULL in COPY csv, so every other value is quoted, except
+# numbers which can't be empty
+_fields = {
+    type(None): lambda value: "",
+    str: _quote,
+    int: str,
+    float: str,
+    bool: lambda value: "true" if value else "false",
+}
+
+
+def _csv_field(value):
+    field = _fields.get(type(value))
+    if field is None:
+        # conversions by type are looked up once, then by exact type
+        if isinstance(value, bool): field = _fields[bool]
+        elif isinstance(value, (int, float)) and not isinstance(value, Decimal): field = str
+        else: field = lambda value: _quote(_text(value))
+        _fields[type(value)] = field
+    return field(value)
+
+
+class RowStream:
+    """
+    A read-only file over an iterator of rows (dicts or tuples), which COPY
+    FROM STDIN reads as CSV. Rows are encoded as they are read, so the iterator
+    is never held in memory.
+    """
+
+    def __init__(self, rows, columns):
+        self.columns = list(columns)
+        self.rows = 0
+        self._rows = iter(rows)
+        self._buffer = b""
+
+
+    def _encode(self, row):
+        if isinstance(row, dict): row = [row[column] for column in self.columns]
+        assert len(row) == len(self.columns), "Error: every row must have a value for each column."
+        self.rows += 1
+        field = _csv_field
+        return (",".join([field(value) for value in row]) + "\n").encode("utf-8")
+
+
+    def read(self, size=-1):
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None: break
+            part = self._encode(row)
+            parts.append(part)
+            length += len(part)
+
+        data = b"".join(parts)
+        if size < 0 or length <= size:
+            self._buffer = b""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _read_header(stream):
+    line = stream.readline()
+    if isinstance(line, bytes): line = line.decode("utf-8")
+    return next(csv.reader([line]))
+
+
+def _source(model, source, columns, format, header):
+    """(stream, columns, close?) for a path, an open file or an iterator of rows."""
+    if isinstance(source, (str, os.PathLike)):
+        stream, close = open(source, "rb"), True
+    elif hasattr(source, "read"):
+        stream, close = source, False
+    else:
+        assert format == "csv", "Error: rows are loaded as csv."
+        rows = iter(source)
+        first = next(rows, None)
+        if first is None: return None, columns, False
+
+        if columns is None:
+            columns = list(first.keys()) if isinstance(first, dict) else model._get_attributes()
+        return RowStream(chain([first], rows), columns), columns, False
+
+    # a CSV header names the columns, in the file's order
+    if format == "csv" and header:
+        names = _read_header(stream)
+        if columns is None: columns = names
+    return stream, columns, close
+
+
+def load(model, source, columns=None, format="csv", header=True, on_conflict="fail"):
+    """See Models.load."""
+    assert format in COPY_FORMATS, "Error: invalid load format."
+    assert on_conflict in ["fail", "skip", "upsert"], "Error: invalid conflict policy."
+
+    start = perf_counter()
+    stream, columns, close = _source(model, source, columns, format, header)
+    try:
+        if stream is None: rows = 0
+        else: rows = _load(model, stream, columns, format, on_conflict)
+    finally:
+        if close: stream.close()
+
+    if rows is None: return None
+
+    seconds = perf_counter() - start
+    stats = {"rows": rows, "seconds": seconds, "rows_per_s": rows / seconds if seconds else None}
+    logger.info("Loaded %s rows into %s in %.2f s (%.0f rows/s).", rows, model.table_name, seconds, stats["rows_per_s"] or 0)
+    return stats
+
+
+def _load(model, stream, columns, format, on_conflict):
+    if columns is None: columns = model._get_attributes()
+    assert model.verify_attributes(list(columns)), "Error: invalid column name."
+    column_list = ", ".join(columns)
+    options = "(FORMAT binary)" if format == "binary" else "(FORMAT csv)"
+
+    with model.db.connection() as conn:
+        with conn.cursor() as cursor:
+            try:
+                if on_conflict == "fail":
+                    rows = _copy_from(model, cursor, model.table_name, column_list, options, stream)
+                else:
+                    rows = _merge(model, cursor, columns, column_list, options, stream, on_conflict)
+
+            except psycopg2.errors.UniqueViolation as e:
+                # inside a session the error rolls back the whole unit of work
+                if model.db.in_session(): raise
+                logger.error(e, exc_info=True)
+                conn.rollback()
+                return None
+
+            model.db.commit(conn)
+
+    # cached rows may have been overwritten
+    if model.cache is not None and on_conflict == "upsert": model.cache.clear()
+    return rows
+
+
+def _copy_from(model, cursor, table_name, column_list, options, stream):
+    SQL = f"COPY {table_name} ({column_list}) FROM STDIN WITH {options};"
+    with model.instrumentation.track(model, "load", SQL) as event:
+        cursor.copy_expert(SQL, stream, size=CHUNK_SIZE)
+        event.rowcount = cursor.rowcount
+    return event.rowcount
+
+
+def _merge(model, cursor, columns, column_list, options, stream, on_conflict):
+    """COPY into a temporary table, then INSERT ... ON CONFLICT from it."""
+    staging = "blubber_load_" + model.table_name.replace(".", "_")
+    pkey = ", ".join(model.table_primaries)
+
+    model._execute(cursor, "load", f"CREATE TEMP TABLE {staging} (LIKE {model.table_name} INCLUDING DEFAULTS) ON COMMIT DROP;")
+    try:
+        _copy_from(model, cursor, staging, column_list, options, stream)
+
+        updates = ", ".join([f"{column} = EXCLUDED.{column}" for column in columns if column not in model.table_primaries])
+        if on_conflict == "skip" or updates == "":
+            select = f"SELECT {column_list} FROM {staging}"
+            conflict = "ON CONFLICT DO NOTHING"
+        else:
+            # a row may only be updated once per statement: the last copy of
+            # a primary key in the source wins
+            select = f"SELECT DISTINCT ON ({pkey}) {column_list} FROM {staging} ORDER BY {pkey}, ctid DESC"
+            conflict = f"ON CONFLICT ({pkey}) DO UPDATE SET {updates}"
+
+        SQL = f"INSERT INTO {model.table_name} ({column_list}) {select} {conflict};"
+        model._execute(cursor, "load", SQL)
+        return cursor.rowcount
+    finally:
+        # the staging table is dropped at commit anyway, but a session may
+        # load the same table again before that
+        if not cursor.connection.closed and cursor.connection.get_transaction_status() != TRANSACTION_STATUS_INERROR:
+            model._execute(cursor, "load", f"DROP TABLE IF EXISTS {staging};")
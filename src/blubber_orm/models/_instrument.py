@@ -0,0 +1,201 @@
+import os
+import logging
+import threading
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+logger = logging.getLogger('blubber-orm')
+
+
+class QueryEvent:
+    """
+    What hooks receive about one query. `rowcount`, `elapsed` (seconds) and
+    `error` are only filled in for the post-execute hooks.
+    """
+
+    __slots__ = ("model", "operation", "sql", "params", "rowcount", "elapsed", "error")
+
+    def __init__(self, model, operation, sql, params):
+        self.model = model
+        self.operation = operation
+        self.sql = sql
+        self.params = params
+        self.rowcount = None
+        self.elapsed = None
+        self.error = None
+
+
+class LatencyHistogram:
+    """Counts query latencies into fixed buckets (upper bounds in milliseconds)."""
+
+    BUCKETS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+
+    def record(self, elapsed_ms):
+        self.counts[bisect_left(self.BUCKETS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.max_ms: self.max_ms = elapsed_ms
+
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the given percentile."""
+        if self.count == 0: return None
+
+        rank = self.count * percent / 100
+        seen = 0
+        for bucket, count in zip(self.BUCKETS, self.counts):
+            seen += count
+            if seen >= rank: return min(bucket, self.max_ms)
+        return self.max_ms
+
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total_ms,
+            "mean_ms": self.total_ms / self.count if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max_ms,
+            "buckets": dict(zip(self.BUCKETS, self.counts))
+        }
+
+
+class Instrumentation:
+    """
+    Times every query issued by Models and AsyncModels.
+
+    - pre/post-execute hooks, called with a QueryEvent:
+        instrumentation.add_hook(after=lambda event: statsd.timing(...))
+    - a LatencyHistogram per (table, operation), see `stats()`.
+    - a slow query log: queries slower than `slow_query_ms` (env
+      BLUBBER_SLOW_QUERY_MS, off by default) are logged as warnings.
+
+    Set `enabled = False` to run queries with no timing at all.
+    """
+
+    _instance = None
+
+    def __init__(self):
+        if Instrumentation._instance:
+            raise Exception("Instrumentation instance should only be created once.")
+        else:
+            self.enabled = True
+            self._slow_query_ms = None
+            self._slow_query_read = False
+            self._before = []
+            self._after = []
+            self._histograms = {}
+            self._lock = threading.Lock()
+            Instrumentation._instance = self
+
+    @staticmethod
+    def get_instance():
+        if Instrumentation._instance is None:
+            Instrumentation()
+        return Instrumentation._instance
+
+    @staticmethod
+    def get_slow_query_ms():
+        _slow_query_ms = os.environ.get("BLUBBER_SLOW_QUERY_MS", None)
+        if _slow_query_ms is None: return None
+        try:
+            return float(_slow_query_ms)
+        except ValueError:
+            raise Exception("ExportError: BLUBBER_SLOW_QUERY_MS must be a number.")
+
+    # read from the environment on first use rather than at import
+    @property
+    def slow_query_ms(self):
+        if not self._slow_query_read:
+            self._slow_query_ms = Instrumentation.get_slow_query_ms()
+            self._slow_query_read = True
+        return self._slow_query_ms
+
+    @slow_query_ms.setter
+    def slow_query_ms(self, value):
+        self._slow_query_ms = value
+        self._slow_query_read = True
+
+
+    def add_hook(self, before=None, after=None):
+        if before is not None: self._before.append(before)
+        if after is not None: self._after.append(after)
+
+
+    def remove_hook(self, before=None, after=None):
+        if before in self._before: self._before.remove(before)
+        if after in self._after: self._after.remove(after)
+
+
+    @contextmanager
+    def track(self, model, operation, sql, params=None):
+        """
+        Time the query run inside the block. The block may set `event.rowcount`.
+        """
+        event = QueryEvent(model, operation, sql, params)
+        logger.debug("Query:\n\t%s", sql)
+
+        if not self.enabled:
+            yield event
+            return
+
+        for hook in self._before:
+            try:
+                hook(event)
+            except Exception as e:
+                logger.error(e, exc_info=True)
+
+        start = perf_counter()
+        try:
+            yield event
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            event.elapsed = perf_counter() - start
+            self._record(event)
+
+
+    def _record(self, event):
+        elapsed_ms = event.elapsed * 1000
+        table_name = getattr(event.model, "table_name", None)
+
+        with self._lock:
+            histogram = self._histograms.get((table_name, event.operation))
+            if histogram is None:
+                histogram = self._histograms[(table_name, event.operation)] = LatencyHistogram()
+            histogram.record(elapsed_ms)
+
+        if self.slow_query_ms is not None and elapsed_ms >= self.slow_query_ms:
+            logger.warning("Slow query (%.1f ms) %s.%s:\n\t%s", elapsed_ms, table_name, event.operation, event.sql)
+
+        for hook in self._after:
+            try:
+                hook(event)
+            except Exception as e:
+                logger.error(e, exc_info=True)
+
+
+    def stats(self):
+        """Latency snapshot per "table.operation"."""
+        with self._lock:
+            return {
+                f"{table_name}.{operation}": histogram.snapshot()
+                for (table_name, operation), histogram in self._histograms.items()
+            }
+
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
@@ -0,0 +1,156 @@
+from ._utils import format_query_data
+
+
+class LoaderResult:
+    """A row promised by ModelLoader.load, fetched on the first call to `get`."""
+
+    def __init__(self, loader, key):
+        self._loader = loader
+        self._key = key
+
+    def get(self):
+        if self._key in self._loader._pending:
+            self._loader.dispatch()
+        return self._loader._loaded.get(self._key)
+
+
+class ModelLoader:
+    """
+    Coalesces primary key lookups on one model into batched queries.
+
+    `load` only queues the key. The first time any queued result is read, every
+    queued key is fetched with a single `get_batch` query:
+
+        loader = User.loader()
+        users = [loader.load({"id": user_id}) for user_id in user_ids]
+        names = [user.get().name for user in users]  # one SELECT
+
+    Rows stay in the loader once fetched, so a loader should live for one
+    request (or unit of work), not for the life of the process.
+
+    Only `load` goes through the loader: Models.get still sends one query per
+    call, unlike AsyncModels.get inside `AsyncModels.batching()`.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._pending = {}
+        self._loaded = {}
+
+
+    def _key(self, pkeys):
+        assert isinstance(pkeys, dict)
+        return format_query_data(self.model.table_primaries, pkeys)
+
+
+    def load(self, pkeys):
+        key = self._key(pkeys)
+        if key not in self._loaded:
+            self._pending[key] = pkeys
+        return LoaderResult(self, key)
+
+
+    def load_many(self, pkeys_list):
+        results = [self.load(pkeys) for pkeys in pkeys_list]
+        return [result.get() for result in results]
+
+
+    def dispatch(self):
+        if len(self._pending) == 0: return
+
+        keys = list(self._pending.keys())
+        pkeys_list = list(self._pending.values())
+        self._pending = {}
+
+        _instances = self.model.get_batch(pkeys_list)
+        self._loaded.update(zip(keys, _instances))
+
+
+    def prime(self, pkeys, instance):
+        key = self._key(pkeys)
+        self._pending.pop(key, None)
+        self._loaded[key] = instance
+
+
+    def clear(self, pkeys=None):
+        if pkeys is None:
+            self._pending = {}
+            self._loaded = {}
+        else:
+            key = self._key(pkeys)
+            self._pending.pop(key, None)
+            self._loaded.pop(key, None)
+
+
+class AsyncModelLoader(ModelLoader):
+    """
+    The asyncio version of ModelLoader. Every `load` awaited in the same tick of
+    the event loop is fetched with one `get_batch` query, which is how
+    AsyncModels.get coalesces lookups inside `AsyncModels.batching()`.
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        self._futures = {}
+        self._scheduled = False
+
+
+    async def load(self, pkeys):
+        # imported here, so sync-only apps never pay for importing asyncio
+        import asyncio
+
+        key = self._key(pkeys)
+        if key in self._loaded: return self._loaded[key]
+
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            self._pending[key] = pkeys
+
+            if not self._scheduled:
+                self._scheduled = True
+                loop.call_soon(lambda: asyncio.ensure_future(self.dispatch()))
+
+        return await asyncio.shield(future)
+
+
+    async def load_many(self, pkeys_list):
+        import asyncio
+        return await asyncio.gather(*[self.load(pkeys) for pkeys in pkeys_list])
+
+
+    async def dispatch(self):
+        self._scheduled = False
+        if len(self._pending) == 0: return
+
+        keys = list(self._pending.keys())
+        pkeys_list = list(self._pending.values())
+        self._pending = {}
+
+        futures = [self._futures.pop(key) for key in keys]
+
+        try:
+            _instances = await self.model.get_batch(pkeys_list)
+        except Exception as e:
+            for future in futures:
+                if not future.done(): future.set_exception(e)
+            return
+
+        for key, future, _instance in zip(keys, futures, _instances):
+            self._loaded[key] = _instance
+            if not future.done(): future.set_result(_instance)
+
+
+    def prime(self, pkeys, instance):
+        key = self._key(pkeys)
+        if key not in self._futures:
+            self._loaded[key] = instance
+
+
+    def clear(self, pkeys=None):
+        if pkeys is None:
+            self._loaded = {}
+        else:
+            self._loaded.pop(self._key(pkeys), None)
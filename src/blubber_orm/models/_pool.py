@@ -0,0 +1,331 @@
+import os
+import logging
+import threading
+
+from time import monotonic
+from itertools import count
+from collections import deque
+from contextlib import contextmanager
+
+from psycopg2 import InterfaceError, OperationalError
+from psycopg2.extensions import (
+    TRANSACTION_STATUS_IDLE,
+    TRANSACTION_STATUS_UNKNOWN
+)
+
+logger = logging.getLogger('blubber-orm')
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of psycopg2 connections.
+
+    Connections are checked out per thread: nested `connection()` blocks in the
+    same thread borrow the same connection, so a Models call which calls another
+    Models call (e.g. insert -> get) stays on one connection. The connection goes
+    back into the pool when the outermost block exits.
+
+    connect => a callable returning a new psycopg2 connection (or None on failure).
+
+    minconn => number of connections opened up front and kept idle.
+
+    maxconn => hard limit of open connections. Threads asking for a connection
+    beyond this limit wait up to `timeout` seconds for one to be returned.
+
+    ping => if True, run `SELECT 1` on every checkout. Otherwise only the cheap
+    client-side checks (closed flag, transaction status) are done, except for
+    connections idle for longer than `ping_idle`.
+
+    ping_idle => seconds a connection may sit idle in the pool before its next
+    checkout runs `SELECT 1` anyway, to catch connections the server or a proxy
+    dropped in the meantime. None never pings them. Busy pools hand connections
+    out again well within it, so they pay no round trip.
+
+    The pool is fork-safe: a child process (gunicorn worker, multiprocessing)
+    never uses the connections it inherited, whose sockets are shared with the
+    parent. The first checkout in the child notices the new PID, orphans them
+    and opens its own, see `after_fork`.
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=30.0, ping=False, ping_idle=10.0):
+        assert 0 <= minconn <= maxconn, "Pool size must satisfy 0 <= minconn <= maxconn."
+        assert maxconn > 0, "Pool must allow at least one connection."
+
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping = ping
+        self.ping_idle = ping_idle
+
+        # (connection, time it was returned) pairs
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._lock = threading.Condition()
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+        # the pool stays usable if the database is down at start up, missing
+        # connections are opened on demand by getconn.
+        try:
+            for _ in range(minconn):
+                self._idle.append((self._open(), monotonic()))
+                self._size += 1
+        except Exception as e:
+            logger.error(e)
+
+
+    def _open(self):
+        conn = self._connect()
+        if conn is None:
+            raise Exception("ConnectionError: could not open a connection to the database.")
+        return conn
+
+
+    def _is_healthy(self, conn, ping):
+        if conn.closed: return False
+
+        status = conn.get_transaction_status()
+        if status == TRANSACTION_STATUS_UNKNOWN: return False
+
+        try:
+            if status != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if ping:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1;")
+                conn.rollback()
+        except (OperationalError, InterfaceError):
+            return False
+        return True
+
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+    def getconn(self):
+        """Take a healthy connection from the pool, opening a new one if needed."""
+        if self._pid != os.getpid(): self.after_fork()
+
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise Exception("PoolError: connection pool is closed.")
+
+                if self._idle:
+                    conn, returned = self._idle.pop()
+                    break
+
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn = None
+                    break
+
+                if not self._lock.wait(self.timeout):
+                    raise Exception("PoolError: timed out waiting for a free connection.")
+
+        if conn is not None:
+            ping = self.ping or (self.ping_idle is not None and monotonic() - returned > self.ping_idle)
+            if self._is_healthy(conn, ping): return conn
+
+        # either the pool had room to grow or the idle connection was stale,
+        # in both cases a fresh connection takes the slot.
+        if conn is not None:
+            logger.warning("Discarding broken pooled connection and reconnecting.")
+            self._discard(conn)
+
+        try:
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool. Broken or aborted connections are closed."""
+        # borrowed before a fork, returned in the child: it belongs to the parent
+        if self._pid != os.getpid():
+            _orphan(conn)
+            return
+
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except (OperationalError, InterfaceError):
+                discard = True
+
+        discard = discard or conn.closed
+
+        with self._lock:
+            if discard or self._closed or len(self._idle) >= self.maxconn:
+                self._size -= 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, monotonic()))
+            self._lock.notify()
+
+
+    @contextmanager
+    def connection(self, pinned=True):
+        """
+        Borrow this thread's connection for the duration of the block. Errors
+        raised inside the block roll back the open transaction and, if they came
+        from the connection itself, drop it from the pool.
+
+        pinned => if False, borrow a connection of its own instead of the one
+        shared by the thread, e.g. for a server-side cursor which must survive
+        commits made by other queries while it is open.
+        """
+        if self._pid != os.getpid(): self.after_fork()
+
+        local = self._local
+        if pinned and getattr(local, "conn", None) is not None:
+            local.depth += 1
+            try:
+                yield local.conn
+            finally:
+                local.depth -= 1
+            return
+
+        conn = self.getconn()
+        if pinned: local.conn, local.depth = conn, 1
+
+        discard = False
+        try:
+            yield conn
+        except (OperationalError, InterfaceError):
+            discard = True
+            raise
+        finally:
+            if pinned: local.conn, local.depth = None, 0
+            self.putconn(conn, discard=discard)
+
+
+    def after_fork(self):
+        """
+        Start over in a child process: forget the inherited connections without
+        closing them (closing would end the parent's sessions too), and replace
+        the locks, which another parent thread may have held at fork time.
+        Connections are then opened on demand, as the child needs them.
+        """
+        inherited = [conn for conn, _ in self._idle]
+        if getattr(self._local, "conn", None) is not None: inherited.append(self._local.conn)
+        for conn in inherited: _orphan(conn)
+
+        self._idle = deque()
+        self._size = 0
+        self._lock = threading.Condition()
+        self._local = threading.local()
+        self._pid = os.getpid()
+        logger.debug("Connection pool reset after fork, %s connections orphaned.", len(inherited))
+
+
+    def pinned(self):
+        """The connection this thread is borrowing, or None."""
+        return getattr(self._local, "conn", None)
+
+
+    def in_use(self):
+        with self._lock:
+            return self._size - len(self._idle)
+
+
+    def closeall(self):
+        # in a child, closing the inherited connections would close the parent's
+        if self._pid != os.getpid(): self.after_fork()
+
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+                self._size -= 1
+            self._lock.notify_all()
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "minconn": self.minconn,
+                "maxconn": self.maxconn
+            }
+
+
+def _orphan(conn):
+    """
+    Drop a connection inherited from the parent process. Its socket descriptor
+    is pointed at /dev/null first: when the object is garbage collected, libpq
+    says goodbye to /dev/null instead of to the parent's server session.
+    """
+    try:
+        devnull = os.open(os.devnull, os.O_RDWR)
+        try:
+            os.dup2(devnull, conn.fileno())
+        finally:
+            os.close(devnull)
+    except Exception as e:
+        logger.debug("Could not detach an inherited connection: %s", e)
+
+
+class ReplicaSet:
+    """
+    One ConnectionPool per read replica, and the policy choosing between them.
+
+    strategy => "round_robin" takes the replicas in turn, "least_connections"
+    takes the replica with the fewest connections in use.
+
+    read_your_writes => seconds after a commit during which the same thread or
+    task keeps reading from the primary, so it sees its own writes even if the
+    replicas lag behind. 0 turns it off.
+    """
+
+    STRATEGIES = ("round_robin", "least_connections")
+
+    def __init__(self, pools, strategy="round_robin", read_your_writes=0.0):
+        assert len(pools) > 0, "A replica set needs at least one pool."
+        assert strategy in ReplicaSet.STRATEGIES, f"Replica strategy must be one of {ReplicaSet.STRATEGIES}."
+
+        self.pools = pools
+        self.strategy = strategy
+        self.read_your_writes = read_your_writes
+        self._turn = count()
+
+
+    def choose(self):
+        if len(self.pools) == 1: return self.pools[0]
+        if self.strategy == "round_robin":
+            return self.pools[next(self._turn) % len(self.pools)]
+        return min(self.pools, key=lambda pool: pool.in_use())
+
+
+    def connection(self, pinned=True):
+        # nested reads stay on the replica this thread is already reading from
+        if pinned:
+            for pool in self.pools:
+                if pool.pinned() is not None: return pool.connection()
+        return self.choose().connection(pinned=pinned)
+
+
+    def after_fork(self):
+        for pool in self.pools:
+            pool.after_fork()
+
+
+    def closeall(self):
+        for pool in self.pools:
+            pool.closeall()
+
+
+    def stats(self):
+        return [pool.stats() for pool in self.pools]
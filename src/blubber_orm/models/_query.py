@@ -0,0 +1,211 @@
+from ._columnar import fetch_columns
+
+# lookup suffix => SQL comparison, "%s" stands for the parameter
+OPERATORS = {
+    "eq": "{} = %s",
+    "ne": "{} <> %s",
+    "lt": "{} < %s",
+    "lte": "{} <= %s",
+    "gt": "{} > %s",
+    "gte": "{} >= %s",
+    "in": "{} = ANY(%s)",
+    "notin": "NOT ({} = ANY(%s))",
+    "like": "{} LIKE %s",
+    "ilike": "{} ILIKE %s",
+    "isnull": None,
+}
+
+AGGREGATES = ["count", "sum", "min", "max", "avg"]
+
+
+class Query:
+    """
+    A lazy, chainable SELECT on one model. Nothing is sent to the database until
+    the query is iterated (or `all`, `first`, `count`... is called):
+
+        User.query().where(dt_joined__gte=since, id__in=ids).order_by("-dt_joined").limit(50)
+
+    `where` takes `column__operator=value` lookups, ANDed together; a bare
+    column means equality. Operators are eq, ne, lt, lte, gt, gte, in, notin,
+    like, ilike and isnull (value True/False). Every column is checked against
+    the table's attributes, and values are always sent as query parameters.
+
+    Each method returns a new Query, so partial queries can be shared safely.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._conds = []
+        self._data = ()
+        self._order = []
+        self._limit = None
+        self._offset = None
+
+
+    def _copy(self):
+        query = Query(self.model)
+        query._conds = list(self._conds)
+        query._data = self._data
+        query._order = list(self._order)
+        query._limit = self._limit
+        query._offset = self._offset
+        return query
+
+
+    def _verify(self, columns):
+        if len(columns) == 0: return
+        assert self.model.verify_attributes(list(columns)), "Error: invalid column name."
+
+
+    def where(self, **lookups):
+        query = self._copy()
+
+        columns = []
+        for lookup, value in lookups.items():
+            column, _, operator = lookup.partition("__")
+            if operator == "": operator = "eq"
+            assert operator in OPERATORS, f"Error: unknown operator '{operator}'."
+            columns.append(column)
+
+            if operator == "isnull":
+                query._conds.append(f"{column} IS NULL" if value else f"{column} IS NOT NULL")
+                continue
+
+            if operator in ["in", "notin"]: value = list(value)
+
+            query._conds.append(OPERATORS[operator].format(column))
+            query._data += (value, )
+
+        self._verify(columns)
+        return query
+
+
+    def order_by(self, *columns):
+        """Sort by the columns in turn, prefix a column with "-" for descending."""
+        query = self._copy()
+        self._verify([column.lstrip("-") for column in columns])
+
+        for column in columns:
+            direction = "DESC" if column.startswith("-") else "ASC"
+            query._order.append(f"{column.lstrip('-')} {direction}")
+        return query
+
+
+    def limit(self, limit):
+        assert isinstance(limit, int) and limit >= 0, "Limit must be a non-negative integer."
+        query = self._copy()
+        query._limit = limit
+        return query
+
+
+    def offset(self, offset):
+        assert isinstance(offset, int) and offset >= 0, "Offset must be a non-negative integer."
+        query = self._copy()
+        query._offset = offset
+        return query
+
+
+    def _where_sql(self):
+        if len(self._conds) == 0: return ""
+        return " WHERE " + " AND ".join(self._conds)
+
+
+    def compile(self, select="*"):
+        """Returns the SQL and its parameters, as they would be executed."""
+        SQL = f"SELECT {select} FROM {self.model.table_name}{self._where_sql()}"
+        data = self._data
+
+        if self._order: SQL += " ORDER BY " + ", ".join(self._order)
+        if self._limit is not None:
+            SQL += " LIMIT %s"
+            data += (self._limit, )
+        if self._offset is not None:
+            SQL += " OFFSET %s"
+            data += (self._offset, )
+
+        return SQL + ";", data
+
+
+    def all(self, as_=None):
+        """Run the query. `as_` returns columns instead of instances, see get_all."""
+        SQL, data = self.compile()
+
+        with self.model.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                self.model._execute(cursor, "query", SQL, data)
+                if as_ is not None: return fetch_columns(cursor, as_)
+
+                results = cursor.fetchall()
+
+                build = self.model._row_factory(cursor)
+                _instances = [build(result) for result in results]
+        return _instances
+
+
+    def first(self):
+        _instances = self.limit(1).all()
+        if len(_instances) == 0: return None
+        return _instances[0]
+
+
+    def _from_rows(self, select):
+        """
+        Compile `SELECT {select}` over the rows this query matches. Ordering is
+        dropped, unless a limit or offset makes it decide which rows match.
+        """
+        if self._limit is None and self._offset is None:
+            query = self._copy()
+            query._order = []
+            return query.compile(select=select)
+
+        SQL, data = self.compile()
+        return f"SELECT {select} FROM ({SQL.rstrip(';')}) AS _rows;", data
+
+
+    def _fetch(self, operation, SQL, data):
+        with self.model.db.connection(readonly=True) as conn:
+            with conn.cursor() as cursor:
+                self.model._execute(cursor, operation, SQL, data)
+                results = cursor.fetchall()
+        return results
+
+
+    def count(self):
+        SQL, data = self._from_rows("COUNT(*)")
+        (count, ), = self._fetch("count", SQL, data)
+        return count
+
+
+    def exists(self):
+        SQL, data = self.limit(1)._from_rows("1")
+        (exists, ), = self._fetch("exists", f"SELECT EXISTS ({SQL.rstrip(';')});", data)
+        return exists
+
+
+    def aggregate(self, func, column, group_by=None):
+        assert func in AGGREGATES, f"Error: unknown aggregate '{func}'."
+
+        if group_by is None: group_by = []
+        elif isinstance(group_by, str): group_by = [group_by]
+        self._verify([column] + group_by)
+
+        select = ", ".join(group_by + [f"{func.upper()}({column})"])
+        SQL, data = self._from_rows(select)
+
+        if len(group_by) == 0:
+            (value, ), = self._fetch(func, SQL, data)
+            return value
+
+        SQL = SQL.rstrip(";") + f" GROUP BY {', '.join(group_by)};"
+        results = self._fetch(func, SQL, data)
+
+        if len(group_by) == 1: return {result[0]: result[1] for result in results}
+        return {tuple(result[:-1]): result[-1] for result in results}
+
+
+    def __iter__(self): return iter(self.all())
+
+
+    def __repr__(self):
+        SQL, data = self.compile()
+        return f"<Blubber Query: {SQL} {data}>"
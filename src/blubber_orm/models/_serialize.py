@@ -0,0 +1,125 @@
+import json
+
+from functools import lru_cache
+from datetime import datetime, date, time
+
+# Postgres type OIDs (cursor.description type_code) of the temporal columns
+TIMESTAMP_TYPES = {1114, 1184}
+DATE_TYPES = {1082}
+TIME_TYPES = {1083}
+TIMETZ_TYPES = {1266}
+
+_encoder = json.JSONEncoder(default=str, separators=(",", ":"))
+
+
+# the typed converters check the exact type first: a model's __init__ may
+# store something other than the column value, e.g. dt.isoformat()
+def _timestamp(value):
+    if type(value) is datetime: return datetime.timestamp(value)
+    return _convert(value)
+
+
+def _date(value):
+    if type(value) is date: return _date_timestamp(value)
+    return _convert(value)
+
+
+# dates repeat a lot across rows, and converting one goes through mktime
+@lru_cache(maxsize=4096)
+def _date_timestamp(value):
+    return datetime.combine(value, time()).timestamp()
+
+
+def _time(value):
+    # same text as strftime("%H:%M:%S.%f"), without parsing the format
+    if type(value) is time and value.tzinfo is None: return value.isoformat(timespec="microseconds")
+    return _convert(value)
+
+
+def _timetz(value):
+    if type(value) is time: return value.strftime("%H:%M:%S.%f")
+    return _convert(value)
+
+
+def _convert(value):
+    """For attributes of unknown type: the checks Models.to_dict always made."""
+    if isinstance(value, datetime): return datetime.timestamp(value)
+    if isinstance(value, date): return _date_timestamp(value)
+    if isinstance(value, time): return value.strftime("%H:%M:%S.%f")
+    return value
+
+
+def remember_types(model, types):
+    """Record the column types of a model, as {column: type OID}."""
+    if model.__dict__.get("_column_types") is not None: return
+    setattr(model, "_column_types", dict(types))
+    # serializers compiled before the types were known convert every value
+    setattr(model, "_serializers", {})
+
+
+def serializer_for(model, keys):
+    """
+    A function turning an instance's attribute dict into its serializable dict,
+    compiled once per model and attribute layout.
+
+    Sensitive attributes are left out of the generated code, leading
+    underscores are stripped from the keys, and only date and time columns get
+    a conversion; every other column is copied as is. Attributes which don't
+    match a column of known type are converted with the old isinstance checks.
+    """
+    serializers = model.__dict__.get("_serializers")
+    if serializers is None:
+        serializers = {}
+        setattr(model, "_serializers", serializers)
+
+    serialize = serializers.get(keys)
+    if serialize is None:
+        serialize = _compile(model, keys)
+        serializers[keys] = serialize
+    return serialize
+
+
+def _compile(model, keys):
+    sensitive = set(model.sensitive_attributes or [])
+    types = model.__dict__.get("_column_types") or {}
+
+    namespace = {"_timestamp": _timestamp, "_date": _date, "_time": _time, "_timetz": _timetz, "_convert": _convert}
+    items = []
+    for key in keys:
+        name = key[1:] if key[0] == "_" else key
+        if name in sensitive: continue
+
+        type_code = types.get(name, types.get(key))
+        if type_code is None: value = f"_convert(state[{key!r}])"
+        elif type_code in TIMESTAMP_TYPES: value = f"_timestamp(state[{key!r}])"
+        elif type_code in DATE_TYPES: value = f"_date(state[{key!r}])"
+        elif type_code in TIME_TYPES: value = f"_time(state[{key!r}])"
+        elif type_code in TIMETZ_TYPES: value = f"_timetz(state[{key!r}])"
+        else: value = f"state[{key!r}]"
+
+        items.append(f"{name!r}: {value}")
+
+    exec(f"def serialize(state): return {{{', '.join(items)}}}", namespace)
+    return namespace["serialize"]
+
+
+def dump_json_many(instances, chunk_size=500):
+    """
+    Encode instances as one JSON array, yielded in chunks of `chunk_size`
+    objects. Only one chunk is held in memory at a time, so `instances` can be
+    a generator such as Models.iter_all().
+    """
+    encode = _encoder.encode
+
+    yield "["
+    chunk = []
+    first = True
+    for instance in instances:
+        chunk.append(encode(instance.to_dict()))
+        if len(chunk) == chunk_size:
+            yield ("" if first else ",") + ",".join(chunk)
+            chunk = []
+            first = False
+
+    if chunk: yield ("" if first else ",") + ",".join(chunk)
+    yield "]"
@@ -0,0 +1,202 @@
+import logging
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from ._utils import format_query_data
+
+logger = logging.getLogger('blubber-orm')
+
+# the Session open in this context, set inside Blubber.session()
+_session = ContextVar("blubber_session", default=None)
+
+# table name => names of the tables its foreign keys reference
+_parents = {}
+
+
+class Session:
+    """
+    A unit of work on one connection and one transaction:
+
+        with blubber.session() as session:
+            session.insert(Order, {"id": 1, "user_id": 7})
+            session.insert(OrderItem, {"order_id": 1, "item_id": 3})
+            session.set(User, {"id": 7}, {"dt_last_order": now})
+            session.delete(Cart, {"user_id": 7})
+
+    Queued writes are sent when the block exits (or on `flush`), batched per
+    table: all inserts, then updates, then deletes. Inserts run parents first
+    and deletes children first, following the foreign keys between the tables.
+    The block commits once on success and rolls everything back on error.
+
+    Models calls made inside the block (e.g. Models.get, or Models.insert for
+    a generated primary key) run immediately in the same transaction, but see
+    queued writes only after `flush`.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._inserts = []
+        self._updates = {}
+        self._deletes = []
+        self._savepoints = 0
+        self._cached = set()
+
+
+    def insert(self, model, attributes):
+        assert isinstance(attributes, dict)
+
+        # a row deleted earlier in the session and inserted again: deletes run
+        # last, so send the delete before queueing the insert
+        if all(attributes.get(pkey) is not None for pkey in model.table_primaries):
+            key = format_query_data(model.table_primaries, attributes)
+            if any(_model is model and format_query_data(model.table_primaries, pkeys) == key for _model, pkeys in self._deletes):
+                self.flush()
+
+        self._inserts.append((model, dict(attributes)))
+
+
+    def set(self, model, pkeys, changes):
+        assert isinstance(pkeys, dict) and isinstance(changes, dict)
+
+        # later changes to the same row are merged into one update
+        key = (model, format_query_data(model.table_primaries, pkeys))
+        if key not in self._updates: self._updates[key] = (pkeys, {})
+        self._updates[key][1].update(changes)
+
+
+    def delete(self, model, pkeys):
+        assert isinstance(pkeys, dict)
+        format_query_data(model.table_primaries, pkeys)
+        self._deletes.append((model, pkeys))
+
+
+    def flush(self):
+        """Send the queued writes, without committing."""
+        inserts, updates, deletes = self._inserts, self._updates, self._deletes
+        self._inserts, self._updates, self._deletes = [], {}, []
+
+        models = [model for model, _ in inserts] + [model for model, _ in updates] + [model for model, _ in deletes]
+        if len(models) == 0: return
+
+        order = self._sort_tables(models)
+
+        # inserts: parents first, one insert_many per table and column set
+        for table in order:
+            groups = {}
+            for model, attributes in inserts:
+                if model.table_name != table: continue
+                groups.setdefault((model, tuple(attributes.keys())), []).append(attributes)
+
+            for (model, _), rows in groups.items():
+                model.insert_many(rows)
+
+        for table in order:
+            groups = {}
+            for (model, _), (pkeys, changes) in updates.items():
+                if model.table_name != table: continue
+                groups.setdefault(model, []).append((pkeys, changes))
+
+            for model, _updates in groups.items():
+                model.set_many(_updates)
+
+        # deletes: children first
+        for table in reversed(order):
+            groups = {}
+            for model, pkeys in deletes:
+                if model.table_name != table: continue
+                groups.setdefault(model, []).append(pkeys)
+
+            for model, pkeys_list in groups.items():
+                model.delete_many(pkeys_list)
+
+
+    @contextmanager
+    def savepoint(self):
+        """
+        A nested transaction: if the block raises, only the writes made inside
+        it are undone, and the error is raised on to the caller.
+        """
+        self.flush()
+
+        self._savepoints += 1
+        name = f"blubber_savepoint_{self._savepoints}"
+
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"SAVEPOINT {name};")
+
+        try:
+            yield self
+            self.flush()
+        except Exception:
+            self._inserts, self._updates, self._deletes = [], {}, []
+            with self.conn.cursor() as cursor:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {name};")
+            self._discard_cached()
+            raise
+        else:
+            with self.conn.cursor() as cursor:
+                cursor.execute(f"RELEASE SAVEPOINT {name};")
+
+
+    def rollback(self):
+        """Drop the queued writes and undo everything done in the session so far."""
+        self._inserts, self._updates, self._deletes = [], {}, []
+        self.conn.rollback()
+        self._discard_cached()
+
+
+    def touch(self, model, key):
+        """Note a cached row written or read in the session, see Models._cache_put."""
+        self._cached.add((model, key))
+
+
+    def is_touched(self, model, key):
+        return (model, key) in self._cached
+
+
+    def _discard_cached(self):
+        # other threads may have cached these rows as they were before the
+        # session (or savepoint), which has now committed or rolled back
+        for model, key in self._cached:
+            model.cache.invalidate(key)
+
+
+    def _sort_tables(self, models):
+        """Table names ordered so that referenced tables come first."""
+        tables = list(dict.fromkeys(model.table_name for model in models))
+        self._load_parents(tables)
+
+        order = []
+        remaining = list(tables)
+        while remaining:
+            for table in remaining:
+                parents = _parents.get(table, set())
+                if all(parent not in remaining or parent == table for parent in parents):
+                    break
+            else:
+                # a cycle of foreign keys: keep the order the writes were queued in
+                table = remaining[0]
+            remaining.remove(table)
+            order.append(table)
+        return order
+
+
+    def _load_parents(self, tables):
+        missing = [table for table in tables if table not in _parents]
+        if len(missing) == 0: return
+
+        SQL = """
+            SELECT conrelid::regclass::text, confrelid::regclass::text
+            FROM pg_constraint
+            WHERE contype = 'f'
+            AND conrelid::regclass::text = ANY(%s);
+            """
+
+        with self.conn.cursor() as cursor:
+            cursor.execute(SQL, (missing, ))
+            results = cursor.fetchall()
+
+        for table in missing: _parents[table] = set()
+        for table, parent in results: _parents[table].add(parent)
+        logger.debug("Foreign keys loaded for %s: %s", missing, results)
@@ -1,3 +1,7 @@
+import json
+import base64
+
+
 def format_query_statement(required_keys: list, unverified_data: dict) -> str:
     statement = []
     for rkey in required_keys:
@@ -16,3 +20,64 @@ def format_query_data(required_keys: list, unverified_data: dict) -> tuple:
 
     data = tuple(data)
     return data
+
+
+def format_batch_query(required_keys: list, unverified_data: list) -> tuple:
+    """
+    Build one WHERE condition matching every row in a list of primary key dicts.
+    Returns the condition, its data and the key tuples in input order.
+    """
+    keys = []
+    for _unverified_data in unverified_data:
+        assert isinstance(_unverified_data, dict)
+        keys.append(format_query_data(required_keys, _unverified_data))
+
+    unique_keys = list(dict.fromkeys(keys))
+
+    # a list of placeholders rather than `= ANY(%s)` or a VALUES list: a list
+    # of strings would be sent as text[], and VALUES of strings typed as text,
+    # which don't compare with e.g. integer or uuid keys. Each value of an IN
+    # list is cast to the column type, as in `get`.
+    if len(required_keys) == 1:
+        statement = f"{required_keys[0]} IN ({', '.join(['%s'] * len(unique_keys))})"
+    else:
+        cols = ", ".join(required_keys)
+        row = "(" + ", ".join(["%s"] * len(required_keys)) + ")"
+        statement = f"({cols}) IN ({', '.join([row] * len(unique_keys))})"
+    data = tuple(value for key in unique_keys for value in key)
+
+    return statement, data, keys
+
+
+def match_batch_keys(keys: list, fetched: dict) -> list:
+    """
+    The fetched instance (or None) of each key tuple, where `fetched` is keyed
+    by the key of each row. Keys given as text, e.g. "5" for an integer id,
+    match the row whose key has the same text.
+    """
+    by_text = None
+    matched = []
+    for key in keys:
+        _instance = fetched.get(key)
+        if _instance is None:
+            if by_text is None:
+                by_text = {
+                    tuple(str(value) for value in _key): _instance
+                    for _key, _instance in fetched.items() if _instance is not None
+                }
+            _instance = by_text.get(tuple(str(value) for value in key))
+        matched.append(_instance)
+    return matched
+
+
+def encode_page_token(values: list) -> str:
+    """Pack the sort key of the last row on a page into an opaque cursor token."""
+    payload = json.dumps(values, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_page_token(token: str) -> list:
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        raise AssertionError("Invalid page token.")
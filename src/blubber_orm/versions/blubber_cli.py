@@ -1,7 +1,8 @@
 import os
 import argparse
 
-from .models import get_blubber
+from blubber_orm import Models, QueryRecorder, get_blubber
+from blubber_orm.models._advisor import advise, format_report
 
 
 # Input Rules:
@@ -11,20 +12,25 @@ from .models import get_blubber
 
 parser = argparse.ArgumentParser()
 
-parser.add_argument("-f", "--func", help = "Create with 'create' and Destroy with 'destroy'.")
+parser.add_argument("-f", "--func", help = "Create with 'create', Destroy with 'destroy' and report missing indexes with 'advise'.")
 parser.add_argument("-v", "--version", help = "Specify which version of database you are building or destroying.")
+parser.add_argument("-s", "--shapes", help = "For 'advise': the JSON file saved by QueryRecorder.save().")
+parser.add_argument("-t", "--top", type = int, default = 10, help = "For 'advise': how many of the slowest query shapes to explain.")
 
 
 def _create_tables(version):
     try:
         blubber = get_blubber()
 
-        with blubber.conn.cursor() as cursor:
-            cwd = os.getcwd()
-            sql_file_path = os.path.join(cwd, f"v{version}/_create.sql")
+        with blubber.connection() as conn:
+            with conn.cursor() as cursor:
+                cwd = os.getcwd()
+                sql_file_path = os.path.join(cwd, f"v{version}/_create.sql")
 
-            with open(sql_file_path, "r") as sql_file:
-                cursor.execute(sql_file.read())
+                with open(sql_file_path, "r") as sql_file:
+                    cursor.execute(sql_file.read())
+
+            conn.commit()
 
     except FileNotFoundError as no_create_sql_present:
         print(no_create_sql_present)
@@ -36,12 +42,15 @@ def _destroy_tables(version):
     try:
         blubber = get_blubber()
 
-        with blubber.conn.cursor() as cursor:
-            cwd = os.getcwd()
-            sql_file_path = os.path.join(cwd, f"v{version}/_destroy.sql")
+        with blubber.connection() as conn:
+            with conn.cursor() as cursor:
+                cwd = os.getcwd()
+                sql_file_path = os.path.join(cwd, f"v{version}/_destroy.sql")
+
+                with open(sql_file_path, "r") as sql_file:
+                    cursor.execute(sql_file.read())
 
-            with open(sql_file_path, "r") as sql_file:
-                cursor.execute(sql_file.read())
+            conn.commit()
 
     except FileNotFoundError as no_create_sql_present:
         print(no_create_sql_present)
@@ -50,13 +59,25 @@ def _destroy_tables(version):
         print("Successfully destroyed Hubbub database.")
 
 
+def _advise(shapes_path, top):
+    try:
+        recorder = QueryRecorder.load(shapes_path)
+    except FileNotFoundError as no_shapes_present:
+        print(no_shapes_present)
+        return
+
+    # EXPLAIN ANALYZE runs the recorded SELECTs, and everything is rolled back
+    report = advise(recorder.shapes(), Models.db.connection, Models.catalog, top=top)
+    print(format_report(report))
+
 
 if __name__ == "__main__":
     args = parser.parse_args()
 
-    assert args.func in ["create", "destroy"], "Invalid Blubber CLI operation."
+    assert args.func in ["create", "destroy", "advise"], "Invalid Blubber CLI operation."
 
     version = args.version
     
     if args.func == "create": _create_tables(version)
     elif args.func == "destroy": _destroy_tables(version)
+    elif args.func == "advise": _advise(args.shapes, args.top)
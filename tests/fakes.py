@@ -0,0 +1,115 @@
+"""
+A stand-in for psycopg2 connections, for unit tests of the Models queries.
+
+Every statement is recorded, whitespace collapsed, and answered by the test's
+`respond(statement, data)` function with a list of row dicts (or by raising).
+Rows of multi-row INSERTs built by execute_values arrive as `data`, a list of
+the mogrified rows.
+"""
+from collections import namedtuple
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, adapt
+
+from blubber_orm.models._conn import Blubber
+from blubber_orm.models._pool import ConnectionPool
+
+Column = namedtuple("Column", ["name", "type_code"])
+
+
+class FakeCursor:
+
+    def __init__(self, conn, name=None):
+        self.connection = conn
+        self.name = name
+        self.itersize = 2000
+        self.description = None
+        self.rowcount = -1
+        self._results = []
+        self._mogrified = []
+
+    def __enter__(self): return self
+
+    def __exit__(self, *args): pass
+
+    def mogrify(self, template, args):
+        self._mogrified.append(tuple(args))
+        values = tuple(adapt(arg).getquoted() for arg in args)
+        if isinstance(template, bytes): return template % values
+        return (template % tuple(value.decode() for value in values)).encode()
+
+    def execute(self, SQL, data=None):
+        if isinstance(SQL, bytes):
+            SQL, data = SQL.decode(), self._mogrified
+            self._mogrified = []
+
+        statement = " ".join(SQL.split())
+        self.connection.statements.append((statement, data))
+
+        rows = self.connection.database.respond(statement, data) or []
+        names = list(rows[0].keys()) if rows else self.connection.database.columns
+        self.description = [Column(name, 0) for name in names]
+        self._results = [tuple(row[name] for name in names) for row in rows]
+        self.rowcount = len(self._results)
+
+    def fetchone(self):
+        return self._results.pop(0) if self._results else None
+
+    def fetchall(self):
+        results, self._results = self._results, []
+        return results
+
+    def fetchmany(self, size):
+        results, self._results = self._results[:size], self._results[size:]
+        return results
+
+    def __iter__(self):
+        while self._results:
+            yield self._results.pop(0)
+
+
+class FakeConnection:
+
+    encoding = "UTF8"
+
+    def __init__(self, database):
+        self.database = database
+        self.closed = 0
+        self.commits = 0
+        self.rollbacks = 0
+        self.statements = database.statements
+
+    def get_transaction_status(self): return TRANSACTION_STATUS_IDLE
+
+    def cursor(self, name=None): return FakeCursor(self, name=name)
+
+    def commit(self): self.commits += 1
+
+    def rollback(self): self.rollbacks += 1
+
+    def close(self): self.closed = 1
+
+
+class FakeDatabase:
+    """
+    Installs a pool of FakeConnections as Blubber's pool until `close`.
+
+    columns => the column names of empty results.
+    """
+
+    def __init__(self, respond, columns=()):
+        self.respond = respond
+        self.columns = list(columns)
+        self.statements = []
+        self.connections = []
+
+        self._pools = Blubber.pool, Blubber.replicas
+        Blubber.pool = ConnectionPool(self.connect, minconn=0, maxconn=4)
+        Blubber.replicas = None
+
+    def connect(self):
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+
+    def close(self):
+        Blubber.pool, Blubber.replicas = self._pools
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+
+from blubber_orm.models._advisor import QueryRecorder, filter_columns, suggest_index, sequential_scans
+from blubber_orm.models._instrument import QueryEvent
+
+COLUMNS = {"id", "category", "name", "price"}
+
+
+class FakeModel:
+    table_name = "items"
+
+
+def make_event(sql, params, elapsed):
+    event = QueryEvent(FakeModel, "filter", sql, params)
+    event.elapsed = elapsed
+    return event
+
+
+class TestQueryRecorder(unittest.TestCase):
+
+    def test_parameters_do_not_change_the_shape(self):
+        recorder = QueryRecorder()
+        recorder.record(make_event("SELECT * FROM items\n    WHERE category = %s;", (1, ), 0.001))
+        recorder.record(make_event("SELECT * FROM items WHERE category = %s;", (2, ), 0.003))
+        recorder.record(make_event("SELECT * FROM items WHERE name = %s;", ("a", ), 0.001))
+
+        shapes = recorder.shapes()
+        self.assertEqual(len(shapes), 2)
+        self.assertEqual(shapes[0]["count"], 2)
+        self.assertEqual(shapes[0]["params"], (2, ))
+
+
+    def test_batches_of_any_size_are_one_shape(self):
+        recorder = QueryRecorder()
+        recorder.record(make_event("SELECT * FROM items WHERE (id, category) IN ((%s, %s));", (1, 1), 0.001))
+        recorder.record(make_event("SELECT * FROM items WHERE (id, category) IN ((%s, %s), (%s, %s));", (1, 1, 2, 1), 0.002))
+
+        shape, = recorder.shapes()
+        self.assertEqual(shape["count"], 2)
+        # the statement of the slowest run goes with its parameters
+        self.assertEqual(shape["sql"], "SELECT * FROM items WHERE (id, category) IN ((%s, %s), (%s, %s));")
+        self.assertEqual(shape["params"], (1, 1, 2, 1))
+
+
+    def test_write_parameters_are_not_kept(self):
+        recorder = QueryRecorder()
+        recorder.record(make_event("UPDATE items SET password = %s WHERE id = %s;", ("hash", 1), 0.001))
+
+        shape, = recorder.shapes()
+        self.assertEqual(shape["count"], 1)
+        self.assertTrue(shape["params"] is None)
+
+
+    def test_save_and_load(self):
+        recorder = QueryRecorder()
+        recorder.record(make_event("SELECT * FROM items WHERE category = %s;", (1, ), 0.001))
+
+        path = os.path.join(tempfile.mkdtemp(), "shapes.json")
+        recorder.save(path)
+        shapes = QueryRecorder.load(path).shapes()
+        self.assertEqual(shapes[0]["sql"], "SELECT * FROM items WHERE category = %s;")
+        self.assertEqual(shapes[0]["params"], [1])
+
+
+class TestAdvisor(unittest.TestCase):
+
+    def test_filter_columns(self):
+        sql = "SELECT * FROM items WHERE category = %s AND price >= %s AND name ILIKE %s AND id <> %s;"
+        self.assertEqual(filter_columns(sql, COLUMNS), [("category", "eq"), ("price", "range"), ("name", "like")])
+        self.assertEqual(filter_columns("SELECT * FROM items;", COLUMNS), [])
+
+
+    def test_negated_conditions_are_left_out(self):
+        sql = "SELECT * FROM items WHERE NOT (category = ANY(%s)) AND name IS NOT NULL AND id = ANY(%s);"
+        self.assertEqual(filter_columns(sql, COLUMNS), [("id", "eq")])
+
+
+    def test_in_lists_and_row_comparisons(self):
+        self.assertEqual(filter_columns("SELECT * FROM items WHERE (id, category) IN ((%s, %s));", COLUMNS), [("id", "eq"), ("category", "eq")])
+        self.assertEqual(
+            filter_columns("SELECT * FROM items WHERE category = %s AND (price, id) > (%s, %s) ORDER BY price ASC, id ASC LIMIT %s;", None),
+            [("category", "eq"), ("price", "range"), ("id", "range")]
+        )
+
+
+    def test_suggest_index(self):
+        columns = [("price", "range"), ("category", "eq")]
+        self.assertEqual(suggest_index("items", columns, []), ("CREATE INDEX ON items (category, price);", None))
+
+        indexes = [("items_category_price_idx", ("category", "price"), False, "btree", ("int4_ops", "numeric_ops"))]
+        self.assertEqual(suggest_index("items", columns, indexes), (None, "items_category_price_idx"))
+
+
+    def test_pattern_needs_a_trigram_index(self):
+        columns = [("name", "like")]
+        suggestion = ("CREATE INDEX ON items USING GIN (name gin_trgm_ops);", None)
+
+        btree = [("items_name_idx", ("name", ), False, "btree", ("text_ops", ))]
+        self.assertEqual(suggest_index("items", columns, btree), suggestion)
+
+        trigram = [("items_name_trgm_idx", ("name", ), False, "gin", ("gin_trgm_ops", ))]
+        self.assertEqual(suggest_index("items", columns, btree + trigram), (None, "items_name_trgm_idx"))
+
+
+    def test_sequential_scans(self):
+        plan = {
+            "Node Type": "Limit",
+            "Plans": [{"Node Type": "Seq Scan", "Relation Name": "items", "Actual Rows": 5, "Shared Hit Blocks": 3, "Shared Read Blocks": 1}]
+        }
+        scans = sequential_scans(plan)
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(scans[0]["buffers"], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
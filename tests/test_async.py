@@ -0,0 +1,150 @@
+import asyncio
+import unittest
+
+from collections import namedtuple
+from contextlib import asynccontextmanager
+
+from blubber_orm import AsyncModels
+from blubber_orm.models._conn import AsyncBlubber
+from blubber_orm.models._loader import AsyncModelLoader
+
+Column = namedtuple("Column", ["name", "type_code"])
+
+# the rows of the fake "users" table
+USERS = {1: "Pennywise", 2: "Georgie"}
+
+
+class FakeAsyncCursor:
+    """Answers `id IN (...)` lookups from USERS, like a psycopg 3 cursor."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = [Column("id", 23), Column("name", 25)]
+        self.rowcount = -1
+        self._results = []
+
+    async def __aenter__(self): return self
+
+    async def __aexit__(self, *args): pass
+
+    async def execute(self, SQL, data=None):
+        self.conn.queries.append((SQL, data))
+        self._results = [(id, USERS[id]) for id in data if id in USERS]
+        self.rowcount = len(self._results)
+
+    async def fetchall(self): return self._results
+
+
+class FakeAsyncConnection:
+
+    def __init__(self):
+        self.queries = []
+
+    def cursor(self): return FakeAsyncCursor(self)
+
+
+class FakeAsyncPool:
+    """Hands out a new FakeAsyncConnection per checkout, and counts them."""
+
+    def __init__(self):
+        self.checkouts = []
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = FakeAsyncConnection()
+        self.checkouts.append(conn)
+        await asyncio.sleep(0)
+        yield conn
+
+
+class User(AsyncModels):
+    table_name = "users"
+    table_primaries = ["id"]
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.name = attrs["name"]
+
+
+class FakeUsers:
+    """A fake async model whose get_batch records every batch it is asked for."""
+
+    table_primaries = ["id"]
+    batches = []
+
+    @classmethod
+    async def get_batch(cls, pkeys_list):
+        cls.batches.append(pkeys_list)
+        return [USERS.get(pkeys["id"]) for pkeys in pkeys_list]
+
+
+class TestAsyncModelLoader(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        FakeUsers.batches = []
+
+
+    async def test_loads_in_one_tick_are_coalesced(self):
+        loader = AsyncModelLoader(FakeUsers)
+
+        names = await asyncio.gather(*[loader.load({"id": i}) for i in [1, 2, 3, 1]])
+        self.assertEqual(names, ["Pennywise", "Georgie", None, "Pennywise"])
+        self.assertEqual(FakeUsers.batches, [[{"id": 1}, {"id": 2}, {"id": 3}]])
+
+        # loaded rows are answered without a query
+        self.assertEqual(await loader.load({"id": 2}), "Georgie")
+        self.assertEqual(len(FakeUsers.batches), 1)
+
+
+    async def test_failed_batch_fails_every_load(self):
+        class BrokenUsers(FakeUsers):
+            @classmethod
+            async def get_batch(cls, pkeys_list): raise RuntimeError("database is down")
+
+        loader = AsyncModelLoader(BrokenUsers)
+        results = await asyncio.gather(loader.load({"id": 1}), loader.load({"id": 2}), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+
+class TestAsyncBlubber(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self._pool = AsyncBlubber.pool
+        AsyncBlubber.pool = FakeAsyncPool()
+
+
+    def tearDown(self):
+        AsyncBlubber.pool = self._pool
+
+
+    async def test_nested_blocks_reuse_the_task_connection(self):
+        async with AsyncBlubber.connection() as conn:
+            async with AsyncBlubber.connection() as nested_conn:
+                self.assertTrue(nested_conn is conn)
+        self.assertEqual(len(AsyncBlubber.pool.checkouts), 1)
+
+        async with AsyncBlubber.connection() as next_conn:
+            self.assertFalse(next_conn is conn)
+
+
+    async def test_tasks_get_their_own_connection(self):
+        async def borrow():
+            async with AsyncBlubber.connection() as conn:
+                await asyncio.sleep(0)
+                return conn
+
+        first, second = await asyncio.gather(borrow(), borrow())
+        self.assertFalse(first is second)
+
+
+    async def test_gets_inside_batching_are_one_query(self):
+        async with AsyncModels.batching():
+            users = await asyncio.gather(*[User.get({"id": i}) for i in [1, 2, 3]])
+
+        self.assertEqual([user and user.name for user in users], ["Pennywise", "Georgie", None])
+        self.assertEqual(len(AsyncBlubber.pool.checkouts), 1)
+        self.assertEqual(AsyncBlubber.pool.checkouts[0].queries[0][1], (1, 2, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -63,11 +63,29 @@ class TestModels(unittest.TestCase):
             FakeModels.set(pkeys_of_incorrect_type, {"name": "Ronald McDonald"})
 
 
-        FakeModels.set(pkeys_of_correct_type, {"name": "Ronald McDonald Jr."})
-        fake_model = FakeModels.get(pkeys_of_correct_type)
+        fake_model = FakeModels.set(pkeys_of_correct_type, {"name": "Ronald McDonald Jr."})
+        self.assertTrue(fake_model.name == "Ronald McDonald Jr.")
 
+        fake_model = FakeModels.get(pkeys_of_correct_type)
         self.assertTrue(fake_model.name == "Ronald McDonald Jr.")
 
+        # Set returns None when no row has the primary key(s)
+        fake_model = FakeModels.set({"id": -1}, {"name": "Nobody"})
+        self.assertTrue(fake_model is None)
+
+
+    def test_upsert(self):
+        # Upsert inserts new rows and overwrites existing ones, returning the stored row
+
+        fake_model = FakeModels.upsert({"id": 2, "name": "Bozo"})
+        self.assertTrue(fake_model.name == "Bozo")
+
+        fake_model = FakeModels.upsert({"id": 2, "name": "Bozo the Clown"})
+        self.assertTrue(fake_model.name == "Bozo the Clown")
+        self.assertTrue(FakeModels.get({"id": 2}) == fake_model)
+
+        FakeModels.delete({"id": 2})
+
 
     def test_delete(self):
         # Delete a data row then check to make sure it's deleted by calling it back
@@ -99,6 +117,22 @@ class TestModels(unittest.TestCase):
         self.assertTrue(fake_models == [])
 
 
+    def test_paginate(self):
+        #Test keyset pages cover the table once, and the last page has no token
+
+        FakeModels.upsert({"id": 2, "name": "Bozo"})
+
+        fake_models, next_token = FakeModels.paginate(1)
+        self.assertTrue(len(fake_models) == 1)
+        self.assertFalse(next_token is None)
+
+        fake_models_next, next_token = FakeModels.paginate(1, after=next_token)
+        self.assertTrue(fake_models_next[0].id > fake_models[0].id)
+        self.assertTrue(next_token is None)
+
+        FakeModels.delete({"id": 2})
+
+
 if __name__ == '__main__':
 
     with Blubber.conn.cursor() as cursor:
@@ -0,0 +1,125 @@
+import time
+import unittest
+
+from blubber_orm import Models
+from blubber_orm.models._cache import ModelCache, identity_map
+
+from fakes import FakeDatabase
+
+
+class TestModelCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = ModelCache(maxsize=2)
+
+        self.assertTrue(cache.get((1, )) is None)
+        cache.put((1, ), "row 1")
+        self.assertEqual(cache.get((1, )), "row 1")
+
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ModelCache(maxsize=2)
+
+        cache.put((1, ), "row 1")
+        cache.put((2, ), "row 2")
+        cache.get((1, ))
+        cache.put((3, ), "row 3")
+
+        self.assertTrue(cache.get((2, )) is None)
+        self.assertEqual(cache.get((1, )), "row 1")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+    def test_expired_rows_are_misses(self):
+        cache = ModelCache(maxsize=2, ttl=0.01)
+
+        cache.put((1, ), "row 1")
+        time.sleep(0.02)
+        self.assertTrue(cache.get((1, )) is None)
+
+
+    def test_invalidate(self):
+        cache = ModelCache()
+
+        cache.put((1, ), "row 1")
+        cache.invalidate((1, ))
+        self.assertTrue(cache.get((1, )) is None)
+
+
+class TestIdentityMap(unittest.TestCase):
+
+    def test_nested_blocks_share_one_map(self):
+        with identity_map() as outer_map:
+            with identity_map() as inner_map:
+                self.assertTrue(outer_map is inner_map)
+
+
+
+class CachedModel(Models):
+    table_name = "cached"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name"]
+    cache = ModelCache()
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.name = attrs["name"]
+
+
+class TestModelsCache(unittest.TestCase):
+
+    def setUp(self):
+        CachedModel.cache.clear()
+        self.db = FakeDatabase(lambda statement, data: [{"id": 5, "name": "Pennywise"}])
+
+
+    def tearDown(self):
+        self.db.close()
+
+
+    def test_rows_are_cached_under_their_own_key(self):
+        # "5" matches the integer id 5, writes to the row refresh the key (5, )
+        CachedModel.get({"id": "5"})
+        self.assertTrue(CachedModel.cache.get(("5", )) is None)
+        self.assertEqual(CachedModel.cache.get((5, )).name, "Pennywise")
+
+        CachedModel.delete({"id": 5})
+        self.assertTrue(CachedModel.cache.get((5, )) is None)
+
+
+    def test_callers_get_their_own_copy(self):
+        fake = CachedModel.get({"id": 5})
+        fake.name = "Robert"
+
+        cached_fake = CachedModel.get({"id": 5})
+        self.assertFalse(cached_fake is fake)
+        self.assertEqual(cached_fake.name, "Pennywise")
+        self.assertEqual(len(self.db.statements), 1)
+
+        # unsaved changes still tell against the loaded row
+        self.assertEqual(fake._changes(["id", "name"]), ({"id": 5}, {"name": "Robert"}))
+
+
+    def test_slot_models_are_copied(self):
+        SlotModel = Models.define("cached", ["id"], ["id", "name"], name="CachedSlotModel")
+        SlotModel.cache = ModelCache()
+
+        fake = SlotModel.get({"id": 5})
+        fake.name = "Robert"
+        self.assertEqual(SlotModel.get({"id": 5}).name, "Pennywise")
+
+
+    def test_identity_map_keeps_one_copy(self):
+        CachedModel.get({"id": 5})
+
+        with identity_map():
+            fake = CachedModel.get({"id": 5})
+            self.assertTrue(CachedModel.get({"id": 5}) is fake)
+            self.assertFalse(CachedModel.cache.get((5, )) is fake)
+
+
+if __name__ == '__main__':
+    unittest.main()
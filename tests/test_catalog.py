@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+
+from blubber_orm import Models
+from blubber_orm.models._catalog import SchemaCatalog, TableSchema
+
+RAW_TABLE = [
+    "users",
+    [["id", 23], ["name", 25], ["dt_joined", 1114]],
+    [["users_pkey", True, True, ["id"], "btree", ["int4_ops"]], ["users_name_idx", False, False, ["name"], "gin", ["gin_trgm_ops"]]]
+]
+
+
+def fail_to_connect():
+    raise AssertionError("The catalog should not query the database.")
+
+
+class TestSchemaCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self._instance = SchemaCatalog._instance
+        self.path = os.path.join(tempfile.mkdtemp(), "schema.json")
+
+
+    def tearDown(self):
+        SchemaCatalog._instance = self._instance
+        for key in ["BLUBBER_SCHEMA_CACHE", "BLUBBER_SCHEMA_VERSION"]:
+            os.environ.pop(key, None)
+
+
+    def new_catalog(self, version):
+        os.environ["BLUBBER_SCHEMA_CACHE"] = self.path
+        os.environ["BLUBBER_SCHEMA_VERSION"] = version
+        SchemaCatalog._instance = None
+        return SchemaCatalog.get_instance()
+
+
+    def test_table_schema(self):
+        table = TableSchema(*RAW_TABLE)
+
+        self.assertEqual(table.columns, ("id", "name", "dt_joined"))
+        self.assertTrue("name" in table.column_set)
+        self.assertEqual(table.types["dt_joined"], 1114)
+        self.assertEqual(table.primary_keys, ("id", ))
+        self.assertEqual(len(table.indexes), 2)
+        self.assertEqual(table.indexes[1], ("users_name_idx", ("name", ), False, "gin", ("gin_trgm_ops", )))
+
+
+    def test_cache_file_round_trip(self):
+        catalog = self.new_catalog("1")
+        catalog._add([RAW_TABLE])
+        catalog._write_file()
+
+        catalog = self.new_catalog("1")
+        table = catalog.get("users", fail_to_connect)
+        self.assertEqual(table.columns, ("id", "name", "dt_joined"))
+
+
+    def test_cache_file_for_another_version_is_ignored(self):
+        catalog = self.new_catalog("1")
+        catalog._add([RAW_TABLE])
+        catalog._write_file()
+
+        catalog = self.new_catalog("2")
+        with self.assertRaises(AssertionError):
+            catalog.get("users", fail_to_connect)
+
+
+
+class LoadedModel(Models):
+    table_name = "users"
+    table_primaries = ["id"]
+
+
+class DeclaredModel(Models):
+    table_name = "users"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name"]
+
+
+class TestResetSchema(unittest.TestCase):
+
+    def test_models_forget_the_schema(self):
+        # what _get_attributes, verify_attributes and to_dict leave behind
+        LoadedModel.table_attributes = ["id", "name", "dt_joined"]
+        LoadedModel._schema_loaded = True
+        for model in [LoadedModel, DeclaredModel]:
+            model._column_set = frozenset(["id", "name"])
+            model._column_types = {"id": 23}
+            model._serializers = {}
+
+        Models.reset_schema()
+
+        self.assertTrue(LoadedModel.table_attributes is None)
+        self.assertEqual(DeclaredModel.table_attributes, ["id", "name"])
+        for model in [LoadedModel, DeclaredModel]:
+            self.assertFalse("_column_set" in model.__dict__)
+            self.assertFalse("_column_types" in model.__dict__)
+            self.assertFalse("_serializers" in model.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+
+from decimal import Decimal
+from collections import namedtuple
+from datetime import datetime, date, timezone, timedelta
+
+from blubber_orm.models._columnar import fetch_columns
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+Column = namedtuple("Column", ["name", "type_code"])
+
+
+class FakeCursor:
+    """Serves fixed rows through fetchmany, like an executed psycopg2 cursor."""
+
+    def __init__(self, description, rows):
+        self.description = [Column(*column) for column in description]
+        self._rows = list(rows)
+
+    def fetchmany(self, size):
+        results, self._rows = self._rows[:size], self._rows[size:]
+        return results
+
+
+class TestColumns(unittest.TestCase):
+
+    def test_columns_across_batches(self):
+        cursor = FakeCursor([("id", 23), ("name", 25)], [(i, f"item {i}") for i in range(5)])
+        columns = fetch_columns(cursor, batch_size=2)
+
+        self.assertEqual(columns["id"], [0, 1, 2, 3, 4])
+        self.assertEqual(columns["name"][-1], "item 4")
+
+
+    def test_empty_result(self):
+        cursor = FakeCursor([("id", 23), ("name", 25)], [])
+        self.assertEqual(fetch_columns(cursor), {"id": [], "name": []})
+
+
+    def test_invalid_format(self):
+        with self.assertRaises(AssertionError):
+            fetch_columns(FakeCursor([("id", 23)], []), as_="rows")
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestNumpyColumns(unittest.TestCase):
+
+    def fetch(self, type_code, values):
+        return fetch_columns(FakeCursor([("value", type_code)], [(value, ) for value in values]), as_="numpy")["value"]
+
+
+    def test_dtypes(self):
+        self.assertEqual(self.fetch(20, [1, 2]).dtype, numpy.dtype("int64"))
+        self.assertEqual(self.fetch(23, [1, 2]).dtype, numpy.dtype("int32"))
+        self.assertEqual(self.fetch(700, [1.5]).dtype, numpy.dtype("float32"))
+        self.assertEqual(self.fetch(1700, [Decimal("1.25")]).tolist(), [1.25])
+        self.assertEqual(self.fetch(16, [True, False]).dtype, numpy.dtype("bool"))
+        self.assertEqual(self.fetch(1082, [date(2022, 1, 1)]).dtype, numpy.dtype("datetime64[D]"))
+        self.assertEqual(self.fetch(25, ["a", "b"]).dtype, numpy.dtype("object"))
+
+
+    def test_null_fallbacks(self):
+        integers = self.fetch(23, [1, None])
+        self.assertEqual(integers.dtype, numpy.dtype("float64"))
+        self.assertTrue(numpy.isnan(integers[1]))
+
+        booleans = self.fetch(16, [True, None])
+        self.assertEqual(booleans.dtype, numpy.dtype("object"))
+        self.assertEqual(booleans.tolist(), [True, None])
+
+        timestamps = self.fetch(1114, [datetime(2022, 1, 1), None])
+        self.assertTrue(numpy.isnat(timestamps[1]))
+
+
+    def test_timestamps_with_time_zone_are_utc(self):
+        local = datetime(2022, 1, 1, 12, tzinfo=timezone(timedelta(hours=2)))
+        timestamps = self.fetch(1184, [local])
+
+        self.assertEqual(timestamps.dtype, numpy.dtype("datetime64[us]"))
+        self.assertEqual(timestamps[0], numpy.datetime64("2022-01-01T10:00:00"))
+
+
+    def test_arrays_stay_single_objects(self):
+        tags = self.fetch(1009, [["a", "b"], ["c", "d"]])
+
+        self.assertEqual(tags.shape, (2, ))
+        self.assertEqual(tags[0], ["a", "b"])
+
+
+    def test_empty_result(self):
+        self.assertEqual(self.fetch(23, []).dtype, numpy.dtype("int32"))
+        self.assertEqual(len(self.fetch(25, [])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
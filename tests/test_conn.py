@@ -44,26 +44,39 @@ class TestBlubber(unittest.TestCase):
         # Sould return a connection object, defined by psycopg2
 
         test_blubber = Blubber.get_instance()
-        test_conn = test_blubber.conn
 
         # 1. Test the connections ability to execute query.
-        with test_conn.cursor() as cursor:
-            cursor.execute("CREATE TABLE test_connections;")
-            cursor.execute("DROP TABLE test_connections;")
-            test_conn.commit()
+        with test_blubber.connection() as test_conn:
+            with test_conn.cursor() as cursor:
+                cursor.execute("CREATE TABLE test_connections;")
+                cursor.execute("DROP TABLE test_connections;")
+                test_conn.commit()
 
         # TODO: 2. import Connection Class from psycopg2 and test that test_conn is an isntance of it
 
 
+    def test_connection_is_per_thread(self):
+        # Nested blocks in one thread should borrow the same connection.
+
+        test_blubber = Blubber.get_instance()
+
+        with test_blubber.connection() as outer_conn:
+            with test_blubber.connection() as inner_conn:
+                self.assertTrue(outer_conn is inner_conn)
+
+
     def test_close_conn(self):
-        # Should not delete the singleton. Should only NULL the .conn attribute.
+        # Should not delete the singleton. Should only NULL the .pool attribute.
 
         test_blubber = Blubber.get_instance()
-        self.assertFalse(test_blubber.conn is None)
+        # the pool is opened by the first connection, not by get_instance
+        with test_blubber.connection():
+            pass
+        self.assertFalse(test_blubber.pool is None)
 
         test_blubber.close_conn() # should test_blubber
 
-        self.assertTrue(test_blubber.conn is None)
+        self.assertTrue(test_blubber.pool is None)
         self.test_singleton_after_connection()
 
 
@@ -0,0 +1,169 @@
+import io
+import unittest
+
+from datetime import datetime, timezone
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from blubber_orm import Models
+from blubber_orm.models._conn import Blubber
+from blubber_orm.models._pool import ConnectionPool
+from blubber_orm.models._copy import BINARY_SIGNATURE, RowStream, _append
+
+HEADER = BINARY_SIGNATURE + b"\x00\x00\x00\x00" + b"\x00\x00\x00\x00"
+TRAILER = b"\xff\xff"
+
+
+def binary_partition(rows):
+    return io.BytesIO(HEADER + b"".join(rows) + TRAILER)
+
+
+class TestExportMerge(unittest.TestCase):
+
+    def test_binary_partitions_make_one_copy_file(self):
+        partitions = [binary_partition([b"row1"]), binary_partition([b"row2", b"row3"]), binary_partition([b"row4"])]
+
+        target = io.BytesIO()
+        for i, spool in enumerate(partitions):
+            _append(target, spool, "binary", first=(i == 0), last=(i == len(partitions) - 1))
+
+        self.assertEqual(target.getvalue(), HEADER + b"row1row2row3row4" + TRAILER)
+
+
+    def test_header_extension_is_skipped(self):
+        extended = io.BytesIO(BINARY_SIGNATURE + b"\x00\x00\x00\x00" + b"\x00\x00\x00\x03ext" + b"row2" + TRAILER)
+
+        target = io.BytesIO()
+        _append(target, binary_partition([b"row1"]), "binary", first=True, last=False)
+        _append(target, extended, "binary", first=False, last=True)
+
+        self.assertEqual(target.getvalue(), HEADER + b"row1row2" + TRAILER)
+
+
+    def test_csv_to_text_stream(self):
+        target = io.StringIO()
+        _append(target, io.BytesIO("id,name\n1,Pennywise\n".encode()), "csv", first=True, last=False)
+        _append(target, io.BytesIO("2,Ünicode\n".encode()), "csv", first=False, last=True)
+
+        self.assertEqual(target.getvalue(), "id,name\n1,Pennywise\n2,Ünicode\n")
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = -1
+
+    def __enter__(self): return self
+
+    def __exit__(self, *args): pass
+
+    def execute(self, SQL, data=None): self.conn.statements.append(SQL)
+
+    def mogrify(self, SQL, data): return (SQL % data).encode()
+
+    # the exported snapshot, then the bounds of two partitions
+    def fetchone(self): return ("snapshot", )
+
+    def fetchall(self): return [(1, ), (5, )]
+
+    def copy_expert(self, SQL, stream, size=None):
+        self.conn.statements.append(SQL)
+        stream.write(b"1,Pennywise\n")
+        self.rowcount = 1
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = 0
+        self.statements = []
+
+    def get_transaction_status(self): return TRANSACTION_STATUS_IDLE
+
+    def cursor(self): return FakeCursor(self)
+
+    def rollback(self): pass
+
+
+class FakeModel(Models):
+    table_name = "fakes"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name"]
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self._pool = Blubber.pool
+        # a worker waiting for a connection would time out quickly
+        Blubber.pool = ConnectionPool(FakeConnection, minconn=1, maxconn=1, timeout=0.05)
+
+
+    def tearDown(self):
+        Blubber.pool = self._pool
+
+
+    def test_partitions_with_a_pool_of_one_connection(self):
+        target = io.BytesIO()
+        rowcount = FakeModel.export(target, partitions=4, header=False)
+
+        self.assertEqual(rowcount, 1)
+        self.assertEqual(target.getvalue(), b"1,Pennywise\n")
+
+
+    def test_partitions_with_every_connection_taken(self):
+        Blubber.pool = ConnectionPool(FakeConnection, minconn=1, maxconn=2, timeout=0.05)
+
+        # this thread's own connection and the coordinator's fill the pool
+        with Models.db.connection():
+            target = io.BytesIO()
+            rowcount = FakeModel.export(target, partitions=4, header=False)
+
+        self.assertEqual(rowcount, 1)
+        self.assertEqual(target.getvalue(), b"1,Pennywise\n")
+
+
+    def test_partitions_with_free_connections(self):
+        Blubber.pool = ConnectionPool(FakeConnection, minconn=1, maxconn=3, timeout=0.05)
+
+        target = io.BytesIO()
+        rowcount = FakeModel.export(target, partitions=2, header=False)
+
+        self.assertEqual(rowcount, 2)
+        self.assertEqual(target.getvalue(), b"1,Pennywise\n1,Pennywise\n")
+
+
+class TestRowStream(unittest.TestCase):
+
+    def test_rows_as_csv(self):
+        rows = [
+            {"id": 1, "name": 'say "hi", bye', "tags": ["a", None], "flag": True, "dt": datetime(2022, 1, 1, tzinfo=timezone.utc)},
+            {"id": 2, "name": "", "tags": None, "flag": False, "dt": None},
+        ]
+        stream = RowStream(rows, ["id", "name", "tags", "flag", "dt"])
+
+        self.assertEqual(stream.read().decode(), (
+            '1,"say ""hi"", bye","{""a"",NULL}",true,"2022-01-01T00:00:00+00:00"\n'
+            '2,"",,false,\n'
+        ))
+        self.assertEqual(stream.rows, 2)
+
+
+    def test_read_in_chunks(self):
+        rows = [(i, f"name {i}") for i in range(100)]
+        expected = RowStream(rows, ["id", "name"]).read()
+
+        stream = RowStream(rows, ["id", "name"])
+        chunks = []
+        while True:
+            chunk = stream.read(7)
+            if not chunk: break
+            self.assertTrue(len(chunk) <= 7)
+            chunks.append(chunk)
+
+        self.assertEqual(b"".join(chunks), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+# generous, CI machines are slow; a local import takes well under 100ms
+IMPORT_BUDGET_S = 0.5
+
+SCRIPT = """
+import sys, json
+from time import perf_counter
+
+start = perf_counter()
+import blubber_orm
+elapsed = perf_counter() - start
+
+from blubber_orm.models._conn import Blubber
+print(json.dumps({
+    "elapsed": elapsed,
+    "pool": Blubber.pool is not None,
+    "asyncio": "asyncio" in sys.modules
+}))
+"""
+
+
+class TestImport(unittest.TestCase):
+
+    def run_import(self):
+        env = dict(os.environ)
+        for key in ["DATABASE_URL", "BLUBBER_DEBUG", "BLUBBER_SLOW_QUERY_MS", "BLUBBER_SCHEMA_CACHE"]:
+            env.pop(key, None)
+
+        output = subprocess.check_output([sys.executable, "-c", SCRIPT], env=env, stderr=subprocess.STDOUT)
+        return output.decode().strip().splitlines()
+
+
+    def test_import_is_quiet_and_lazy(self):
+        # importing must not connect, read config or print anything
+        lines = self.run_import()
+        self.assertEqual(len(lines), 1, lines)
+
+        result = json.loads(lines[0])
+        self.assertFalse(result["pool"])
+        self.assertFalse(result["asyncio"])
+
+
+    def test_import_time(self):
+        result = json.loads(self.run_import()[-1])
+        self.assertLess(result["elapsed"], IMPORT_BUDGET_S)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+
+import psycopg2.errors
+
+from blubber_orm import Models
+
+from fakes import FakeDatabase
+
+
+class FakeModel(Models):
+    table_name = "fakes"
+    table_primaries = ["id", "version"]
+    table_attributes = ["id", "version", "name"]
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.version = attrs["version"]
+        self.name = attrs["name"]
+
+
+class TestConflictClause(unittest.TestCase):
+
+    def test_fail(self):
+        self.assertEqual(FakeModel._conflict_clause(["id", "version", "name"], "fail"), "")
+
+
+    def test_skip(self):
+        self.assertEqual(
+            FakeModel._conflict_clause(["id", "version", "name"], "skip"),
+            "ON CONFLICT DO NOTHING"
+        )
+
+
+    def test_upsert(self):
+        self.assertEqual(
+            FakeModel._conflict_clause(["id", "version", "name"], "upsert"),
+            "ON CONFLICT (id, version) DO UPDATE SET name = EXCLUDED.name"
+        )
+
+
+    def test_upsert_of_primary_keys_only_returns_the_existing_rows(self):
+        # DO NOTHING would leave the existing rows out of RETURNING
+        self.assertEqual(
+            FakeModel._conflict_clause(["id", "version"], "upsert"),
+            "ON CONFLICT (id, version) DO UPDATE SET id = EXCLUDED.id"
+        )
+
+
+class TestInsertMany(unittest.TestCase):
+
+    def setUp(self):
+        # the rows already in the table
+        self.existing = {(1, 1)}
+        self.db = FakeDatabase(self.respond, columns=["id", "version", "name"])
+
+
+    def tearDown(self):
+        self.db.close()
+
+
+    def respond(self, statement, data):
+        if not statement.startswith("INSERT"): return []
+
+        rows = [{"id": id, "version": version, "name": name} for id, version, name in data]
+        conflicts = [row for row in rows if (row["id"], row["version"]) in self.existing]
+        if conflicts and "ON CONFLICT" not in statement:
+            raise psycopg2.errors.UniqueViolation("duplicate key value violates unique constraint")
+        if "DO NOTHING" in statement:
+            return [row for row in rows if row not in conflicts]
+        return rows
+
+
+    def rows(self, *keys):
+        return [{"id": id, "version": version, "name": f"fake {id}.{version}"} for id, version in keys]
+
+
+    def inserts(self):
+        return [data for statement, data in self.db.statements if statement.startswith("INSERT")]
+
+
+    def test_rows_are_sent_in_pages(self):
+        fakes = FakeModel.insert_many(self.rows((2, 1), (3, 1), (4, 1), (5, 1), (6, 1)), batch_size=2)
+
+        self.assertEqual([len(data) for data in self.inserts()], [2, 2, 1])
+        self.assertEqual([fake.id for fake in fakes], [2, 3, 4, 5, 6])
+
+
+    def test_instances_are_built_from_returning(self):
+        fakes = FakeModel.insert_many(self.rows((2, 1), (3, 1)))
+
+        self.assertEqual([fake.name for fake in fakes], ["fake 2.1", "fake 3.1"])
+        self.assertTrue(all(statement.startswith("INSERT") for statement, data in self.db.statements))
+        self.assertEqual(len(self.db.statements), 1)
+
+
+    def test_fail_rolls_back_and_returns_none(self):
+        fakes = FakeModel.insert_many(self.rows((2, 1), (1, 1)), batch_size=1)
+
+        self.assertIsNone(fakes)
+        self.assertEqual(self.db.connections[0].rollbacks, 1)
+        self.assertEqual(self.db.connections[0].commits, 0)
+
+
+    def test_skip_leaves_out_existing_rows(self):
+        fakes = FakeModel.insert_many(self.rows((1, 1), (2, 1)), on_conflict="skip")
+
+        self.assertEqual([(fake.id, fake.version) for fake in fakes], [(2, 1)])
+        self.assertTrue(self.db.statements[0][0].endswith("ON CONFLICT DO NOTHING RETURNING *;"))
+
+
+    def test_upsert_sends_each_key_once(self):
+        rows = self.rows((2, 1), (3, 1), (2, 1))
+        rows[-1]["name"] = "last"
+        fakes = FakeModel.insert_many(rows, on_conflict="upsert")
+
+        self.assertEqual(self.inserts(), [[(2, 1, "last"), (3, 1, "fake 3.1")]])
+        self.assertEqual([fake.name for fake in fakes], ["last", "fake 3.1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
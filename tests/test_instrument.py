@@ -0,0 +1,75 @@
+import unittest
+
+from blubber_orm.models._instrument import Instrumentation, LatencyHistogram
+
+
+class FakeModel:
+    table_name = "fake"
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        for elapsed_ms in [0.1] * 90 + [30] * 9 + [700]:
+            histogram.record(elapsed_ms)
+
+        self.assertEqual(histogram.percentile(50), 0.5)
+        self.assertEqual(histogram.percentile(90), 0.5)
+        self.assertEqual(histogram.percentile(99), 50)
+        self.assertEqual(histogram.percentile(100), 700)
+
+
+    def test_empty(self):
+        self.assertTrue(LatencyHistogram().percentile(50) is None)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.instrumentation = Instrumentation.get_instance()
+        self.instrumentation.reset()
+        self.events = []
+        self.instrumentation.add_hook(after=self.events.append)
+
+
+    def tearDown(self):
+        self.instrumentation.remove_hook(after=self.events.append)
+        self.instrumentation.reset()
+
+
+    def test_track_records_query(self):
+        with self.instrumentation.track(FakeModel, "get", "SELECT 1;") as event:
+            event.rowcount = 1
+
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.events[0].rowcount, 1)
+        self.assertTrue(self.events[0].elapsed >= 0)
+        self.assertEqual(self.instrumentation.stats()["fake.get"]["count"], 1)
+
+
+    def test_track_records_errors(self):
+        with self.assertRaises(ValueError):
+            with self.instrumentation.track(FakeModel, "get", "SELECT 1;"):
+                raise ValueError("failed")
+
+        self.assertTrue(isinstance(self.events[0].error, ValueError))
+
+
+    def test_failing_hook_does_not_raise(self):
+        def hook(event): raise RuntimeError("broken hook")
+
+        ran = []
+        self.instrumentation.add_hook(before=hook, after=hook)
+        try:
+            with self.instrumentation.track(FakeModel, "get", "SELECT 1;"):
+                ran.append(True)
+        finally:
+            self.instrumentation.remove_hook(before=hook, after=hook)
+
+        self.assertEqual(ran, [True])
+        self.assertEqual(len(self.events), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import types
+import unittest
+
+from blubber_orm import Models
+
+from fakes import FakeDatabase
+
+
+class FakeModel(Models):
+    table_name = "fakes"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name"]
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.name = attrs["name"]
+
+
+# the rows of the fake "fakes" table
+ROWS = [{"id": id, "name": "Pennywise" if id % 2 else "Georgie"} for id in range(1, 6)]
+
+
+def respond(statement, data):
+    if "WHERE name = %s" in statement: return [row for row in ROWS if row["name"] == data[0]]
+    return ROWS
+
+
+class TestIter(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase(respond, columns=["id", "name"])
+
+
+    def tearDown(self):
+        self.db.close()
+
+
+    def test_iter_all_is_lazy(self):
+        fakes = FakeModel.iter_all(itersize=2)
+
+        self.assertTrue(isinstance(fakes, types.GeneratorType))
+        self.assertEqual(self.db.statements, [])
+
+        self.assertEqual([fake.id for fake in fakes], [1, 2, 3, 4, 5])
+        self.assertEqual(self.db.statements, [("SELECT * FROM fakes;", None)])
+
+
+    def test_iter_filter_yields_the_rows_of_filter(self):
+        fakes = list(FakeModel.iter_filter({"name": "Georgie"}))
+
+        self.assertEqual([fake.id for fake in fakes], [2, 4])
+        self.assertEqual([fake.id for fake in FakeModel.filter({"name": "Georgie"})], [2, 4])
+        self.assertEqual(self.db.statements[0], ("SELECT * FROM fakes WHERE name = %s;", ("Georgie", )))
+
+
+    def test_iter_filter_refuses_unknown_columns(self):
+        with self.assertRaises(AssertionError):
+            list(FakeModel.iter_filter({"age": 27}))
+
+
+    def test_scan_runs_on_its_own_connection(self):
+        with Models.db.connection() as conn:
+            fake = next(FakeModel.iter_all())
+            self.assertEqual(fake.id, 1)
+
+        # the pinned connection, and the unpinned one of the named cursor
+        self.assertEqual(len(self.db.connections), 2)
+        self.assertFalse(self.db.connections[1] is conn)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+
+from blubber_orm.models._loader import ModelLoader
+from blubber_orm import Models
+from blubber_orm.models._utils import format_batch_query
+
+from fakes import FakeDatabase
+
+
+class FakeModels:
+    """A fake model whose get_batch records every batch it is asked for."""
+
+    table_primaries = ["id"]
+    batches = []
+
+    @classmethod
+    def get_batch(cls, pkeys_list):
+        cls.batches.append(pkeys_list)
+        return [{"id": pkeys["id"]} if pkeys["id"] > 0 else None for pkeys in pkeys_list]
+
+
+class TestModelLoader(unittest.TestCase):
+
+    def setUp(self):
+        FakeModels.batches = []
+
+
+    def test_loads_are_coalesced(self):
+        loader = ModelLoader(FakeModels)
+
+        results = [loader.load({"id": i}) for i in [1, 2, -1, 1]]
+        self.assertEqual(FakeModels.batches, [])
+
+        self.assertEqual([result.get() for result in results], [{"id": 1}, {"id": 2}, None, {"id": 1}])
+        self.assertEqual(len(FakeModels.batches), 1)
+        self.assertEqual(len(FakeModels.batches[0]), 3)
+
+
+    def test_loaded_rows_are_remembered(self):
+        loader = ModelLoader(FakeModels)
+
+        loader.load_many([{"id": 1}])
+        loader.load_many([{"id": 1}])
+        self.assertEqual(len(FakeModels.batches), 1)
+
+        loader.clear({"id": 1})
+        loader.load_many([{"id": 1}])
+        self.assertEqual(len(FakeModels.batches), 2)
+
+
+class TestFormatBatchQuery(unittest.TestCase):
+
+    def test_single_primary_key(self):
+        conds, data, keys = format_batch_query(["id"], [{"id": 1}, {"id": 2}, {"id": 1}])
+        self.assertEqual(conds, "id IN (%s, %s)")
+        self.assertEqual(data, (1, 2))
+        self.assertEqual(keys, [(1, ), (2, ), (1, )])
+
+
+    def test_composite_primary_key(self):
+        conds, data, keys = format_batch_query(["lat", "lng"], [{"lat": 1, "lng": 2}, {"lat": 3, "lng": 4}])
+        self.assertEqual(conds, "(lat, lng) IN ((%s, %s), (%s, %s))")
+        self.assertEqual(data, (1, 2, 3, 4))
+
+
+
+class User(Models):
+    table_name = "users"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name"]
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.name = attrs["name"]
+
+
+class TestGetBatch(unittest.TestCase):
+
+    def setUp(self):
+        rows = {1: "Pennywise", 2: "Georgie"}
+        # Postgres casts each value of the IN list to the column type
+        respond = lambda statement, data: [{"id": int(id), "name": rows[int(id)]} for id in data if int(id) in rows]
+        self.db = FakeDatabase(respond, columns=["id", "name"])
+
+
+    def tearDown(self):
+        self.db.close()
+
+
+    def test_keys_given_as_text_match_their_rows(self):
+        users = User.get_batch([{"id": "2"}, {"id": 1}, {"id": "3"}])
+
+        self.assertEqual([user and user.name for user in users], ["Georgie", "Pennywise", None])
+        self.assertEqual(self.db.statements[0], ("SELECT * FROM users WHERE id IN (%s, %s, %s);", ("2", 1, "3")))
+
+
+    def test_loader_batches_loads(self):
+        loader = User.loader()
+        users = [loader.load({"id": id}) for id in ["1", "2"]]
+
+        self.assertEqual([user.get().name for user in users], ["Pennywise", "Georgie"])
+        self.assertEqual(len(self.db.statements), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
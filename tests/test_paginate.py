@@ -0,0 +1,122 @@
+import unittest
+
+from blubber_orm import Models
+from blubber_orm.models._utils import encode_page_token
+
+from fakes import FakeDatabase
+
+
+class FakeModel(Models):
+    table_name = "fakes"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name"]
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.name = attrs["name"]
+
+
+# the rows of the fake "fakes" table
+ROWS = [{"id": id, "name": f"fake {id}"} for id in range(1, 6)]
+
+
+def respond(statement, data):
+    """Answers the keyset and offset SELECTs on `id` from ROWS."""
+    rows = sorted(ROWS, key=lambda row: row["id"], reverse="DESC" in statement)
+
+    if "OFFSET" in statement:
+        limit, offset = data
+        return rows[offset:offset + limit]
+
+    if "(id) > (%s)" in statement: rows = [row for row in rows if row["id"] > data[-2]]
+    if "(id) < (%s)" in statement: rows = [row for row in rows if row["id"] < data[-2]]
+    return rows[:data[-1]]
+
+
+class TestPaginate(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase(respond, columns=["id", "name"])
+
+
+    def tearDown(self):
+        self.db.close()
+
+
+    def test_first_page(self):
+        fakes, next_token = FakeModel.paginate(2)
+
+        self.assertEqual([fake.id for fake in fakes], [1, 2])
+        self.assertIsNotNone(next_token)
+        self.assertEqual(self.db.statements[0], ("SELECT * FROM fakes ORDER BY id ASC LIMIT %s;", (3, )))
+
+
+    def test_next_token_seeks_past_the_last_row(self):
+        _, next_token = FakeModel.paginate(2)
+        fakes, next_token = FakeModel.paginate(2, after=next_token)
+
+        self.assertEqual([fake.id for fake in fakes], [3, 4])
+        self.assertEqual(
+            self.db.statements[1],
+            ("SELECT * FROM fakes WHERE (id) > (%s) ORDER BY id ASC LIMIT %s;", (2, 3))
+        )
+
+        fakes, next_token = FakeModel.paginate(2, after=next_token)
+        self.assertEqual([fake.id for fake in fakes], [5])
+        self.assertIsNone(next_token)
+
+
+    def test_descending_order_flips_the_comparison(self):
+        fakes, next_token = FakeModel.paginate(2, order_by="-id")
+        self.assertEqual([fake.id for fake in fakes], [5, 4])
+
+        fakes, _ = FakeModel.paginate(2, after=next_token, order_by="-id")
+        self.assertEqual([fake.id for fake in fakes], [3, 2])
+        self.assertEqual(
+            self.db.statements[1],
+            ("SELECT * FROM fakes WHERE (id) < (%s) ORDER BY id DESC LIMIT %s;", (4, 3))
+        )
+
+
+    def test_filters_and_other_sort_columns(self):
+        FakeModel.paginate(2, after=encode_page_token(["fake 2", 2]), order_by="name", filters={"name": "fake 3"})
+
+        self.assertEqual(
+            self.db.statements[0],
+            (
+                "SELECT * FROM fakes WHERE name = %s AND (name, id) > (%s, %s) ORDER BY name ASC, id ASC LIMIT %s;",
+                ("fake 3", "fake 2", 2, 3)
+            )
+        )
+
+
+    def test_bad_tokens_are_refused(self):
+        with self.assertRaises(AssertionError):
+            FakeModel.paginate(2, after="not a token")
+
+        # a token of another ordering
+        with self.assertRaises(AssertionError):
+            FakeModel.paginate(2, after=encode_page_token([1]), order_by="name")
+
+        self.assertEqual(self.db.statements, [])
+
+
+class TestGetMany(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase(respond, columns=["id", "name"])
+
+
+    def tearDown(self):
+        self.db.close()
+
+
+    def test_page_by_offset(self):
+        fakes = FakeModel.get_many(2, offset=2)
+
+        self.assertEqual([fake.id for fake in fakes], [3, 4])
+        self.assertEqual(self.db.statements[0], ("SELECT * FROM fakes ORDER BY id LIMIT %s OFFSET %s;", (2, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
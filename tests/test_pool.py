@@ -0,0 +1,253 @@
+import os
+import threading
+import unittest
+
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from blubber_orm.models._conn import Blubber
+from blubber_orm.models._pool import ConnectionPool, ReplicaSet
+
+
+class FakeConnection:
+    """A stand-in for a psycopg2 connection which only tracks its own state."""
+
+    def __init__(self):
+        self.closed = 0
+        self.status = TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self): return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def commit(self): pass
+
+    def close(self): self.closed = 1
+
+
+class DroppedConnection(FakeConnection):
+    """A connection the server has closed, which the client doesn't know yet."""
+
+    def cursor(self): raise OperationalError("server closed the connection unexpectedly")
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_min_connections_opened(self):
+        pool = ConnectionPool(FakeConnection, minconn=2, maxconn=4)
+        self.assertEqual(pool.stats()["size"], 2)
+        self.assertEqual(pool.stats()["idle"], 2)
+
+
+    def test_nested_checkout_reuses_connection(self):
+        pool = ConnectionPool(FakeConnection, minconn=0, maxconn=2)
+
+        with pool.connection() as outer_conn:
+            with pool.connection() as inner_conn:
+                self.assertTrue(outer_conn is inner_conn)
+            self.assertEqual(pool.stats()["in_use"], 1)
+
+        self.assertEqual(pool.stats()["in_use"], 0)
+
+
+    def test_threads_get_different_connections(self):
+        pool = ConnectionPool(FakeConnection, minconn=0, maxconn=2)
+        borrowed = []
+        barrier = threading.Barrier(2)
+
+        def borrow():
+            with pool.connection() as conn:
+                borrowed.append(conn)
+                barrier.wait()
+
+        threads = [threading.Thread(target=borrow) for _ in range(2)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        self.assertFalse(borrowed[0] is borrowed[1])
+
+
+    def test_aborted_transaction_is_rolled_back(self):
+        pool = ConnectionPool(FakeConnection, minconn=0, maxconn=1)
+
+        with pool.connection() as conn:
+            conn.status = TRANSACTION_STATUS_INTRANS
+
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertEqual(conn.get_transaction_status(), TRANSACTION_STATUS_IDLE)
+
+
+    def test_closed_connection_is_replaced(self):
+        pool = ConnectionPool(FakeConnection, minconn=1, maxconn=1)
+
+        with pool.connection() as conn:
+            pass
+        conn.close()
+
+        with pool.connection() as new_conn:
+            self.assertFalse(new_conn is conn)
+        self.assertEqual(pool.stats()["size"], 1)
+
+
+    def test_dropped_connection_is_replaced_with_ping(self):
+        connections = iter([DroppedConnection(), FakeConnection()])
+        pool = ConnectionPool(lambda: next(connections), minconn=1, maxconn=1, ping=True)
+
+        with pool.connection() as conn:
+            self.assertFalse(isinstance(conn, DroppedConnection))
+        self.assertEqual(pool.stats()["size"], 1)
+
+
+    def test_idle_connection_is_pinged(self):
+        connections = iter([DroppedConnection(), FakeConnection()])
+        pool = ConnectionPool(lambda: next(connections), minconn=1, maxconn=1, ping_idle=60)
+
+        # returned to the pool a minute ago
+        conn, returned = pool._idle.pop()
+        pool._idle.append((conn, returned - 61))
+
+        with pool.connection() as conn:
+            self.assertFalse(isinstance(conn, DroppedConnection))
+        self.assertEqual(pool.stats()["size"], 1)
+
+
+    def test_recently_used_connection_is_not_pinged(self):
+        pool = ConnectionPool(DroppedConnection, minconn=1, maxconn=1, ping_idle=60)
+
+        with pool.connection() as conn:
+            self.assertTrue(isinstance(conn, DroppedConnection))
+
+
+    def test_ping_setting(self):
+        os.environ["BLUBBER_POOL_PING"] = "1"
+        try:
+            self.assertTrue(Blubber.get_pool_ping())
+            self.assertTrue(Blubber.open_pool(minconn=0, maxconn=1).ping)
+        finally:
+            del os.environ["BLUBBER_POOL_PING"]
+        self.assertFalse(Blubber.get_pool_ping())
+
+
+    def test_timeout_when_exhausted(self):
+        pool = ConnectionPool(FakeConnection, minconn=0, maxconn=1, timeout=0.01)
+
+        with pool.connection():
+            error = []
+            thread = threading.Thread(target=lambda: error.append(self._try_getconn(pool)))
+            thread.start()
+            thread.join()
+
+        self.assertTrue(error[0])
+
+
+    def test_pid_change_orphans_inherited_connections(self):
+        pool = ConnectionPool(FakeConnection, minconn=2, maxconn=4)
+        inherited = [conn for conn, _ in pool._idle]
+        pool._pid = -1
+
+        with pool.connection() as conn:
+            self.assertFalse(conn in inherited)
+            self.assertEqual(pool.stats()["size"], 1)
+
+        # never closed: that would end the parent's sessions
+        self.assertFalse(any(conn.closed for conn in inherited))
+
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+    def test_child_process_opens_its_own_connection(self):
+        pool = ConnectionPool(FakeConnection, minconn=0, maxconn=2)
+        read_end, write_end = os.pipe()
+
+        with pool.connection() as parent_conn:
+            pid = os.fork()
+            if pid == 0:
+                with pool.connection() as child_conn:
+                    os.write(write_end, b"1" if child_conn is not parent_conn else b"0")
+                os._exit(0)
+
+            os.waitpid(pid, 0)
+            self.assertEqual(os.read(read_end, 1), b"1")
+        os.close(read_end)
+        os.close(write_end)
+
+
+    @staticmethod
+    def _try_getconn(pool):
+        try:
+            pool.getconn()
+        except Exception:
+            return True
+        return False
+
+
+class TestReplicaSet(unittest.TestCase):
+
+    def test_round_robin(self):
+        pools = [ConnectionPool(FakeConnection, minconn=0, maxconn=2) for _ in range(3)]
+        replicas = ReplicaSet(pools)
+        self.assertEqual([replicas.choose() for _ in range(4)], pools + pools[:1])
+
+
+    def test_least_connections(self):
+        pools = [ConnectionPool(FakeConnection, minconn=0, maxconn=2) for _ in range(2)]
+        replicas = ReplicaSet(pools, strategy="least_connections")
+
+        with pools[0].connection():
+            self.assertTrue(replicas.choose() is pools[1])
+
+
+    def test_nested_reads_stay_on_one_replica(self):
+        pools = [ConnectionPool(FakeConnection, minconn=0, maxconn=2) for _ in range(2)]
+        replicas = ReplicaSet(pools)
+
+        with replicas.connection() as outer_conn:
+            with replicas.connection() as inner_conn:
+                self.assertTrue(outer_conn is inner_conn)
+
+
+class TestReplicaRouting(unittest.TestCase):
+
+    def setUp(self):
+        self._pools = Blubber.pool, Blubber.replicas
+        self._token = Blubber._last_write.set(None)
+        Blubber.pool = ConnectionPool(FakeConnection, minconn=0, maxconn=2)
+        Blubber.replicas = ReplicaSet([ConnectionPool(FakeConnection, minconn=0, maxconn=2)])
+        self.replica = Blubber.replicas.pools[0]
+
+
+    def tearDown(self):
+        Blubber.pool, Blubber.replicas = self._pools
+        Blubber._last_write.reset(self._token)
+
+
+    def test_reads_go_to_replica(self):
+        with Blubber.connection(readonly=True):
+            self.assertTrue(self.replica.pinned() is not None)
+        with Blubber.connection():
+            self.assertTrue(self.replica.pinned() is None)
+
+
+    def test_reads_in_a_transaction_stay_on_primary(self):
+        with Blubber.connection() as conn:
+            with Blubber.connection(readonly=True) as read_conn:
+                self.assertTrue(read_conn is conn)
+
+
+    def test_read_your_writes(self):
+        Blubber.replicas.read_your_writes = 60
+        with Blubber.connection() as conn:
+            Blubber.commit(conn)
+
+        with Blubber.connection(readonly=True):
+            self.assertTrue(self.replica.pinned() is None)
+
+        Blubber.replicas.read_your_writes = 0
+        with Blubber.connection(readonly=True):
+            self.assertTrue(self.replica.pinned() is not None)
+
+
+if __name__ == '__main__':
+    unittest.main()
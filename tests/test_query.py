@@ -0,0 +1,78 @@
+import unittest
+
+from blubber_orm.models._query import Query
+
+
+class FakeModels:
+    """A fake model with a fixed set of columns, no database needed to compile."""
+
+    table_name = "fake_table"
+    table_attributes = ["id", "name", "dt_created"]
+
+    @classmethod
+    def verify_attributes(cls, query_attributes):
+        return set(query_attributes).issubset(cls.table_attributes)
+
+
+class TestQuery(unittest.TestCase):
+
+    def test_compile_where(self):
+        query = Query(FakeModels).where(id__gte=3, name="Pennywise")
+        SQL, data = query.compile()
+
+        self.assertEqual(SQL, "SELECT * FROM fake_table WHERE id >= %s AND name = %s;")
+        self.assertEqual(data, (3, "Pennywise"))
+
+
+    def test_compile_in_and_isnull(self):
+        query = Query(FakeModels).where(id__in=(1, 2), name__isnull=True)
+        SQL, data = query.compile()
+
+        self.assertEqual(SQL, "SELECT * FROM fake_table WHERE id = ANY(%s) AND name IS NULL;")
+        self.assertEqual(data, ([1, 2], ))
+
+
+    def test_compile_order_limit_offset(self):
+        query = Query(FakeModels).order_by("-dt_created", "id").limit(50).offset(100)
+        SQL, data = query.compile()
+
+        self.assertEqual(SQL, "SELECT * FROM fake_table ORDER BY dt_created DESC, id ASC LIMIT %s OFFSET %s;")
+        self.assertEqual(data, (50, 100))
+
+
+    def test_queries_are_immutable(self):
+        query = Query(FakeModels).where(id=1)
+        query.where(name="The Joker").limit(1)
+
+        self.assertEqual(query.compile(), ("SELECT * FROM fake_table WHERE id = %s;", (1, )))
+
+
+    def test_rejects_unknown_columns_and_operators(self):
+        with self.assertRaises(AssertionError):
+            Query(FakeModels).where(password="hunter2")
+
+        with self.assertRaises(AssertionError):
+            Query(FakeModels).where(id__between=(1, 2))
+
+        with self.assertRaises(AssertionError):
+            Query(FakeModels).order_by("-password")
+
+
+    def test_aggregates_drop_ordering(self):
+        query = Query(FakeModels).where(id__gt=1).order_by("name")
+        SQL, data = query._from_rows("COUNT(*)")
+
+        self.assertEqual(SQL, "SELECT COUNT(*) FROM fake_table WHERE id > %s;")
+        self.assertEqual(data, (1, ))
+
+
+    def test_aggregates_respect_limits(self):
+        query = Query(FakeModels).order_by("name").limit(10)
+        SQL, data = query._from_rows("COUNT(*)")
+
+        self.assertEqual(SQL, "SELECT COUNT(*) FROM (SELECT * FROM fake_table ORDER BY name ASC LIMIT %s) AS _rows;")
+        self.assertEqual(data, (10, ))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+from blubber_orm import Models
+
+
+class FakeModel(Models):
+    table_name = "fakes"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name", "password"]
+    sensitive_attributes = ["password"]
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.name = attrs["name"]
+        self._password = attrs["password"]
+
+
+SlotModel = Models.define("fakes", ["id"], table_attributes=["id", "name", "password"])
+
+
+class TestChangeTracking(unittest.TestCase):
+
+    def setUp(self):
+        self.row = {"id": 1, "name": "Pennywise", "password": "balloon"}
+
+
+    def test_unchanged_instance_has_no_changes(self):
+        fake = FakeModel._new(self.row)
+        self.assertEqual(fake._changes(FakeModel.table_attributes), ({"id": 1}, {}))
+        self.assertFalse(fake.save())
+
+
+    def test_only_changed_columns_are_sent(self):
+        fake = FakeModel._new(self.row)
+        fake.name = "Bob"
+        fake.name = "Robert"
+        fake._password = "balloon"
+
+        self.assertEqual(fake._changes(FakeModel.table_attributes), ({"id": 1}, {"name": "Robert"}))
+
+
+    def test_private_attributes_map_to_columns(self):
+        fake = FakeModel._new(self.row)
+        fake._password = "circus"
+
+        self.assertEqual(fake._changes(FakeModel.table_attributes), ({"id": 1}, {"password": "circus"}))
+
+
+    def test_loaded_row_is_not_part_of_the_state(self):
+        fake = FakeModel._new(self.row)
+
+        self.assertEqual(set(fake.to_dict().keys()), {"id", "name"})
+        self.assertEqual(fake, FakeModel(self.row))
+
+
+    def test_slot_models_track_changes(self):
+        build = SlotModel._compile_row_factory(("id", "name", "password"))
+        fake = build((1, "Pennywise", "balloon"))
+        fake.name = "Robert"
+
+        self.assertEqual(fake._changes(SlotModel.table_attributes), ({"id": 1}, {"name": "Robert"}))
+        self.assertEqual(set(fake._state().keys()), {"id", "name", "password"})
+
+
+class TestDefine(unittest.TestCase):
+
+    def test_columns_clashing_with_models_attributes_are_refused(self):
+        for column in ["count", "cache", "db", "load", "table_name"]:
+            with self.assertRaises(Exception) as context:
+                Models.define("clashes", ["id"], table_attributes=["id", column])
+            self.assertIn(f"column {column} of clashes", str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
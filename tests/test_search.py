@@ -0,0 +1,47 @@
+import unittest
+
+from blubber_orm import Models
+
+
+class Item(Models):
+    table_name = "items"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name", "description"]
+    sensitive_attributes = []
+    search_columns = {"name": ["fts", "trigram"], "description": ["fts"]}
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.name = attrs["name"]
+        self.description = attrs["description"]
+
+
+class TestSearchIndexes(unittest.TestCase):
+
+    def test_one_index_per_column_and_mode(self):
+        names = [name for name, _ in Item.search_indexes()]
+        self.assertEqual(names, ["items_name_fts_idx", "items_name_trgm_idx", "items_description_fts_idx"])
+
+
+    def test_index_expressions_match_search(self):
+        indexes = dict(Item.search_indexes())
+        self.assertTrue("GIN ((to_tsvector('english'::regconfig, name)))" in indexes["items_name_fts_idx"])
+        self.assertTrue("GIN (name gin_trgm_ops)" in indexes["items_name_trgm_idx"])
+
+
+    def test_concurrently(self):
+        for _, SQL in Item.search_indexes(concurrently=True):
+            self.assertTrue(SQL.startswith("CREATE INDEX CONCURRENTLY IF NOT EXISTS"))
+
+
+    def test_invalid_search(self):
+        with self.assertRaises(AssertionError):
+            Item.search("password", "x")
+        with self.assertRaises(AssertionError):
+            Item.search("name", "x", mode="soundex")
+        with self.assertRaises(AssertionError):
+            Item.search("name", "x", limit=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
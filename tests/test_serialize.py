@@ -0,0 +1,90 @@
+import json
+import unittest
+
+from datetime import datetime, date, time, timezone
+
+from blubber_orm import Models
+
+
+class FakeModel(Models):
+    table_name = "fakes"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name", "password", "dt_joined", "birthday", "alarm"]
+    sensitive_attributes = ["password"]
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.name = attrs["name"]
+        self._password = attrs["password"]
+        self.dt_joined = attrs["dt_joined"]
+        self.birthday = attrs["birthday"]
+        self.alarm = attrs["alarm"]
+
+
+class TestSerializer(unittest.TestCase):
+
+    def setUp(self):
+        self.joined = datetime(2022, 1, 1, 12, tzinfo=timezone.utc)
+        self.fake = FakeModel({
+            "id": 1,
+            "name": "Pennywise",
+            "password": "balloon",
+            "dt_joined": self.joined,
+            "birthday": date(1986, 9, 15),
+            "alarm": time(6, 30),
+        })
+        self.expected = {
+            "id": 1,
+            "name": "Pennywise",
+            "dt_joined": self.joined.timestamp(),
+            "birthday": datetime(1986, 9, 15).timestamp(),
+            "alarm": "06:30:00.000000",
+        }
+
+
+    def test_untyped_columns(self):
+        self.assertEqual(self.fake.to_dict(), self.expected)
+
+
+    def test_typed_columns(self):
+        FakeModel._column_types = {"id": 23, "name": 25, "password": 25, "dt_joined": 1184, "birthday": 1082, "alarm": 1083}
+        FakeModel._serializers = {}
+        try:
+            self.assertEqual(self.fake.to_dict(), self.expected)
+        finally:
+            del FakeModel._column_types
+            del FakeModel._serializers
+
+
+    def test_typed_columns_holding_other_values(self):
+        # an __init__ which stores something other than the database value
+        FakeModel._column_types = {"dt_joined": 1184, "birthday": 1082, "alarm": 1083}
+        FakeModel._serializers = {}
+        self.fake.dt_joined = self.joined.isoformat()
+        self.fake.birthday = None
+        self.fake.alarm = datetime(2022, 1, 1, 6, 30)
+        try:
+            result = self.fake.to_dict()
+        finally:
+            del FakeModel._column_types
+            del FakeModel._serializers
+
+        self.assertEqual(result["dt_joined"], self.joined.isoformat())
+        self.assertTrue(result["birthday"] is None)
+        self.assertEqual(result["alarm"], datetime(2022, 1, 1, 6, 30).timestamp())
+
+
+    def test_not_serializable(self):
+        self.assertEqual(self.fake.to_dict(serializable=False)["_password"], "balloon")
+
+
+    def test_dump_json_many(self):
+        chunks = list(Models.dump_json_many(iter([self.fake] * 5), chunk_size=2))
+
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads("".join(chunks)), [self.expected] * 5)
+        self.assertEqual("".join(Models.dump_json_many([])), "[]")
+
+
+if __name__ == '__main__':
+    unittest.main()
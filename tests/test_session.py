@@ -0,0 +1,148 @@
+import unittest
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from blubber_orm import Models, ModelCache
+from blubber_orm.models import _session
+from blubber_orm.models._conn import Blubber
+from blubber_orm.models._pool import ConnectionPool
+from blubber_orm.models._session import Session
+
+
+calls = []
+
+
+class FakeModel:
+    table_primaries = ["id"]
+    cache = None
+
+    @classmethod
+    def insert_many(cls, rows): calls.append(("insert", cls.table_name, [row["id"] for row in rows]))
+
+    @classmethod
+    def set_many(cls, updates): calls.append(("set", cls.table_name, updates))
+
+    @classmethod
+    def delete_many(cls, pkeys_list): calls.append(("delete", cls.table_name, [pkeys["id"] for pkeys in pkeys_list]))
+
+
+class Parent(FakeModel):
+    table_name = "parents"
+
+
+class Child(FakeModel):
+    table_name = "children"
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        calls.clear()
+        _session._parents.update({"parents": set(), "children": {"parents"}})
+        self.session = Session(conn=None)
+
+
+    def test_inserts_parents_first_and_deletes_children_first(self):
+        self.session.insert(Child, {"id": 1, "parent_id": 1})
+        self.session.insert(Parent, {"id": 1})
+        self.session.delete(Parent, {"id": 2})
+        self.session.delete(Child, {"id": 2})
+        self.session.flush()
+
+        self.assertEqual(calls, [
+            ("insert", "parents", [1]),
+            ("insert", "children", [1]),
+            ("delete", "children", [2]),
+            ("delete", "parents", [2]),
+        ])
+
+
+    def test_writes_are_batched_per_table(self):
+        for i in range(3): self.session.insert(Parent, {"id": i})
+        self.session.flush()
+
+        self.assertEqual(calls, [("insert", "parents", [0, 1, 2])])
+
+
+    def test_updates_to_one_row_are_merged(self):
+        self.session.set(Parent, {"id": 1}, {"name": "a"})
+        self.session.set(Parent, {"id": 1}, {"name": "b", "age": 3})
+        self.session.flush()
+
+        self.assertEqual(calls, [("set", "parents", [({"id": 1}, {"name": "b", "age": 3})])])
+
+
+    def test_flush_empties_the_queue(self):
+        self.session.insert(Parent, {"id": 1})
+        self.session.flush()
+        self.session.flush()
+
+        self.assertEqual(len(calls), 1)
+
+
+class FakeConnection:
+
+    def __init__(self): self.closed = 0
+
+    def get_transaction_status(self): return TRANSACTION_STATUS_IDLE
+
+    def rollback(self): pass
+
+    def commit(self): pass
+
+
+class CachedModel(Models):
+    table_name = "cached"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name"]
+    cache = ModelCache()
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.name = attrs["name"]
+
+
+class TestSessionCache(unittest.TestCase):
+
+    def setUp(self):
+        self._pool = Blubber.pool
+        Blubber.pool = ConnectionPool(FakeConnection, minconn=0, maxconn=2)
+        CachedModel.cache.clear()
+        CachedModel.cache.put((1, ), CachedModel({"id": 1, "name": "committed"}))
+
+
+    def tearDown(self):
+        Blubber.pool = self._pool
+
+
+    def test_rolled_back_write_is_not_cached(self):
+        with self.assertRaises(ValueError):
+            with Blubber.session():
+                # what Models.set does with the row it gets back
+                CachedModel._build({"id": 1, "name": "rolled back"}, refresh=True)
+                self.assertTrue(CachedModel.cache.get((1, )) is None)
+                raise ValueError
+
+        self.assertTrue(CachedModel.cache.get((1, )) is None)
+
+
+    def test_rows_cached_during_the_session_are_dropped_on_commit(self):
+        with Blubber.session():
+            CachedModel._build({"id": 1, "name": "new"}, refresh=True)
+            # another thread reads the row as it was before the session
+            CachedModel.cache.put((1, ), CachedModel({"id": 1, "name": "committed"}))
+            self.assertTrue(CachedModel._lookup((1, )) is None)
+
+        self.assertTrue(CachedModel.cache.get((1, )) is None)
+
+
+    def test_deleted_row_is_dropped_on_commit(self):
+        with Blubber.session():
+            CachedModel._forget((1, ))
+            CachedModel.cache.put((1, ), CachedModel({"id": 1, "name": "committed"}))
+
+        self.assertTrue(CachedModel.cache.get((1, )) is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+from blubber_orm import Models
+
+from fakes import FakeDatabase
+
+
+class FakeModel(Models):
+    table_name = "fakes"
+    table_primaries = ["id"]
+    table_attributes = ["id", "name", "dt_created"]
+
+    def __init__(self, attrs):
+        self.id = attrs["id"]
+        self.name = attrs["name"]
+        self.dt_created = attrs["dt_created"]
+
+
+class TestReturning(unittest.TestCase):
+    """Writes build their instance from RETURNING *, without a follow-up get."""
+
+    def setUp(self):
+        # the rows of the fake "fakes" table, by id
+        self.rows = {1: {"id": 1, "name": "Pennywise", "dt_created": "2022-01-01"}}
+        self.db = FakeDatabase(self.respond, columns=["id", "name", "dt_created"])
+
+
+    def tearDown(self):
+        self.db.close()
+
+
+    def respond(self, statement, data):
+        if statement.startswith("INSERT"):
+            id, name = data
+            # the column default is only known to the database
+            self.rows[id] = {"id": id, "name": name, "dt_created": "2022-02-02"}
+            return [self.rows[id]]
+
+        if statement.startswith("UPDATE"):
+            name, id = data
+            if id not in self.rows: return []
+            self.rows[id]["name"] = name
+            return [self.rows[id]]
+
+        return []
+
+
+    def statements(self):
+        return [statement for statement, data in self.db.statements]
+
+
+    def test_insert(self):
+        fake = FakeModel.insert({"id": 2, "name": "Georgie"})
+
+        self.assertEqual((fake.id, fake.name, fake.dt_created), (2, "Georgie", "2022-02-02"))
+        self.assertEqual(self.statements(), ["INSERT INTO fakes (id, name) VALUES (%s, %s) RETURNING *;"])
+
+
+    def test_set(self):
+        fake = FakeModel.set({"id": 1}, {"name": "Bob Gray"})
+
+        self.assertEqual((fake.id, fake.name, fake.dt_created), (1, "Bob Gray", "2022-01-01"))
+        self.assertEqual(self.statements(), ["UPDATE fakes SET name = %s WHERE id = %s RETURNING *;"])
+
+
+    def test_set_of_a_missing_row(self):
+        self.assertIsNone(FakeModel.set({"id": 3}, {"name": "Bob Gray"}))
+        self.assertEqual(len(self.statements()), 1)
+
+
+    def test_upsert(self):
+        fake = FakeModel.upsert({"id": 1, "name": "Bob Gray"})
+
+        self.assertEqual((fake.id, fake.name, fake.dt_created), (1, "Bob Gray", "2022-02-02"))
+        self.assertEqual(
+            self.statements(),
+            ["INSERT INTO fakes (id, name) VALUES (%s, %s) ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name RETURNING *;"]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()